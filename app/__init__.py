@@ -1,6 +1,13 @@
+import atexit
+
 from flask import Flask
 from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
+from .services.admission import FairWorkerPool
+from .services.job_queue import job_queue
+from .services.outbox import outbox_sender
+from .services.tenant_registry import tenant_registry
+from .services.thread_sweeper import thread_sweeper
 
 
 def create_app():
@@ -13,4 +20,52 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Pick up tenant config changes without a restart
+    tenant_registry.start_watcher()
+    tenant_registry.install_sighup_handler()
+
+    # Expire idle user -> thread mappings in the background
+    thread_sweeper.start()
+
+    # Drain the webhook job queue in the background
+    start_job_workers(app)
+
+    # Send queued replies, with retries, off the request and job threads
+    outbox_sender.start()
+
+    # Don't leave assistant runs going on OpenAI's side when the worker exits
+    from .services.openai_service import run_lifecycle
+    atexit.register(run_lifecycle.cancel_all)
+
     return app
+
+
+def start_job_workers(app):
+    """
+    Start the background workers that turn queued webhook messages into replies.
+    """
+    from .utils.webhook_events import InboundEvent
+    from .utils.whatsapp_utils import (
+        get_business_number_for_phone_number_id,
+        process_conversation,
+        shed_conversation,
+    )
+
+    def handle_jobs(payloads):
+        # One conversation's messages, answered together
+        with app.app_context():
+            process_conversation([InboundEvent.from_dict(payload) for payload in payloads])
+
+    def shed_jobs(payloads):
+        # One busy reply for the whole batch
+        with app.app_context():
+            shed_conversation([InboundEvent.from_dict(payload) for payload in payloads])
+
+    def tenant_of(payload):
+        return get_business_number_for_phone_number_id(payload.get("tenant_id"))
+
+    # Messages are admitted per tenant and scheduled fairly across tenants
+    pool = FairWorkerPool(job_queue, handle_jobs, tenant_of, shed_jobs, size=app.config["JOB_WORKERS"])
+    pool.start()
+    app.extensions["job_workers"] = pool
+    return pool
@@ -0,0 +1,270 @@
+"""
+Asynchronous serving mode for the webhook.
+
+Serves the same /webhook GET/POST contract as the Flask blueprint in
+views.py, but on aiohttp: OpenAI calls run on a non-blocking client, so a
+conversation waiting on the assistant costs a coroutine instead of a
+gunicorn thread. Replies go through the outbox like in the Flask app.
+
+Run with:
+    gunicorn app.async_server:create_async_app --worker-class aiohttp.GunicornWebWorker
+or for local development:
+    python -m app.async_server
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from app.config import configure_logging
+from app.decorators.security import is_signed_by_known_app
+from app.services.admission import AdmissionController
+from app.services.dedupe import message_deduplicator
+from app.services.job_queue import job_queue
+from app.services.metrics import metrics
+from app.services.llm_backends import generate_response_async
+from app.services.openai_service import run_lifecycle
+from app.services.outbox import outbox_sender
+from app.services.tenant_registry import tenant_registry
+from app.services.thread_sweeper import thread_sweeper
+from app.utils.webhook_events import InboundEvent, parse_webhook
+from app.utils.whatsapp_utils import (
+    get_business_number_for_phone_number_id,
+    prepare_conversation,
+    send_reply,
+    shed_conversation,
+)
+
+# Upper bound on conversations processed concurrently by one process
+ASYNC_MAX_CONVERSATIONS = int(os.getenv("ASYNC_MAX_CONVERSATIONS", "1000"))
+JOB_POLL_INTERVAL = 1.0
+
+
+async def webhook_get(request):
+    """Required webhook verification for WhatsApp"""
+    config = request.app["config"]
+    mode = request.query.get("hub.mode")
+    token = request.query.get("hub.verify_token")
+    challenge = request.query.get("hub.challenge")
+    if mode and token:
+        if mode == "subscribe" and token == config["VERIFY_TOKEN"]:
+            logging.info("WEBHOOK_VERIFIED")
+            return web.Response(text=challenge or "")
+        logging.info("VERIFICATION_FAILED")
+        return web.json_response({"status": "error", "message": "Verification failed"}, status=403)
+    logging.info("MISSING_PARAMETER")
+    return web.json_response({"status": "error", "message": "Missing parameters"}, status=400)
+
+
+async def webhook_post(request):
+    """
+    Verify the signature, queue every new message and acknowledge immediately.
+    """
+    config = request.app["config"]
+    raw_body = await request.read()
+    signature = request.headers.get("X-Hub-Signature-256", "")[7:]  # Removing 'sha256='
+    if not is_signed_by_known_app(raw_body, signature, config["APP_SECRET"] or ""):
+        logging.info("Signature verification failed!")
+        return web.json_response({"status": "error", "message": "Invalid signature"}, status=403)
+
+    try:
+        events = parse_webhook(raw_body)
+    except ValueError:
+        logging.error("Failed to decode JSON")
+        return web.json_response({"status": "error", "message": "Invalid JSON provided"}, status=400)
+
+    messages = []
+    for event in events:
+        if event.kind != "message" or event.sender == event.display_number:
+            continue
+        # Meta redelivers webhooks it thinks we missed; drop those up front
+        if not await asyncio.to_thread(message_deduplicator.claim, event.message_id):
+            logging.info(f"Ignoring duplicate delivery of message {event.message_id}")
+            continue
+        messages.append(event)
+
+    if messages:
+        try:
+            await asyncio.to_thread(
+                job_queue.enqueue_many,
+                [event.to_dict() for event in messages],
+                [event.conversation for event in messages],
+            )
+        except Exception:
+            # Let Meta redeliver rather than losing the messages
+            for event in messages:
+                await asyncio.to_thread(message_deduplicator.release, event.message_id)
+            raise
+        request.app["job_wakeup"].set()
+        logging.info(f"Queued {len(messages)} WhatsApp message(s)")
+
+    return web.json_response({"status": "ok"})
+
+
+async def metrics_get(request):
+    return web.json_response(metrics.snapshot())
+
+
+async def process_conversation(events):
+    """Generate and send one reply for a batch of messages from the same user"""
+    business_number, wa_id, name, pending = await asyncio.to_thread(prepare_conversation, events)
+    if not business_number or not pending:
+        return
+
+    message_body = "\n".join(event.text for event in pending)
+    response = await generate_response_async(message_body, wa_id, name, business_number)
+    message_ids = [event.message_id for event in pending]
+    for message_id in message_ids:
+        await asyncio.to_thread(message_deduplicator.record_reply, message_id, response)
+
+    # The outbox senders deliver the reply, with retries, off the event loop
+    await asyncio.to_thread(send_reply, wa_id, response, business_number, message_ids)
+
+
+async def drain_jobs(app):
+    """
+    Claim queued messages and process them as tasks, up to ASYNC_MAX_CONVERSATIONS at once.
+
+    Claimed batches go through the same AdmissionController as the Flask
+    workers: each tenant may have its ADMISSION_QUEUE_PER_TENANT share
+    (scaled by its weight) of batches waiting, batches beyond that get one
+    busy reply, and free slots are handed out in weighted fair order across
+    tenants. A user's batches run one at a time under a per-user lock.
+    """
+    wakeup = app["job_wakeup"]
+    slots = asyncio.Semaphore(ASYNC_MAX_CONVERSATIONS)
+    admission = AdmissionController()
+    admitted = asyncio.Event()
+    user_locks = {}
+    lock_users = Counter()
+    tasks = set()
+
+    def spawn(coroutine):
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def finish(jobs, error=None):
+        for job_id, _, attempts in jobs:
+            if error is None:
+                await asyncio.to_thread(job_queue.complete, job_id)
+            else:
+                await asyncio.to_thread(job_queue.fail, job_id, error, attempts)
+
+    async def answer(events):
+        conversation = events[0].conversation
+        lock = user_locks.setdefault(conversation, asyncio.Lock())
+        lock_users[conversation] += 1
+        try:
+            async with lock:
+                await process_conversation(events)
+        finally:
+            lock_users[conversation] -= 1
+            if not lock_users[conversation]:
+                del lock_users[conversation], user_locks[conversation]
+
+    async def run_jobs(jobs):
+        owned = []
+        try:
+            # A batch that waited past its lease may have been claimed again elsewhere
+            for job in jobs:
+                if await asyncio.to_thread(job_queue.renew, job[0], job[2]):
+                    owned.append(job)
+            if owned:
+                await answer([InboundEvent.from_dict(payload) for _, payload, _ in owned])
+                await finish(owned)
+        except Exception as e:
+            logging.error(f"Error processing jobs {[job[0] for job in owned]}: {str(e)}")
+            await finish(owned, e)
+        finally:
+            slots.release()
+
+    async def shed_jobs(jobs):
+        try:
+            await asyncio.to_thread(shed_conversation, [InboundEvent.from_dict(payload) for _, payload, _ in jobs])
+            await finish(jobs)
+        except Exception as e:
+            logging.error(f"Error shedding jobs {[job[0] for job in jobs]}: {str(e)}")
+            await finish(jobs, e)
+
+    async def dispatch():
+        while True:
+            await slots.acquire()
+            taken = admission.take(timeout=0)
+            while taken is None:
+                admitted.clear()
+                await admitted.wait()
+                taken = admission.take(timeout=0)
+            spawn(run_jobs(taken[1]))
+
+    dispatcher = asyncio.create_task(dispatch())
+    try:
+        while True:
+            try:
+                jobs = await asyncio.to_thread(job_queue.claim)
+            except Exception as e:
+                logging.error(f"Error claiming job: {str(e)}")
+                jobs = None
+
+            if jobs is None:
+                # Other processes may enqueue too, so fall back to polling
+                try:
+                    await asyncio.wait_for(wakeup.wait(), job_queue.wait_timeout(JOB_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                continue
+
+            tenant = await asyncio.to_thread(get_business_number_for_phone_number_id, jobs[0][1].get("tenant_id"))
+            if admission.offer(tenant, jobs):
+                admitted.set()
+                continue
+            logging.warning(f"Tenant {tenant} is over its share, shedding jobs {[job[0] for job in jobs]}")
+            spawn(shed_jobs(jobs))
+    finally:
+        dispatcher.cancel()
+
+
+async def on_startup(app):
+    outbox_sender.start()
+    app["job_wakeup"] = asyncio.Event()
+    app["job_drainer"] = asyncio.create_task(drain_jobs(app))
+
+
+async def on_cleanup(app):
+    app["job_drainer"].cancel()
+    await asyncio.to_thread(outbox_sender.stop)
+    # Don't leave assistant runs going on OpenAI's side
+    await asyncio.to_thread(run_lifecycle.cancel_all)
+
+
+async def create_async_app():
+    load_dotenv()
+    configure_logging()
+
+    app = web.Application()
+    app["config"] = {
+        "APP_SECRET": os.getenv("APP_SECRET"),
+        "VERIFY_TOKEN": os.getenv("VERIFY_TOKEN"),
+    }
+    app.router.add_get("/webhook", webhook_get)
+    app.router.add_post("/webhook", webhook_post)
+    app.router.add_get("/metrics", metrics_get)
+    app.on_startup.append(on_startup)
+
+    # Pick up tenant config changes without a restart
+    tenant_registry.start_watcher()
+    tenant_registry.install_sighup_handler()
+
+    # Expire idle user -> thread mappings in the background
+    thread_sweeper.start()
+
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_async_app(), host="0.0.0.0", port=8000)
@@ -4,15 +4,26 @@ import logging
 import hashlib
 import hmac
 
+from app.services.tenant_registry import tenant_registry
 
-def validate_signature(payload, signature):
+
+def validate_signature(payload, signature, app_secret=None):
     """
-    Validate the incoming payload's signature against our expected signature
+    Validate the incoming payload's signature against our expected signature.
+
+    The payload is the raw request body as bytes; it is hashed as-is so the
+    body is never decoded and re-encoded just for the check. The App Secret
+    defaults to the one configured on the Flask app.
     """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if app_secret is None:
+        app_secret = current_app.config["APP_SECRET"]
+
     # Use the App Secret to hash the payload
     expected_signature = hmac.new(
-        bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
+        bytes(app_secret, "latin-1"),
+        msg=payload,
         digestmod=hashlib.sha256,
     ).hexdigest()
 
@@ -20,6 +31,16 @@ def validate_signature(payload, signature):
     return hmac.compare_digest(expected_signature, signature)
 
 
+def is_signed_by_known_app(payload, signature, app_secret=None):
+    """
+    Check the signature against the main App Secret and any per-tenant App Secrets.
+    """
+    if app_secret is None:
+        app_secret = current_app.config["APP_SECRET"]
+    secrets = ([app_secret] if app_secret else []) + list(tenant_registry.app_secrets())
+    return any(validate_signature(payload, signature, secret) for secret in secrets)
+
+
 def signature_required(f):
     """
     Decorator to ensure that the incoming requests to our webhook are valid and signed with the correct signature.
@@ -30,7 +51,8 @@ def signature_required(f):
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
+        # get_data() caches the body, so the view reuses these same bytes
+        if not is_signed_by_known_app(request.get_data(), signature):
             logging.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
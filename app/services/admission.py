@@ -0,0 +1,179 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+# Messages a tenant may have waiting for a worker before new ones are shed
+ADMISSION_QUEUE_PER_TENANT = int(os.getenv("ADMISSION_QUEUE_PER_TENANT", "20"))
+
+
+def tenant_weight(tenant):
+    """Scheduling weight of a tenant (TENANT_WEIGHT_<number> or "weight" in the tenant config)"""
+    config = tenant_registry.get(tenant)
+    return max(config.weight, 0.01) if config else 1.0
+
+
+class AdmissionController:
+    """
+    Bounded per-tenant queues with weighted fair scheduling across tenants.
+
+    Each tenant gets a queue of ADMISSION_QUEUE_PER_TENANT slots (scaled by its
+    weight). Workers take items using stride scheduling: every tenant has a
+    virtual "pass" that advances by 1/weight per item served, and the
+    non-empty tenant with the lowest pass goes next. A spike on one tenant
+    therefore only fills that tenant's queue, and offers beyond it are refused
+    so the caller can shed load.
+    """
+
+    def __init__(self, queue_size=ADMISSION_QUEUE_PER_TENANT, weight_for=tenant_weight):
+        self.queue_size = queue_size
+        self.weight_for = weight_for
+        self._queues = {}
+        self._passes = {}
+        self._virtual_time = 0.0
+        self._cond = threading.Condition()
+
+    def capacity(self, tenant):
+        return max(1, int(self.queue_size * self.weight_for(tenant)))
+
+    def offer(self, tenant, item):
+        """Queue an item for a tenant. Returns False if the tenant is over its share."""
+        with self._cond:
+            queue = self._queues.get(tenant)
+            if queue is None:
+                queue = self._queues[tenant] = deque()
+            if len(queue) >= self.capacity(tenant):
+                return False
+            if not queue:
+                # A tenant that was idle rejoins at the current virtual time
+                # instead of cashing in the turns it did not use
+                self._passes[tenant] = max(self._passes.get(tenant, 0.0), self._virtual_time)
+            queue.append(item)
+            self._cond.notify()
+            return True
+
+    def take(self, timeout=None):
+        """Return the next (tenant, item) in fair order, or None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(self._has_items, timeout):
+                return None
+            tenant = min(
+                (t for t, q in self._queues.items() if q),
+                key=lambda t: self._passes[t],
+            )
+            item = self._queues[tenant].popleft()
+            self._virtual_time = self._passes[tenant]
+            self._passes[tenant] += 1.0 / self.weight_for(tenant)
+            if not self._queues[tenant]:
+                del self._queues[tenant]
+            return tenant, item
+
+    def _has_items(self):
+        return any(self._queues.values())
+
+    def depths(self):
+        with self._cond:
+            return {tenant: len(queue) for tenant, queue in self._queues.items()}
+
+
+class FairWorkerPool:
+    """
+    Worker pool that drains a JobQueue through an AdmissionController.
+
+    A feeder thread claims jobs, one conversation's batch at a time, and
+    offers each batch to the controller under its tenant; batches refused
+    because the tenant is over its share are handed to on_shed and
+    completed. Worker threads take batches in fair order and hand their
+    payloads to handler. They renew the leases first, so a job that waited in
+    the controller longer than the lease is not run a second time by another
+    process that claimed it again.
+    """
+
+    def __init__(self, queue, handler, tenant_of, on_shed, controller=None, size=4, poll_interval=1.0):
+        self.queue = queue
+        self.handler = handler
+        self.tenant_of = tenant_of
+        self.on_shed = on_shed
+        self.controller = controller or AdmissionController()
+        self.size = size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        threads = [threading.Thread(target=self._feed, name="job-feeder", daemon=True)]
+        for i in range(self.size):
+            threads.append(threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True))
+        for thread in threads:
+            thread.start()
+        self._threads = threads
+        logger.info(f"Started {self.size} job workers with per-tenant admission control")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self.queue._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _feed(self):
+        while not self._stop.is_set():
+            try:
+                jobs = self.queue.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                jobs = None
+
+            if jobs is None:
+                # Other processes may enqueue too, so fall back to polling
+                self.queue.wait(self.poll_interval)
+                continue
+
+            tenant = self.tenant_of(jobs[0][1])
+            if self.controller.offer(tenant, jobs):
+                continue
+
+            logger.warning(f"Tenant {tenant} is over its share, shedding jobs {[job[0] for job in jobs]}")
+            try:
+                self.on_shed([payload for _, payload, _ in jobs])
+                self._complete(jobs)
+            except Exception as e:
+                logger.error(f"Error shedding jobs {[job[0] for job in jobs]}: {str(e)}")
+                self._fail(jobs, e)
+
+    def _complete(self, jobs):
+        for job_id, _, _ in jobs:
+            self.queue.complete(job_id)
+
+    def _fail(self, jobs, error):
+        for job_id, _, attempts in jobs:
+            self.queue.fail(job_id, error, attempts)
+
+    def _work(self):
+        while not self._stop.is_set():
+            taken = self.controller.take(timeout=self.poll_interval)
+            if taken is None:
+                continue
+
+            _, jobs = taken
+            try:
+                owned = [job for job in jobs if self.queue.renew(job[0], job[2])]
+            except sqlite3.Error as e:
+                logger.error(f"Error renewing leases on jobs {[job[0] for job in jobs]}: {str(e)}")
+                continue
+            if len(owned) < len(jobs):
+                logger.warning(f"Leases on {len(jobs) - len(owned)} jobs expired while they waited, leaving them to their new owner")
+            if not owned:
+                continue
+
+            try:
+                self.handler([payload for _, payload, _ in owned])
+                self._complete(owned)
+            except Exception as e:
+                logger.error(f"Error processing jobs {[job[0] for job in owned]}: {str(e)}")
+                self._fail(owned, e)
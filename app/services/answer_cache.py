@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from app.services import cache_invalidation
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds a generated answer is reused for the same question (0 disables the cache)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))
+# Longer messages are conversations rather than FAQ questions and are never cached
+ANSWER_CACHE_MAX_CHARS = int(os.getenv("ANSWER_CACHE_MAX_CHARS", "200"))
+
+# Questions that refer back to the conversation only make sense for one user
+CONTEXT_WORDS = frozenset(
+    "previous earlier before again above last said say told that it this those them".split()
+)
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_question(text):
+    """Lowercase, drop punctuation and collapse whitespace: "Check-in time??" -> "check in time" """
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def _knowledge_key(business_number=None):
+    return f"knowledge:{business_number}" if business_number else "knowledge:*"
+
+
+def invalidation_keys(business_number, assistant_id):
+    # Updating the assistant (instructions, vector store, files) goes through
+    # assistant_cache.invalidate_assistant, which bumps the same key
+    return (f"assistant:{assistant_id}", _knowledge_key(), _knowledge_key(business_number))
+
+
+def invalidate_knowledge(business_number=None):
+    """
+    Drop cached answers in every running process after knowledge changed,
+    for one business or (without a business number) for all of them.
+    """
+    cache_invalidation.bump(_knowledge_key(business_number))
+
+
+def knowledge_version(business_number=None):
+    """Versions of the shared and the business's knowledge; changes after invalidate_knowledge()"""
+    return cache_invalidation.versions((_knowledge_key(), _knowledge_key(business_number)))
+
+
+class AnswerCache:
+    """
+    Per-tenant cache of answers to repeated questions, with single-flight.
+
+    Answers are keyed on (business number, assistant, normalized question) and
+    kept for ttl seconds in an LRU of maxsize entries. Identical questions
+    that arrive while the first one is still being answered wait for that
+    answer instead of starting runs of their own. Each entry records the
+    invalidation versions it was built under, so invalidate_knowledge() and
+    invalidate_assistant() make it stale in every process.
+
+    Callers only pass questions that don't depend on a conversation, and pass
+    an on_shared callback that adds a reused answer to the asking user's
+    conversation.
+    """
+
+    def __init__(self, ttl=ANSWER_CACHE_TTL, maxsize=ANSWER_CACHE_SIZE, max_chars=ANSWER_CACHE_MAX_CHARS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def cacheable_question(self, normalized):
+        return (
+            self.ttl > 0
+            and 0 < len(normalized) <= self.max_chars
+            and CONTEXT_WORDS.isdisjoint(normalized.split())
+        )
+
+    def _begin(self, business_number, assistant_id, question):
+        """
+        Returns ("hit", answer), ("wait", future), ("lead", (key, versions, future)) or ("skip", None).
+        """
+        normalized = normalize_question(question)
+        if not self.cacheable_question(normalized):
+            return "skip", None
+
+        key = (business_number, assistant_id, normalized)
+        versions = cache_invalidation.versions(invalidation_keys(business_number, assistant_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, stored_at, entry_versions = entry
+                if entry_versions == versions and time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    metrics.increment("answer_cache_hits")
+                    return "hit", answer
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            if future is not None:
+                metrics.increment("answer_cache_coalesced")
+                return "wait", future
+
+            future = self._inflight[key] = Future()
+        metrics.increment("answer_cache_misses")
+        return "lead", (key, versions, future)
+
+    def _finish(self, token, answer, cacheable):
+        key, versions, future = token
+        with self._lock:
+            if cacheable:
+                self._entries[key] = (answer, time.monotonic(), versions)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(answer)
+
+    def _fail(self, token, error):
+        key, _, future = token
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_exception(error)
+
+    def get_or_generate(
+        self, business_number, assistant_id, question, generate, cacheable=lambda answer: True, on_shared=None
+    ):
+        """
+        Return the cached answer for a question, or call generate() once for
+        everyone asking it and cache the result if cacheable(answer).
+        on_shared(answer) is called when the answer came from the cache or
+        another caller's generate().
+        """
+        state, value = self._begin(business_number, assistant_id, question)
+        if state == "skip":
+            return generate()
+        if state in ("hit", "wait"):
+            answer = value if state == "hit" else value.result()
+            if on_shared is not None and cacheable(answer):
+                on_shared(answer)
+            return answer
+
+        try:
+            answer = generate()
+        except BaseException as e:
+            self._fail(value, e)
+            raise
+        self._finish(value, answer, cacheable(answer))
+        return answer
+
+    async def get_or_generate_async(
+        self, business_number, assistant_id, question, generate, cacheable=lambda answer: True, on_shared=None
+    ):
+        """
+        Async counterpart of get_or_generate; generate is a coroutine function
+        and on_shared runs on a worker thread.
+        """
+        state, value = await asyncio.to_thread(self._begin, business_number, assistant_id, question)
+        if state == "skip":
+            return await generate()
+        if state in ("hit", "wait"):
+            answer = value if state == "hit" else await asyncio.wrap_future(value)
+            if on_shared is not None and cacheable(answer):
+                await asyncio.to_thread(on_shared, answer)
+            return answer
+
+        try:
+            answer = await generate()
+        except BaseException as e:
+            self._fail(value, e)
+            raise
+        self._finish(value, answer, cacheable(answer))
+        return answer
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Create a singleton instance
+answer_cache = AnswerCache()
@@ -0,0 +1,78 @@
+import logging
+import os
+import threading
+import time
+
+from app.services import cache_invalidation
+
+logger = logging.getLogger(__name__)
+
+ASSISTANT_CACHE_TTL = float(os.getenv("ASSISTANT_CACHE_TTL", "300"))
+
+
+def _invalidation_key(assistant_id):
+    return f"assistant:{assistant_id}"
+
+
+class AssistantMetadataCache:
+    """
+    Process-wide TTL cache of assistant metadata (name, model, instructions).
+
+    Entries older than the TTL are served stale while a background thread
+    refreshes them, so the hot path never waits on assistants.retrieve once an
+    assistant has been seen. Admin scripts that modify an assistant call
+    invalidate_assistant(), which bumps a version in the shared state
+    database and forces every process to fetch it again.
+    """
+
+    def __init__(self, fetch, ttl=ASSISTANT_CACHE_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, assistant_id):
+        version = cache_invalidation.version(_invalidation_key(assistant_id))
+        with self._lock:
+            entry = self._entries.get(assistant_id)
+
+        if entry is None or entry[2] != version:
+            return self._load(assistant_id, version)
+
+        value, fetched_at, _ = entry
+        if time.monotonic() - fetched_at > self.ttl:
+            self._refresh_in_background(assistant_id, version)
+        return value
+
+    def _load(self, assistant_id, version):
+        value = self.fetch(assistant_id)
+        with self._lock:
+            self._entries[assistant_id] = (value, time.monotonic(), version)
+        return value
+
+    def _refresh_in_background(self, assistant_id, version):
+        with self._lock:
+            if assistant_id in self._refreshing:
+                return
+            self._refreshing.add(assistant_id)
+
+        def refresh():
+            try:
+                self._load(assistant_id, version)
+            except Exception as e:
+                logger.warning(f"Could not refresh assistant {assistant_id}, keeping cached copy: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(assistant_id)
+
+        threading.Thread(target=refresh, name="assistant-refresh", daemon=True).start()
+
+
+def invalidate_assistant(assistant_id):
+    """
+    Drop cached metadata for an assistant in every running process.
+
+    Call this after updating an assistant (instructions, tools, files).
+    """
+    cache_invalidation.bump(_invalidation_key(assistant_id))
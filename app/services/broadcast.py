@@ -0,0 +1,397 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import aiohttp
+
+from app.services.graph_client import GRAPH_API_URL
+from app.services.metrics import metrics
+from app.services.outbox import PAIR_LIMIT_CODES, THROUGHPUT_LIMIT_CODES, THROUGHPUT_RETRY_SECONDS, backoff
+from app.services.state_db import STATE_DB_PATH, connect
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+# Cloud API defaults: 80 messages per second per phone number, and business-initiated
+# conversations with 1,000 unique users per rolling 24 hours on the first messaging tier.
+# Override per tenant with "messages_per_second" and "messaging_limit" (0 = unlimited).
+BROADCAST_MESSAGES_PER_SECOND = float(os.getenv("BROADCAST_MESSAGES_PER_SECOND", "80"))
+BROADCAST_MESSAGING_LIMIT = int(os.getenv("BROADCAST_MESSAGING_LIMIT", "1000"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "32"))
+# Sends of a rate-limited message before it is recorded as failed
+BROADCAST_MAX_ATTEMPTS = 3
+QUOTA_WINDOW_SECONDS = 24 * 3600
+REPORT_INTERVAL_SECONDS = 5
+
+
+def read_recipients(path):
+    """
+    Stream (line number, recipient, template parameters) from a recipient list.
+
+    NDJSON lines look like {"to": "447700900123", "parameters": ["Jane"]}.
+    CSV files need a header with a "to" (or "wa_id"/"phone") column; the
+    remaining columns, in order, are the template's body parameters.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    row = json.loads(line)
+                    yield line_no, str(row.get("to") or ""), [str(p) for p in row.get("parameters") or []]
+            return
+
+        reader = csv.DictReader(f)
+        column = next((c for c in ("to", "wa_id", "phone") if c in (reader.fieldnames or ())), None)
+        if column is None:
+            raise ValueError(f"{path} needs a 'to', 'wa_id' or 'phone' column")
+        parameters = [c for c in reader.fieldnames if c != column]
+        for row in reader:
+            yield reader.line_num, (row[column] or "").strip(), [row[c] or "" for c in parameters]
+
+
+def template_payload(recipient, template, language, parameters):
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": recipient,
+        "type": "template",
+        "template": {"name": template, "language": {"code": language}},
+    }
+    if parameters:
+        payload["template"]["components"] = [
+            {"type": "body", "parameters": [{"type": "text", "text": value} for value in parameters]}
+        ]
+    return json.dumps(payload)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the sends of one campaign; pause() holds everyone back.
+    With the default burst of 1, no one-second window ever holds more than rate sends.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CampaignStats:
+    """Running totals plus the send rate and error rate over the last few seconds"""
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._recent = deque()
+
+    def record(self, ok):
+        now = time.monotonic()
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self._recent.append((now, ok))
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        recent = [ok for at, ok in self._recent if at >= now - self.window]
+        span = min(self.window, max(now - self.started, 1e-6))
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "sent_per_second": round(sum(recent) / span, 1),
+            "error_rate": round(recent.count(False) / len(recent), 3) if recent else 0.0,
+        }
+
+
+class CampaignStore:
+    """
+    Campaign progress in the shared state database.
+
+    A delivery row is written as 'sending' before the message goes out and
+    updated once the Graph API answered. A resumed campaign skips every line
+    that has a row, so nothing is sent twice; rows still 'sending' after a
+    crash, and 'unknown' rows whose request timed out or lost its response,
+    are reported as unconfirmed instead of being retried.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or STATE_DB_PATH
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_campaigns (
+                id TEXT PRIMARY KEY,
+                business_number TEXT NOT NULL,
+                source TEXT NOT NULL,
+                template TEXT NOT NULL,
+                language TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                campaign_id TEXT NOT NULL,
+                line_no INTEGER NOT NULL,
+                business_number TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL,
+                message_id TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (campaign_id, line_no)
+            );
+            CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_quota
+                ON broadcast_deliveries (business_number, updated_at);
+            """
+        )
+
+    def open_campaign(self, campaign_id, business_number, source, template, language):
+        """Create the campaign, or pick up an existing one with the same id"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO broadcast_campaigns
+                    (id, business_number, source, template, language, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'running', ?, ?)
+                ON CONFLICT (id) DO UPDATE SET status = 'running', updated_at = excluded.updated_at
+                """,
+                (campaign_id, business_number, source, template, language, now, now),
+            )
+
+    def set_status(self, campaign_id, status):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE broadcast_campaigns SET status = ?, updated_at = ? WHERE id = ?",
+                (status, time.time(), campaign_id),
+            )
+
+    def handled_lines(self, campaign_id):
+        rows = self._conn().execute("SELECT line_no FROM broadcast_deliveries WHERE campaign_id = ?", (campaign_id,))
+        return {line_no for line_no, in rows}
+
+    def start_batch(self, campaign_id, business_number, rows):
+        """Write-ahead the deliveries about to be attempted"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO broadcast_deliveries
+                    (campaign_id, line_no, business_number, recipient, status, updated_at)
+                VALUES (?, ?, ?, ?, 'sending', ?)
+                """,
+                [(campaign_id, line_no, business_number, recipient, now) for line_no, recipient, _ in rows],
+            )
+
+    def finish_batch(self, campaign_id, results):
+        """Record (line number, status, message id, error) outcomes in one transaction"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                UPDATE broadcast_deliveries SET status = ?, message_id = ?, error = ?, updated_at = ?
+                WHERE campaign_id = ? AND line_no = ?
+                """,
+                [(status, message_id, error, now, campaign_id, line_no) for line_no, status, message_id, error in results],
+            )
+
+    def quota_used(self, business_number, now=None):
+        """(unique recipients messaged in the last 24 hours, when the oldest of them leaves the window)"""
+        now = time.time() if now is None else now
+        count, oldest = self._conn().execute(
+            """
+            SELECT COUNT(DISTINCT recipient), MIN(updated_at) FROM broadcast_deliveries
+            WHERE business_number = ? AND status IN ('sending', 'sent', 'unknown') AND updated_at > ?
+            """,
+            (business_number, now - QUOTA_WINDOW_SECONDS),
+        ).fetchone()
+        return count, (oldest + QUOTA_WINDOW_SECONDS) if oldest else now
+
+    def progress(self, campaign_id):
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE campaign_id = ? GROUP BY status",
+            (campaign_id,),
+        )
+        return dict(rows.fetchall())
+
+
+class BroadcastEngine:
+    """
+    Sends a template message to every recipient of a list, resumably.
+
+    The list is streamed in chunks. Each chunk is written ahead to the
+    CampaignStore, sent concurrently (at most `concurrency` requests in
+    flight, paced by the phone number's messages-per-second), and its
+    outcomes recorded in one transaction. Before each chunk the tenant's
+    24-hour messaging limit is checked; once it is used up the engine either
+    waits for the window to roll over or stops with the campaign paused.
+    """
+
+    def __init__(self, store=None, concurrency=BROADCAST_CONCURRENCY, report_interval=REPORT_INTERVAL_SECONDS, on_report=None):
+        self.store = store or CampaignStore()
+        self.concurrency = concurrency
+        self.report_interval = report_interval
+        self.on_report = on_report or (lambda campaign_id, stats: logger.info(f"Campaign {campaign_id}: {stats}"))
+
+    async def run(self, campaign_id, path, business_number, template, language="en", wait_for_quota=False):
+        tenant = tenant_registry.get(business_number)
+        if tenant is None or not tenant.access_token or not tenant.phone_number_id:
+            raise ValueError(f"No WhatsApp credentials for business {business_number}")
+        rate = tenant.messages_per_second or BROADCAST_MESSAGES_PER_SECOND
+        limit = tenant.messaging_limit if tenant.messaging_limit is not None else BROADCAST_MESSAGING_LIMIT
+
+        await asyncio.to_thread(self.store.open_campaign, campaign_id, business_number, path, template, language)
+        handled = await asyncio.to_thread(self.store.handled_lines, campaign_id)
+        if handled:
+            logger.info(f"Resuming campaign {campaign_id}: {len(handled)} recipients already handled")
+
+        stats = CampaignStats()
+        limiter = RateLimiter(rate)
+        url = f"{GRAPH_API_URL}/{os.getenv('VERSION', 'v18.0')}/{tenant.phone_number_id}/messages"
+        headers = {"Content-type": "application/json", "Authorization": f"Bearer {tenant.access_token}"}
+        reporter = asyncio.create_task(self._report(campaign_id, stats))
+        status = "completed"
+        try:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+                send = asyncio.Semaphore(self.concurrency)
+
+                async def deliver(row):
+                    async with send:
+                        return await self._send(session, url, limiter, stats, row, template, language)
+
+                pending = []
+                rows = (row for row in read_recipients(path) if row[0] not in handled)
+                for row in rows:
+                    pending.append(row)
+                    if len(pending) >= self.concurrency * 4:
+                        pending = await self._send_chunk(campaign_id, business_number, limit, pending, deliver, wait_for_quota)
+                        if pending:
+                            status = "paused"
+                            break
+                else:
+                    pending = await self._send_chunk(campaign_id, business_number, limit, pending, deliver, wait_for_quota)
+                    if pending:
+                        status = "paused"
+        except BaseException:
+            status = "interrupted"
+            raise
+        finally:
+            reporter.cancel()
+            await asyncio.to_thread(self.store.set_status, campaign_id, status)
+            self.on_report(campaign_id, {**stats.snapshot(), "status": status})
+
+        return {**stats.snapshot(), "status": status}
+
+    async def _send_chunk(self, campaign_id, business_number, limit, rows, deliver, wait_for_quota):
+        """Send rows as far as the messaging limit allows; returns the rows left over"""
+        while rows:
+            batch = rows
+            if limit:
+                used, frees_at = await asyncio.to_thread(self.store.quota_used, business_number)
+                if used >= limit:
+                    if not wait_for_quota:
+                        logger.warning(f"Messaging limit of {limit} reached for {business_number}, pausing campaign {campaign_id}")
+                        return rows
+                    delay = max(1.0, frees_at - time.time())
+                    logger.info(f"Messaging limit of {limit} reached for {business_number}, waiting {delay:.0f}s")
+                    await asyncio.sleep(min(delay, 60))
+                    continue
+                batch = rows[:limit - used]
+            rows = rows[len(batch):]
+
+            await asyncio.to_thread(self.store.start_batch, campaign_id, business_number, batch)
+            results = await asyncio.gather(*(deliver(row) for row in batch))
+            await asyncio.to_thread(self.store.finish_batch, campaign_id, results)
+        return rows
+
+    async def _send(self, session, url, limiter, stats, row, template, language):
+        line_no, recipient, parameters = row
+        if not recipient:
+            stats.record(False)
+            return line_no, "failed", None, "No recipient"
+
+        data = template_payload(recipient, template, language, parameters)
+        error = None
+        for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+            await limiter.acquire()
+            try:
+                async with session.post(url, data=data, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    status = response.status
+                    text = await response.text()
+            except aiohttp.ClientConnectorError as e:
+                # Nothing reached the Graph API, so sending again cannot duplicate the message
+                error = str(e) or type(e).__name__
+                await asyncio.sleep(backoff(attempt))
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # The message may have been accepted; a resend could reach the recipient twice
+                stats.record(False)
+                metrics.increment("broadcast_unknown")
+                return line_no, "unknown", None, str(e) or type(e).__name__
+
+            try:
+                body = json.loads(text)
+            except ValueError:
+                body = {}
+            if status == 200:
+                stats.record(True)
+                metrics.increment("broadcast_sent")
+                return line_no, "sent", ((body.get("messages") or [{}])[0]).get("id"), None
+
+            code = (body.get("error") or {}).get("code")
+            error = f"{status} (code {code}): {(body.get('error') or {}).get('message')}"
+            if code in THROUGHPUT_LIMIT_CODES or status == 429:
+                # Everyone slows down, not just this send
+                limiter.pause(backoff(attempt, THROUGHPUT_RETRY_SECONDS))
+                continue
+            if code in PAIR_LIMIT_CODES or status >= 500:
+                await asyncio.sleep(backoff(attempt))
+                continue
+            break
+
+        stats.record(False)
+        metrics.increment("broadcast_failed")
+        return line_no, "failed", None, error
+
+    async def _report(self, campaign_id, stats):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.on_report(campaign_id, stats.snapshot())
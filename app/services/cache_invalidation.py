@@ -0,0 +1,55 @@
+import logging
+import threading
+
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+# Databases whose cache_versions table this process has already created
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _conn(path=None):
+    path = path or STATE_DB_PATH
+    conn = connect(path)
+    if path not in _initialized:
+        with _init_lock:
+            if path not in _initialized:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+                )
+                _initialized.add(path)
+    return conn
+
+
+def bump(key, path=None):
+    """
+    Invalidate everything cached under a key, in every process sharing the state database.
+    """
+    with _conn(path) as conn:
+        conn.execute(
+            """
+            INSERT INTO cache_versions (key, version) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1
+            """,
+            (key,),
+        )
+    logger.info(f"Invalidated cached data for {key}")
+
+
+def version(key, path=None):
+    """Current version of a key; cached values built under an older version are stale"""
+    row = _conn(path).execute("SELECT version FROM cache_versions WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def versions(keys, path=None):
+    """Current versions of several keys in one query, in the order given"""
+    keys = list(keys)
+    rows = _conn(path).execute(
+        f"SELECT key, version FROM cache_versions WHERE key IN ({', '.join('?' for _ in keys)})",
+        keys,
+    ).fetchall()
+    found = dict(rows)
+    return tuple(found.get(key, 0) for key in keys)
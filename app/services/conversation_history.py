@@ -0,0 +1,106 @@
+import logging
+import os
+import time
+
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+# What the Chat Completions backend sends back to the model for each user:
+# at most HISTORY_MAX_MESSAGES messages and roughly HISTORY_MAX_TOKENS tokens
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "3000"))
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token, plus per-message overhead)"""
+    return len(text) // 4 + 4
+
+
+class ConversationHistory:
+    """
+    Per-conversation message history for backends that don't keep server-side threads.
+
+    Messages are stored in the shared SQLite state database, so every worker
+    process sees the same history. Only the last max_messages messages of a
+    conversation are kept, and window() trims further to the token budget.
+    """
+
+    def __init__(self, path=None, max_messages=HISTORY_MAX_MESSAGES, max_tokens=HISTORY_MAX_TOKENS):
+        self.path = path or STATE_DB_PATH
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversation_history_conversation
+                ON conversation_history (conversation, id);
+            """
+        )
+
+    def window(self, conversation):
+        """
+        Most recent messages of a conversation that fit the message and token
+        budgets, oldest first, as Chat Completions message dicts.
+        """
+        rows = self._conn().execute(
+            "SELECT role, content, tokens FROM conversation_history WHERE conversation = ? ORDER BY id DESC LIMIT ?",
+            (conversation, self.max_messages),
+        ).fetchall()
+
+        messages = []
+        budget = self.max_tokens
+        for role, content, tokens in rows:
+            if tokens > budget:
+                break
+            budget -= tokens
+            messages.append({"role": role, "content": content})
+        messages.reverse()
+        return messages
+
+    def append(self, conversation, *messages):
+        """
+        Add (role, content) pairs to a conversation and drop what falls out of the window.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO conversation_history (conversation, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(conversation, role, content, estimate_tokens(content), now) for role, content in messages],
+            )
+            conn.execute(
+                """
+                DELETE FROM conversation_history WHERE conversation = ? AND id <= (
+                    SELECT id FROM conversation_history WHERE conversation = ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (conversation, conversation, self.max_messages),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self, conversation):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM conversation_history WHERE conversation = ?", (conversation,))
+
+
+# Create a singleton instance
+conversation_history = ConversationHistory()
@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "10000"))
+# Meta stops redelivering after a few days, so older ids can be forgotten
+DEDUPE_RETENTION_SECONDS = int(os.getenv("DEDUPE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+PRUNE_EVERY = 1000
+
+
+class MessageDeduplicator:
+    """
+    Idempotency index keyed on the WhatsApp message id.
+
+    A bounded in-memory LRU answers most lookups; the SQLite table behind it
+    is shared by every gunicorn worker process and also remembers the reply
+    generated for a message, so a retried job can resend it without running
+    the assistant again.
+    """
+
+    def __init__(self, path=None, cache_size=DEDUPE_CACHE_SIZE, retention_seconds=DEDUPE_RETENTION_SECONDS):
+        self.path = path or STATE_DB_PATH
+        self.cache_size = cache_size
+        self.retention_seconds = retention_seconds
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._claims = 0
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                message_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                reply TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_processed_messages_created ON processed_messages (created_at);
+            """
+        )
+
+    def _remember(self, message_id):
+        with self._lock:
+            self._cache[message_id] = True
+            self._cache.move_to_end(message_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def claim(self, message_id):
+        """
+        Record a message id as received. Returns False if it was seen before.
+        """
+        if not message_id:
+            return True
+
+        with self._lock:
+            if message_id in self._cache:
+                self._cache.move_to_end(message_id)
+                return False
+
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_messages (message_id, status, created_at) VALUES (?, 'received', ?)",
+                (message_id, time.time()),
+            )
+        self._remember(message_id)
+
+        self._claims += 1
+        if self._claims % PRUNE_EVERY == 0:
+            self.prune()
+
+        return cursor.rowcount == 1
+
+    def release(self, message_id):
+        """Forget a claim, e.g. when the message could not be queued"""
+        with self._lock:
+            self._cache.pop(message_id, None)
+        with self._conn() as conn:
+            conn.execute("DELETE FROM processed_messages WHERE message_id = ?", (message_id,))
+
+    def get(self, message_id):
+        """Return (status, reply) for a message id, or (None, None) if unknown"""
+        row = self._conn().execute(
+            "SELECT status, reply FROM processed_messages WHERE message_id = ?",
+            (message_id,),
+        ).fetchone()
+        return row if row else (None, None)
+
+    def record_reply(self, message_id, reply):
+        """Store the generated reply so a retry can reuse it"""
+        if not message_id:
+            return
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO processed_messages (message_id, status, reply, created_at) VALUES (?, 'replied', ?, ?)
+                ON CONFLICT (message_id) DO UPDATE SET status = 'replied', reply = excluded.reply
+                """,
+                (message_id, reply, time.time()),
+            )
+
+    def mark_queued(self, message_id):
+        """Mark the reply for a message as handed to the outbox, which will deliver it"""
+        if not message_id:
+            return
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE processed_messages SET status = 'queued' WHERE message_id = ? AND status != 'sent'",
+                (message_id,),
+            )
+
+    def mark_sent(self, message_id):
+        """Mark the reply for a message as delivered to the Graph API"""
+        if not message_id:
+            return
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE processed_messages SET status = 'sent' WHERE message_id = ?",
+                (message_id,),
+            )
+
+    def prune(self):
+        """Drop ids older than the retention window"""
+        try:
+            with self._conn() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM processed_messages WHERE created_at < ?",
+                    (time.time() - self.retention_seconds,),
+                )
+            if cursor.rowcount:
+                logger.info(f"Pruned {cursor.rowcount} old message ids from the dedupe index")
+        except Exception as e:
+            logger.error(f"Error pruning dedupe index: {str(e)}")
+
+
+# Create a singleton instance
+message_deduplicator = MessageDeduplicator()
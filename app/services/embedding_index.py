@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the local embedding index
+    np = None
+
+from app.services.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Local semantic index: "hashing" (offline, deterministic) or "openai" embeddings
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+HASHING_DIMENSIONS = int(os.getenv("HASHING_DIMENSIONS", "512"))
+# Rows scored per matrix product, which bounds the temporary memory of int8 searches
+SEARCH_BATCH_ROWS = 4096
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.json"
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The embedding index needs numpy (pip install numpy)")
+
+
+class HashingEmbedder:
+    """
+    Deterministic feature-hashing embedder: words and word pairs are hashed
+    into a fixed number of signed buckets. No model or network needed, so it
+    suits offline tests and small keyword-heavy knowledge bases.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts):
+        _require_numpy()
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI embeddings endpoint, requested in batches"""
+
+    name = "openai"
+
+    def __init__(self, model=EMBEDDING_MODEL, client=None, batch_size=256):
+        self.model = model
+        self.batch_size = batch_size
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.services.openai_service import client
+            self._client = client
+        return self._client
+
+    def embed(self, texts):
+        _require_numpy()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in response.data)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+EMBEDDERS = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+
+
+def get_embedder(name=EMBEDDER):
+    try:
+        return EMBEDDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown embedder {name!r}; expected one of {', '.join(EMBEDDERS)}")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """
+    Read-only semantic index over knowledge chunks, memory-mapped from disk.
+
+    build() writes unit-length embeddings as an .npy matrix (float32, or int8
+    with one scale per row when quantized) next to the chunk texts, into a
+    fresh directory that is swapped in with a rename. load() maps the matrix
+    read-only, so every gunicorn worker shares the same page cache copy
+    instead of holding its own. search() scores the query against the
+    matrix in batches with a single matrix-vector product per batch.
+    """
+
+    def __init__(self, path, embedder, vectors, scales, chunks):
+        self.path = path
+        self.embedder = embedder
+        self.vectors = vectors
+        self.scales = scales
+        self.chunks = chunks
+
+    @classmethod
+    def build(cls, path, chunks, embedder=None, quantize=False):
+        """Embed (source, text) chunks and write the index to path, replacing any previous one"""
+        _require_numpy()
+        embedder = embedder or get_embedder()
+        chunks = list(chunks)
+        vectors = _normalize(embedder.embed([text for _, text in chunks])) if chunks else np.zeros((0, 1), np.float32)
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".embedding-index-", dir=parent)
+        try:
+            if quantize:
+                scales = np.abs(vectors).max(axis=1) if len(vectors) else np.zeros(0, np.float32)
+                scales[scales == 0] = 1.0
+                quantized = np.rint(vectors / scales[:, None] * 127).astype(np.int8)
+                np.save(os.path.join(staging, VECTORS_FILE), quantized)
+                np.save(os.path.join(staging, SCALES_FILE), (scales / 127).astype(np.float32))
+            else:
+                np.save(os.path.join(staging, VECTORS_FILE), vectors.astype(np.float32))
+            with open(os.path.join(staging, CHUNKS_FILE), "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "embedder": embedder.name,
+                        "dimensions": int(vectors.shape[1]),
+                        "chunks": [{"source": source, "text": text} for source, text in chunks],
+                    },
+                    f,
+                )
+
+            previous = None
+            if os.path.exists(path):
+                previous = tempfile.mkdtemp(prefix=".embedding-index-old-", dir=parent)
+                os.rename(path, os.path.join(previous, "index"))
+            os.rename(staging, path)
+            if previous:
+                shutil.rmtree(previous, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        logger.info(f"Embedding index with {len(chunks)} chunks written to {path}")
+        return cls.load(path, embedder)
+
+    @classmethod
+    def load(cls, path, embedder=None):
+        _require_numpy()
+        with open(os.path.join(path, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if embedder is None:
+            embedder = get_embedder(meta["embedder"])
+        elif embedder.name != meta["embedder"]:
+            raise ValueError(f"Index at {path} was built with the {meta['embedder']} embedder, not {embedder.name}")
+
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        scales_path = os.path.join(path, SCALES_FILE)
+        scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        chunks = [(chunk["source"], chunk["text"]) for chunk in meta["chunks"]]
+        return cls(path, embedder, vectors, scales, chunks)
+
+    @property
+    def quantized(self):
+        return self.scales is not None
+
+    def scores(self, query_vectors):
+        """Cosine similarity of every chunk (rows) with every query (columns)"""
+        queries = _normalize(np.atleast_2d(query_vectors).astype(np.float32)).T
+        result = np.empty((len(self.vectors), queries.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_BATCH_ROWS):
+            block = self.vectors[start:start + SEARCH_BATCH_ROWS]
+            if self.quantized:
+                scores = block.astype(np.float32) @ queries
+                scores *= self.scales[start:start + SEARCH_BATCH_ROWS, None]
+            else:
+                scores = block @ queries
+            result[start:start + len(block)] = scores
+        return result
+
+    def search_many(self, queries, k=3):
+        """Top-k (score, source, text) per query, best first"""
+        if not self.chunks or not queries:
+            return [[] for _ in queries]
+        scores = self.scores(self.embedder.embed(list(queries)))
+        k = min(k, len(self.chunks))
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append([(float(column[i]), *self.chunks[i]) for i in top if column[i] > 0])
+        return results
+
+    def search(self, query, k=3):
+        return self.search_many([query], k)[0]
+
+    def __len__(self):
+        return len(self.chunks)
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.services.metrics import metrics
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com")
+# Keep-alive connections per tenant; sends beyond this wait for a free one
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "8"))
+GRAPH_TIMEOUT_SECONDS = float(os.getenv("GRAPH_TIMEOUT_SECONDS", "10"))
+
+
+class GraphClient:
+    """
+    WhatsApp Cloud API client for one tenant.
+
+    Wraps a requests.Session whose connection pool keeps up to pool_size
+    connections to the Graph API alive, so replies after the first skip the
+    TCP and TLS handshake. The session is configured once and only used to
+    send afterwards, which is safe from many threads.
+    """
+
+    def __init__(self, tenant, pool_size=GRAPH_POOL_SIZE, timeout=GRAPH_TIMEOUT_SECONDS):
+        self.business_number = tenant.business_number
+        self.access_token = tenant.access_token
+        self.phone_number_id = tenant.phone_number_id
+        self.timeout = timeout
+        self.messages_url = f"{GRAPH_API_URL}/{os.getenv('VERSION', 'v18.0')}/{self.phone_number_id}/messages"
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self.session.headers.update({
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {self.access_token}",
+        })
+
+    def matches(self, tenant):
+        return (tenant.access_token, tenant.phone_number_id) == (self.access_token, self.phone_number_id)
+
+    def _connections_opened(self):
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def post(self, url, **kwargs):
+        """POST through the pool, timing the call by whether it had to open a new connection"""
+        kwargs.setdefault("timeout", self.timeout)
+        opened = self._connections_opened()
+        started = time.perf_counter()
+        try:
+            return self.session.post(url, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            reused = self._connections_opened() == opened
+            metrics.increment("graph_sends")
+            metrics.increment("graph_connections_reused" if reused else "graph_connections_opened")
+            metrics.observe("graph_send_seconds", elapsed)
+            metrics.observe("graph_send_seconds.reused" if reused else "graph_send_seconds.new_connection", elapsed)
+
+    def send(self, data):
+        """Send a prepared message payload (JSON string) to the messages endpoint"""
+        return self.post(self.messages_url, data=data)
+
+    def prewarm(self):
+        """Open a pooled connection ahead of the first send"""
+        try:
+            self.session.head(GRAPH_API_URL, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Could not prewarm Graph API connection for {self.business_number}: {str(e)}")
+
+    def close(self):
+        self.session.close()
+
+
+class GraphClientPool:
+    """
+    One GraphClient per tenant, created on first use. A client is replaced
+    when the tenant's token or phone number ID changes on a registry reload.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, business_number):
+        tenant = tenant_registry.get(business_number)
+        if tenant is None:
+            return None
+        client = self._clients.get(business_number)
+        if client is not None and client.matches(tenant):
+            return client
+        with self._lock:
+            client = self._clients.get(business_number)
+            if client is None or not client.matches(tenant):
+                # A replaced client is left to in-flight sends and closed when collected
+                client = self._clients[business_number] = GraphClient(tenant)
+        return client
+
+    def prewarm(self):
+        """Connect every configured tenant's client, e.g. at worker boot"""
+        started = time.perf_counter()
+        business_numbers = [
+            tenant.business_number
+            for tenant in tenant_registry.tenants()
+            if tenant.access_token and tenant.phone_number_id
+        ]
+        for business_number in business_numbers:
+            self.get(business_number).prewarm()
+        logger.info(f"Prewarmed {len(business_numbers)} Graph API clients in {time.perf_counter() - started:.2f}s")
+        return len(business_numbers)
+
+
+# Create a singleton instance
+graph_clients = GraphClientPool()
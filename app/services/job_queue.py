@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed job stays invisible to other workers before it is
+# considered abandoned (worker crashed, process restarted) and handed out again.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Messages from the same user arriving within this window are handed out together
+MESSAGE_DEBOUNCE_SECONDS = float(os.getenv("MESSAGE_DEBOUNCE_SECONDS", "1.5"))
+# Never hold the first message of a burst longer than this
+MESSAGE_DEBOUNCE_MAX_SECONDS = float(os.getenv("MESSAGE_DEBOUNCE_MAX_SECONDS", "5"))
+# Most jobs of one conversation handed out at once
+JOB_BATCH_SIZE = 20
+
+_WAITING = "(status = 'pending' OR (status = 'processing' AND leased_until < :now))"
+
+# Oldest job that is waiting, and whose conversation (if any) has nothing in
+# progress and is either quiet or has waited long enough
+_CLAIMABLE = f"""
+    SELECT id, conversation FROM jobs w
+    WHERE {_WAITING}
+      AND (
+          conversation IS NULL
+          OR (
+              NOT EXISTS (
+                  SELECT 1 FROM jobs p
+                  WHERE p.conversation = w.conversation AND p.status = 'processing' AND p.leased_until >= :now
+              )
+              AND (
+                  SELECT MAX(created_at) <= :quiet_since OR MIN(created_at) <= :waited_since FROM jobs x
+                  WHERE x.conversation = w.conversation AND {_WAITING}
+              )
+          )
+      )
+    ORDER BY id LIMIT 1
+"""
+
+# When the next conversation that is held back only by the debounce becomes claimable
+_NEXT_DUE = """
+    SELECT MIN(due) FROM (
+        SELECT MIN(MAX(created_at) + :debounce, MIN(created_at) + :max_delay) AS due FROM jobs
+        WHERE conversation IS NOT NULL AND status = 'pending'
+          AND conversation NOT IN (
+              SELECT conversation FROM jobs
+              WHERE conversation IS NOT NULL AND status = 'processing' AND leased_until >= :now
+          )
+        GROUP BY conversation
+    ) WHERE due > :now
+"""
+
+
+class JobQueue:
+    """
+    Durable FIFO job queue backed by SQLite.
+
+    Jobs are claimed with a lease; a job whose lease expires without being
+    completed (e.g. the worker died) becomes visible again, so queued work
+    survives restarts.
+
+    Jobs can belong to a conversation. Its jobs are handed out together, a
+    short quiet period after the last one arrived, and never while another
+    of its jobs is in progress, so each user's messages are processed one
+    batch at a time and in order across every worker and process.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        lease_seconds=JOB_LEASE_SECONDS,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        debounce_seconds=MESSAGE_DEBOUNCE_SECONDS,
+        max_delay_seconds=MESSAGE_DEBOUNCE_MAX_SECONDS,
+        batch_size=JOB_BATCH_SIZE,
+    ):
+        self.path = path or STATE_DB_PATH
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._next_due = None
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                leased_until REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_error TEXT,
+                conversation TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, leased_until, id);
+            """
+        )
+        # Tables created before conversations have no conversation column
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "conversation" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN conversation TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_conversation ON jobs (conversation, status)")
+
+    def enqueue(self, payload, conversation=None):
+        """Persist a job and return its id"""
+        return self.enqueue_many([payload], [conversation])[0]
+
+    def enqueue_many(self, payloads, conversations=None):
+        """
+        Persist several jobs in a single transaction and return their ids.
+        conversations optionally gives each job's conversation key.
+        """
+        conn = self._conn()
+        now = time.time()
+        ids = []
+        conversations = conversations or [None] * len(payloads)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for payload, conversation in zip(payloads, conversations):
+                cursor = conn.execute(
+                    "INSERT INTO jobs (payload, created_at, conversation) VALUES (?, ?, ?)",
+                    (json.dumps(payload), now, conversation),
+                )
+                ids.append(cursor.lastrowid)
+        self._wakeup.set()
+        return ids
+
+    def claim(self):
+        """
+        Claim the oldest available job, together with the other jobs waiting
+        in its conversation. Returns a list of (job_id, payload, attempts),
+        oldest first, or None.
+        """
+        conn = self._conn()
+        now = time.time()
+        params = {
+            "now": now,
+            "quiet_since": now - self.debounce_seconds,
+            "waited_since": now - self.max_delay_seconds,
+        }
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(_CLAIMABLE, params).fetchone()
+            if row is None:
+                self._next_due = conn.execute(
+                    _NEXT_DUE, {"now": now, "debounce": self.debounce_seconds, "max_delay": self.max_delay_seconds}
+                ).fetchone()[0]
+                return None
+            job_id, conversation = row
+            if conversation is None:
+                rows = conn.execute("SELECT id, payload, attempts FROM jobs WHERE id = ?", (job_id,)).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT id, payload, attempts FROM jobs WHERE conversation = :conversation AND {_WAITING} "
+                    "ORDER BY id LIMIT :limit",
+                    {"conversation": conversation, "now": now, "limit": self.batch_size},
+                ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'processing', attempts = attempts + 1, leased_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows],
+            )
+        return [(job_id, json.loads(payload), attempts + 1) for job_id, payload, attempts in rows]
+
+    def renew(self, job_id, attempts):
+        """
+        Extend the lease of a job claimed earlier, e.g. when it was held back
+        before a worker took it. Returns False if the lease expired and the job
+        was claimed again (attempts changed) or finished elsewhere meanwhile.
+        """
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET leased_until = ? WHERE id = ? AND status = 'processing' AND attempts = ?",
+                (time.time() + self.lease_seconds, job_id, attempts),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id):
+        """Remove a finished job from the queue"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def fail(self, job_id, error, attempts):
+        """Release a job for retry, or park it as dead once it ran out of attempts"""
+        status = "dead" if attempts >= self.max_attempts else "pending"
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, leased_until = 0, last_error = ? WHERE id = ?",
+                (status, str(error), job_id),
+            )
+        if status == "dead":
+            logger.error(f"Job {job_id} failed {attempts} times, giving up: {error}")
+
+    def depth(self):
+        """Number of jobs waiting or in progress"""
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'processing')"
+        ).fetchone()
+        return row[0]
+
+    def wait_timeout(self, timeout):
+        """timeout, shortened to when the next held-back conversation becomes claimable"""
+        if self._next_due is None:
+            return timeout
+        return max(0.0, min(timeout, self._next_due - time.time()))
+
+    def wait(self, timeout):
+        """
+        Block until a job is enqueued in this process, a held-back conversation
+        becomes claimable, or the timeout elapses
+        """
+        self._wakeup.wait(self.wait_timeout(timeout))
+        self._wakeup.clear()
+
+
+# Create a singleton instance
+job_queue = JobQueue()
@@ -4,12 +4,33 @@ from dotenv import load_dotenv
 import logging
 import json
 
+from app.services.answer_cache import invalidate_knowledge, knowledge_version
+from app.services.embedding_index import EmbeddingIndex
+from app.services.lexical_index import BM25Index, chunk_text, flatten_knowledge
+
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Every business is answered from the *.txt / *.md files in KNOWLEDGE_DIR/<business_number>/.
+# knowledge_base.json, KNOWLEDGE_DOCUMENTS (comma separated) and the files directly in
+# KNOWLEDGE_DIR describe KNOWLEDGE_BUSINESS_NUMBER only, which is also used for messages
+# without a business number
+KNOWLEDGE_DOCUMENTS = os.getenv("KNOWLEDGE_DOCUMENTS", "company_info.txt")
+KNOWLEDGE_DIR = os.getenv("KNOWLEDGE_DIR", "knowledge")
+KNOWLEDGE_BUSINESS_NUMBER = os.getenv("KNOWLEDGE_BUSINESS_NUMBER", "447464177761")
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "3"))
+KNOWLEDGE_EXTENSIONS = (".txt", ".md")
+# "bm25" (built in memory on first use) or "embeddings" (memory-mapped index written by
+# build_embedding_index.py into EMBEDDING_INDEX_DIR/<business_number>)
+KNOWLEDGE_RETRIEVER = os.getenv("KNOWLEDGE_RETRIEVER", "bm25")
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "embedding_index")
+
 class KnowledgeBase:
     def __init__(self):
         self.knowledge_file = "knowledge_base.json"
+        self._indexes = {}
+        self._shared_version = None
+        self._versions = {}
         self.load_knowledge()
 
     def load_knowledge(self):
@@ -41,6 +62,7 @@ class KnowledgeBase:
         except Exception as e:
             logging.error(f"Error loading knowledge base: {str(e)}")
             self.knowledge = {}
+        self._indexes = {}
 
     def save_knowledge(self):
         """Save knowledge base to JSON file"""
@@ -51,21 +73,94 @@ class KnowledgeBase:
         except Exception as e:
             logging.error(f"Error saving knowledge base: {str(e)}")
 
-    def get_relevant_info(self, query):
-        """Get relevant information from knowledge base based on query"""
+    def _document_paths(self, directory, paths=()):
+        paths = list(paths)
+        if os.path.isdir(directory):
+            paths += sorted(
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.endswith(KNOWLEDGE_EXTENSIONS)
+            )
+        return [p for p in paths if os.path.isfile(p)]
+
+    def has_knowledge(self, business_number=None):
+        """Whether a business has any knowledge of its own to search"""
+        business_number = str(business_number or KNOWLEDGE_BUSINESS_NUMBER)
+        return business_number == KNOWLEDGE_BUSINESS_NUMBER or os.path.isdir(os.path.join(KNOWLEDGE_DIR, business_number))
+
+    def chunks(self, business_number=None):
+        """(source, text) chunks of the knowledge available to a business"""
+        business_number = str(business_number or KNOWLEDGE_BUSINESS_NUMBER)
+        chunks = []
+        paths = self._document_paths(os.path.join(KNOWLEDGE_DIR, business_number))
+        if business_number == KNOWLEDGE_BUSINESS_NUMBER:
+            company_info = self.knowledge.get("company_info", {})
+            chunks = [(self.knowledge_file, chunk) for chunk in flatten_knowledge(company_info)]
+            documents = [p.strip() for p in KNOWLEDGE_DOCUMENTS.split(",") if p.strip()]
+            paths = self._document_paths(KNOWLEDGE_DIR, documents) + paths
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                chunks.extend((path, chunk) for chunk in chunk_text(f.read()))
+        return chunks
+
+    def embedding_index_path(self, business_number=None):
+        return os.path.join(EMBEDDING_INDEX_DIR, str(business_number or KNOWLEDGE_BUSINESS_NUMBER))
+
+    def _build_index(self, business_number=None):
+        if KNOWLEDGE_RETRIEVER == "embeddings":
+            path = self.embedding_index_path(business_number)
+            try:
+                index = EmbeddingIndex.load(path)
+                logging.info(f"Knowledge embedding index loaded from {path} ({len(index)} chunks)")
+                return index
+            except (OSError, RuntimeError, ValueError) as e:
+                logging.warning(f"Could not load embedding index {path}, using keyword search: {str(e)}")
+
+        index = BM25Index()
+        for source, chunk in self.chunks(business_number):
+            index.add(chunk, source)
+        logging.info(f"Knowledge index built with {len(index)} chunks for business {business_number}")
+        return index.build()
+
+    def _index_for(self, business_number=None):
+        # Another process may have updated the knowledge base since it was loaded.
+        # A change for every business rebuilds all indexes; a change for one
+        # business only rebuilds its index.
+        business_number = str(business_number or KNOWLEDGE_BUSINESS_NUMBER)
+        shared_version, version = knowledge_version(business_number)
+        if shared_version != self._shared_version:
+            if self._shared_version is not None:
+                self.load_knowledge()
+            self._shared_version = shared_version
+        if self._versions.get(business_number, version) != version:
+            self._indexes.pop(business_number, None)
+        self._versions[business_number] = version
+
+        # A business without knowledge of its own gets none, rather than another company's
+        if not self.has_knowledge(business_number):
+            return None
+        index = self._indexes.get(business_number)
+        if index is None:
+            index = self._indexes[business_number] = self._build_index(business_number)
+        return index
+
+    def get_relevant_info(self, query, business_number=None, k=KNOWLEDGE_TOP_K):
+        """Get the knowledge base snippets most relevant to a query"""
         try:
-            # For now, return all company info
-            # In the future, we can implement semantic search here
-            return self.knowledge.get("company_info", {})
+            index = self._index_for(business_number)
+            return [text for _, _, text in index.search(query, k)] if index is not None else []
         except Exception as e:
             logging.error(f"Error getting relevant info: {str(e)}")
-            return {}
+            return []
 
     def update_knowledge(self, new_info):
         """Update knowledge base with new information"""
         try:
             self.knowledge["company_info"].update(new_info)
             self.save_knowledge()
+            self._indexes = {}
+            # Answers generated from the old knowledge must not be served again
+            invalidate_knowledge()
             logging.info("Knowledge base updated successfully")
         except Exception as e:
             logging.error(f"Error updating knowledge base: {str(e)}")
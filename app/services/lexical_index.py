@@ -0,0 +1,117 @@
+import heapq
+import math
+import re
+
+# Chunks longer than this many words are split into overlapping windows
+CHUNK_WORDS = 80
+CHUNK_OVERLAP = 20
+
+STOPWORDS = frozenset(
+    """a an and are as at be by can do does for from how i in is it me my of on or our please
+    the to we what when where which who why will with you your""".split()
+)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _stem(token):
+    # Just enough to match "hours" with "hour" and "services" with "service"
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(token) for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Split a document into paragraphs, and long paragraphs into overlapping word windows"""
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(words) <= max_words:
+            chunks.append(" ".join(words))
+            continue
+        step = max_words - overlap
+        for start in range(0, len(words) - overlap, step):
+            chunks.append(" ".join(words[start:start + max_words]))
+    return chunks
+
+
+def flatten_knowledge(value, label=""):
+    """Turn nested knowledge_base.json data into "label: value" chunks, one per leaf group"""
+    if isinstance(value, dict):
+        chunks = []
+        for key, item in value.items():
+            name = str(key).replace("_", " ")
+            chunks.extend(flatten_knowledge(item, f"{label} {name}".strip()))
+        return chunks
+    if isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            return [f"{label}: " + "; ".join(str(item) for item in value)]
+        chunks = []
+        for item in value:
+            chunks.extend(flatten_knowledge(item, label))
+        return chunks
+    return [f"{label}: {value}" if label else str(value)]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 ranking.
+
+    Call add() for every chunk, then build(). build() folds the document
+    length normalization and IDF into one weight per posting, so search()
+    only sums weights over the query terms' posting lists.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []
+        self._terms = []
+        self._postings = {}
+
+    def add(self, text, source=None):
+        self.chunks.append((source, text))
+        counts = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        self._terms.append(counts)
+
+    def build(self):
+        count = len(self._terms)
+        lengths = [sum(counts.values()) for counts in self._terms]
+        average = (sum(lengths) / count) if count else 0
+        document_frequency = {}
+        for counts in self._terms:
+            for term in counts:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        postings = {}
+        for doc, counts in enumerate(self._terms):
+            norm = self.k1 * (1 - self.b + self.b * lengths[doc] / average) if average else self.k1
+            for term, tf in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                postings.setdefault(term, []).append((doc, idf * tf * (self.k1 + 1) / (tf + norm)))
+        self._postings = postings
+        self._terms = []
+        return self
+
+    def search(self, query, k=3):
+        """Top-k (score, source, text) for a query, best first"""
+        scores = {}
+        for term in set(tokenize(query)):
+            for doc, weight in self._postings.get(term, ()):
+                scores[doc] = scores.get(doc, 0.0) + weight
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, *self.chunks[doc]) for doc, score in best]
+
+    def __len__(self):
+        return len(self.chunks)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import time
+
+from app.services.answer_cache import answer_cache
+from app.services.conversation_history import conversation_history
+from app.services.metrics import metrics
+from app.services import openai_async, openai_service
+from app.services.tenant_registry import tenant_registry
+
+# Backend used for tenants that don't pick one ("assistants" or "chat");
+# set per tenant with LLM_BACKEND_<business_number> or "llm_backend" in the tenant config
+LLM_BACKEND = os.getenv("LLM_BACKEND", "assistants")
+# Model for the chat backend when the tenant's assistant doesn't name one
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+
+ERROR_REPLY = "I apologize, but I encountered an error while processing your request."
+EMPTY_REPLY = "I apologize, but I couldn't generate a response at this time."
+
+
+class AssistantsBackend:
+    """
+    OpenAI Assistants: the conversation lives in a server-side thread and
+    every reply is an assistant run (see openai_service.generate_response).
+    """
+
+    name = "assistants"
+
+    def generate_response(self, message, user_id, user_name=None, business_number=None):
+        return openai_service.generate_response(message, user_id, user_name, business_number)
+
+    async def generate_response_async(self, message, user_id, user_name=None, business_number=None):
+        return await openai_async.generate_response_async(message, user_id, user_name, business_number)
+
+    def is_first_turn(self, user_id, business_number=None):
+        return openai_service.lookup_thread_id(user_id, business_number) is None
+
+    def record_exchange(self, message, answer, user_id, business_number=None):
+        openai_service.record_exchange(user_id, message, answer, business_number)
+
+
+class ChatCompletionsBackend:
+    """
+    OpenAI Chat Completions with the conversation history kept locally.
+
+    One request per reply and no run to wait for. The tenant's assistant still
+    supplies the instructions and model, so switching backends doesn't change
+    the bot's configuration; the relevant knowledge base snippets are added
+    to the system prompt in place of the assistant's file search.
+    """
+
+    name = "chat"
+
+    def __init__(self, history=conversation_history, default_model=CHAT_MODEL):
+        self.history = history
+        self.default_model = default_model
+
+    def _conversation(self, user_id, business_number):
+        return f"{business_number}:{user_id}"
+
+    def _system_prompt(self, assistant, message, business_number):
+        parts = [assistant.instructions] if assistant is not None and assistant.instructions else []
+        context = openai_service.knowledge_context(message, business_number)
+        if context:
+            parts.append(context)
+        return "\n\n".join(parts)
+
+    def build_request(self, message, user_id, business_number=None):
+        """Chat Completions arguments: system prompt, history window and the new message"""
+        assistant = None
+        assistant_id = openai_service.get_assistant_id_for_business(business_number)
+        if assistant_id:
+            try:
+                assistant = openai_service.assistant_cache.get(assistant_id)
+            except Exception as e:
+                logging.error(f"Error retrieving assistant details: {str(e)}")
+
+        messages = []
+        system_prompt = self._system_prompt(assistant, message, business_number)
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(self.history.window(self._conversation(user_id, business_number)))
+        messages.append({"role": "user", "content": message})
+
+        model = assistant.model if assistant is not None and assistant.model else self.default_model
+        return {"model": model, "messages": messages}
+
+    def _finish(self, completion, message, user_id, business_number, started):
+        metrics.observe("chat_completion_seconds", time.monotonic() - started)
+        response = completion.choices[0].message.content if completion.choices else None
+        if not response:
+            return EMPTY_REPLY
+        self.history.append(
+            self._conversation(user_id, business_number),
+            ("user", message),
+            ("assistant", response),
+        )
+        logging.info(f"Generated response for user {user_id} (business {business_number}): {response[:100]}...")
+        return response
+
+    def is_first_turn(self, user_id, business_number=None):
+        return not self.history.window(self._conversation(user_id, business_number))
+
+    def record_exchange(self, message, answer, user_id, business_number=None):
+        self.history.append(self._conversation(user_id, business_number), ("user", message), ("assistant", answer))
+
+    def generate_response(self, message, user_id, user_name=None, business_number=None):
+        try:
+            request = self.build_request(message, user_id, business_number)
+            started = time.monotonic()
+            openai_service.count_api_call("chat.completions.create")
+            completion = openai_service.client.chat.completions.create(**request)
+            return self._finish(completion, message, user_id, business_number, started)
+        except Exception as e:
+            logging.error(f"Error generating response for user {user_id} (business {business_number}): {str(e)}")
+            return ERROR_REPLY
+
+    async def generate_response_async(self, message, user_id, user_name=None, business_number=None):
+        try:
+            request = await asyncio.to_thread(self.build_request, message, user_id, business_number)
+            started = time.monotonic()
+            openai_service.count_api_call("chat.completions.create")
+            completion = await openai_async.async_client.chat.completions.create(**request)
+            return await asyncio.to_thread(
+                self._finish, completion, message, user_id, business_number, started
+            )
+        except Exception as e:
+            logging.error(f"Error generating response for user {user_id} (business {business_number}): {str(e)}")
+            return ERROR_REPLY
+
+
+BACKENDS = {backend.name: backend for backend in (AssistantsBackend(), ChatCompletionsBackend())}
+
+
+def backend_for(business_number):
+    """The backend a tenant uses, falling back to LLM_BACKEND"""
+    tenant = tenant_registry.get(business_number)
+    name = (tenant.llm_backend if tenant and tenant.llm_backend else LLM_BACKEND).lower()
+    backend = BACKENDS.get(name)
+    if backend is None:
+        logging.warning(f"Unknown LLM backend {name!r} for business {business_number}, using assistants")
+        backend = BACKENDS["assistants"]
+    return backend
+
+
+def is_cacheable_answer(answer):
+    """Apologies for errors and timeouts must not be served to the next user asking"""
+    return bool(answer) and not answer.startswith("I apologize")
+
+
+def _shared_answer_recorder(backend, message, user_id, business_number):
+    """on_shared callback that adds a reused answer to the user's conversation"""
+    def record(answer):
+        try:
+            backend.record_exchange(message, answer, user_id, business_number)
+        except Exception as e:
+            logging.error(f"Error recording cached answer for user {user_id} (business {business_number}): {str(e)}")
+    return record
+
+
+def generate_response(message, user_id, user_name=None, business_number=None):
+    """
+    Generate a reply with the backend configured for the business.
+
+    A user's first question is answered from the answer cache when another
+    user asked it before; later turns may depend on the conversation and
+    always get a run of their own.
+    """
+    backend = backend_for(business_number)
+    generate = lambda: backend.generate_response(message, user_id, user_name, business_number)
+    if not backend.is_first_turn(user_id, business_number):
+        return generate()
+    return answer_cache.get_or_generate(
+        business_number,
+        openai_service.get_assistant_id_for_business(business_number),
+        message,
+        generate,
+        is_cacheable_answer,
+        _shared_answer_recorder(backend, message, user_id, business_number),
+    )
+
+
+async def generate_response_async(message, user_id, user_name=None, business_number=None):
+    """
+    Async counterpart of generate_response.
+    """
+    backend = backend_for(business_number)
+    generate = lambda: backend.generate_response_async(message, user_id, user_name, business_number)
+    if not await asyncio.to_thread(backend.is_first_turn, user_id, business_number):
+        return await generate()
+    return await answer_cache.get_or_generate_async(
+        business_number,
+        openai_service.get_assistant_id_for_business(business_number),
+        message,
+        generate,
+        is_cacheable_answer,
+        _shared_answer_recorder(backend, message, user_id, business_number),
+    )
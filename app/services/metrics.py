@@ -0,0 +1,84 @@
+import random
+import threading
+
+# Samples kept per timing for percentile estimates
+RESERVOIR_SIZE = 1024
+
+
+class _Timing:
+    __slots__ = ("count", "total", "min", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        # Reservoir sampling keeps a uniform sample of everything observed
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < RESERVOIR_SIZE:
+                self.samples[index] = value
+
+    def summary(self):
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            if not samples:
+                return None
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+        }
+
+
+class Metrics:
+    """
+    In-process counters and timings, exposed as JSON on /metrics.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing()
+            timing.observe(value)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {name: timing.summary() for name, timing in self._timings.items()},
+            }
+
+
+# Create a singleton instance
+metrics = Metrics()
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, BadRequestError, NotFoundError
+
+from app.services.metrics import metrics
+from app.services.tools import tool_registry
+from app.services.openai_service import (
+    POLL_BACKOFF,
+    POLL_INITIAL_INTERVAL,
+    POLL_MAX_INTERVAL,
+    RUN_STOP_STATUSES,
+    RUN_TERMINAL_STATUSES,
+    RUN_TIMEOUT_SECONDS,
+    assistant_cache,
+    count_api_call,
+    forget_thread,
+    get_assistant_id_for_business,
+    knowledge_context,
+    lookup_thread_id,
+    remember_thread,
+    run_lifecycle,
+    touch_thread,
+)
+from app.services.run_lifecycle import is_active_run_error
+
+load_dotenv()
+
+async_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    default_headers={"OpenAI-Beta": "assistants=v2"}
+)
+
+
+async def lookup_thread_id_async(user_id, business_number=None):
+    """
+    Async counterpart of openai_service.lookup_thread_id.
+    """
+    return await asyncio.to_thread(lookup_thread_id, user_id, business_number)
+
+
+async def start_run_async(thread_id, assistant_id, message, context=None):
+    """
+    Async counterpart of openai_service.start_run (without streaming).
+    """
+    user_message = {"role": "user", "content": message}
+    if thread_id is None:
+        options = {}
+        if context:
+            try:
+                assistant = await asyncio.to_thread(assistant_cache.get, assistant_id)
+                options["instructions"] = f"{assistant.instructions or ''}\n\n{context}".strip()
+            except Exception as e:
+                logging.error(f"Error retrieving assistant details: {str(e)}")
+        count_api_call("threads.create_and_run")
+        return await async_client.beta.threads.create_and_run(
+            assistant_id=assistant_id,
+            thread={"messages": [user_message]},
+            **options
+        )
+    options = {"additional_instructions": context} if context else {}
+    for attempt in range(2):
+        try:
+            count_api_call("runs.create")
+            return await async_client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                additional_messages=[user_message],
+                **options
+            )
+        except BadRequestError as e:
+            if attempt or not is_active_run_error(e):
+                raise
+            if not await asyncio.to_thread(run_lifecycle.clear_thread, thread_id):
+                raise
+
+
+async def poll_run_async(thread_id, run_id, deadline):
+    """
+    Async counterpart of openai_service.poll_run; returns (status, number of polls, run).
+    """
+    interval = POLL_INITIAL_INTERVAL
+    polls = 0
+    while True:
+        # A run never finishes instantly, so wait before every check
+        remaining = deadline - time.monotonic()
+        await asyncio.sleep(max(0, min(remaining, interval * random.uniform(0.8, 1.2))))
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+        count_api_call("runs.retrieve")
+        run_status = await async_client.beta.threads.runs.retrieve(
+            thread_id=thread_id,
+            run_id=run_id
+        )
+        polls += 1
+        status = run_status.status
+        if status in RUN_STOP_STATUSES or time.monotonic() >= deadline:
+            return status, polls, run_status
+
+
+async def wait_for_run_async(thread_id, run, deadline, business_number=None):
+    """
+    Poll a run until it finishes, executing tool calls when it requires action.
+
+    Returns (status, number of API calls made).
+    """
+    started = time.monotonic()
+    calls = 0
+    polls = 0
+    while True:
+        status, run_polls, run = await poll_run_async(thread_id, run.id, deadline)
+        calls += run_polls
+        polls += run_polls
+        if status != 'requires_action' or time.monotonic() >= deadline:
+            break
+
+        logging.info("Run requires action - calling tools")
+        tool_outputs = await asyncio.to_thread(
+            tool_registry.execute, run.required_action.submit_tool_outputs.tool_calls, business_number
+        )
+        count_api_call("runs.submit_tool_outputs")
+        calls += 1
+        run = await async_client.beta.threads.runs.submit_tool_outputs(
+            thread_id=thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs
+        )
+
+    metrics.increment("assistant_runs_polled")
+    metrics.observe("assistant_run_seconds", time.monotonic() - started)
+    metrics.observe("assistant_run_polls", polls)
+    return status, calls
+
+
+async def generate_response_async(message, user_id, user_name=None, business_number=None):
+    """
+    Async counterpart of openai_service.generate_response.
+
+    Waiting on the run only suspends the coroutine, so a single process can
+    keep thousands of conversations in flight.
+    """
+    try:
+        assistant_id = get_assistant_id_for_business(business_number)
+        if not assistant_id:
+            raise ValueError("No OpenAI Assistant ID found in environment variables")
+
+        thread_id = await lookup_thread_id_async(user_id, business_number)
+        context = await asyncio.to_thread(knowledge_context, message, business_number)
+
+        run_calls = 1
+        if thread_id is not None:
+            await asyncio.to_thread(run_lifecycle.ensure_idle, thread_id)
+        try:
+            run = await start_run_async(thread_id, assistant_id, message, context)
+        except NotFoundError as e:
+            if thread_id is None or thread_id not in str(e):
+                raise
+            logging.warning(f"Thread {thread_id} for user {user_id} no longer exists, recreating it")
+            await asyncio.to_thread(forget_thread, user_id, business_number)
+            thread_id = None
+            run_calls += 1
+            run = await start_run_async(None, assistant_id, message, context)
+
+        # Record the run before anything else, so others wait for it instead of cancelling it
+        await asyncio.to_thread(run_lifecycle.begin, run.thread_id, run.id)
+        if run.thread_id != thread_id:
+            await asyncio.to_thread(remember_thread, user_id, run.thread_id, business_number)
+            logging.info(f"New thread created for user {user_id}: {run.thread_id}")
+        else:
+            await asyncio.to_thread(touch_thread, user_id, thread_id, business_number)
+        thread_id = run.thread_id
+
+        status = None
+        try:
+            status, wait_calls = await wait_for_run_async(
+                thread_id, run, time.monotonic() + RUN_TIMEOUT_SECONDS, business_number
+            )
+        finally:
+            if status in RUN_TERMINAL_STATUSES:
+                await asyncio.to_thread(run_lifecycle.end, thread_id, run.id)
+            else:
+                # Timed out (or failed mid-way): stop the run so the thread accepts the next one
+                try:
+                    await asyncio.to_thread(run_lifecycle.cancel, thread_id, run.id)
+                except Exception as e:
+                    logging.error(f"Error cancelling run {run.id}: {str(e)}")
+        metrics.observe("openai_calls_per_reply", run_calls + wait_calls + (1 if status == 'completed' else 0))
+
+        if status in ['failed', 'cancelled', 'expired']:
+            logging.error(f"Run failed with status: {status}")
+            return "I apologize, but I encountered an error while processing your request."
+
+        if status != 'completed':
+            logging.error("Run timed out")
+            return "I apologize, but the request is taking too long to process. Please try again."
+
+        count_api_call("messages.list")
+        messages = await async_client.beta.threads.messages.list(
+            thread_id=thread_id,
+            run_id=run.id,
+            order='desc',
+            limit=1
+        )
+
+        if messages.data and messages.data[0].content:
+            response = messages.data[0].content[0].text.value
+            logging.info(f"Generated response for user {user_id} (business {business_number}): {response[:100]}...")
+            return response
+
+        return "I apologize, but I couldn't generate a response at this time."
+
+    except Exception as e:
+        logging.error(f"Error generating response for user {user_id} (business {business_number}): {str(e)}")
+        return "I apologize, but I encountered an error while processing your request."
@@ -1,11 +1,20 @@
-from openai import OpenAI
-import shelve
+from openai import BadRequestError, NotFoundError, OpenAI
 from dotenv import load_dotenv
 import os
+import math
+import random
+import threading
 import time
 import logging
 from flask import current_app
+from app.services.assistant_cache import AssistantMetadataCache
 from app.services.knowledge_base import knowledge_base
+from app.services.metrics import metrics
+from app.services.run_lifecycle import RunLifecycle, is_active_run_error
+from app.services.tenant_registry import tenant_registry
+from app.services.thread_store import thread_store
+from app.services.tools import tool_registry
+from app.utils.lru import LRUCache
 import json
 
 load_dotenv()
@@ -16,27 +25,47 @@ client = OpenAI(
     default_headers={"OpenAI-Beta": "assistants=v2"}
 )
 
-# Thread storage file path
-THREAD_DB_PATH = "threads.db"
+# Runs: stream events when possible, otherwise poll with exponential backoff
+RUN_TIMEOUT_SECONDS = 60
+ASSISTANT_STREAMING = os.getenv("ASSISTANT_STREAMING", "true").lower() != "false"
+POLL_INITIAL_INTERVAL = 0.25
+POLL_MAX_INTERVAL = 2.0
+POLL_BACKOFF = 1.6
+RUN_TERMINAL_STATUSES = {'completed', 'failed', 'cancelled', 'expired', 'incomplete'}
+RUN_STOP_STATUSES = RUN_TERMINAL_STATUSES | {'requires_action'}
+
+# Add the knowledge base snippets relevant to each message to the run's instructions
+KNOWLEDGE_CONTEXT = os.getenv("KNOWLEDGE_CONTEXT", "true").lower() != "false"
+
+# Thread IDs known to exist, so the hot path can skip threads.retrieve
+THREAD_CACHE_SIZE = int(os.getenv("THREAD_CACHE_SIZE", "10000"))
+known_threads = LRUCache(THREAD_CACHE_SIZE)
+
+# OpenAI calls made by the reply currently being generated on this thread
+_reply_calls = threading.local()
+
+
+def count_api_call(endpoint):
+    """Record one OpenAI API call, both in the metrics and against the current reply"""
+    metrics.increment(f"openai_calls.{endpoint}")
+    _reply_calls.count = getattr(_reply_calls, "count", 0) + 1
+
+
+def _retrieve_assistant(assistant_id):
+    count_api_call("assistants.retrieve")
+    return client.beta.assistants.retrieve(assistant_id)
+
+
+# Assistant metadata is only logged, so don't fetch it on every message
+assistant_cache = AssistantMetadataCache(_retrieve_assistant)
+
+# Runs in flight per thread, so timed-out and abandoned runs get cancelled
+run_lifecycle = RunLifecycle(client, count_api_call, run_timeout=RUN_TIMEOUT_SECONDS)
 
 def get_assistant_id_for_business(business_number):
     """Get the assistant ID for a specific business number"""
-    if business_number:
-        assistant_id = os.getenv(f"OPENAI_ASSISTANT_ID_{business_number}")
-        if assistant_id:
-            return assistant_id
-    
-    # Fallback to generic assistant ID
-    assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
-    if assistant_id:
-        return assistant_id
-    
-    # If no business-specific or generic assistant ID found, use the first available
-    for key in os.environ:
-        if key.startswith("OPENAI_ASSISTANT_ID_"):
-            return os.getenv(key)
-    
-    return None
+    # Falls back to OPENAI_ASSISTANT_ID, then to the first configured assistant
+    return tenant_registry.assistant_id_for(business_number)
 
 
 def upload_file(file_path):
@@ -105,138 +134,389 @@ For any technical or complex inquiries, direct the user to contact our support t
         raise
 
 
-def get_or_create_thread(user_id):
+def _thread_key(user_id, business_number):
+    """A user has a separate thread with every business they write to"""
+    return f"{business_number}:{user_id}"
+
+
+def lookup_thread_id(user_id, business_number=None):
     """
-    Get an existing thread for a user or create a new one.
+    Get the known thread ID for a user of a business, or None for a first-contact user.
     """
-    try:
-        # Check if thread exists in storage
-        thread_id = check_if_thread_exists(user_id)
+    thread_id = known_threads.get(_thread_key(user_id, business_number))
+    if not thread_id:
+        thread_id = check_if_thread_exists(user_id, business_number)
         if thread_id:
-            try:
-                thread = client.beta.threads.retrieve(thread_id)
-                return thread
-            except Exception as e:
-                logging.warning(f"Could not retrieve thread {thread_id}: {str(e)}")
-                # If thread doesn't exist on OpenAI side, remove from storage and create new
-                remove_thread(user_id)
-        
-        # Create new thread if none exists
-        thread = client.beta.threads.create()
-        store_thread(user_id, thread.id)
-        logging.info(f"New thread created for user {user_id}: {thread.id}")
-        return thread
+            known_threads.put(_thread_key(user_id, business_number), thread_id)
+    return thread_id
+
+
+def remember_thread(user_id, thread_id, business_number=None):
+    """
+    Store a user's thread ID and mark it as known to exist.
+    """
+    store_thread(user_id, thread_id, business_number)
+    known_threads.put(_thread_key(user_id, business_number), thread_id)
+
+
+def record_exchange(user_id, message, answer, business_number=None):
+    """
+    Add a question and an answer that was given without a run (e.g. from the
+    answer cache) to the user's thread, so later runs know about them.
+    """
+    messages = [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+    thread_id = lookup_thread_id(user_id, business_number)
+    if thread_id is None:
+        count_api_call("threads.create")
+        thread_id = client.beta.threads.create(messages=messages).id
+        remember_thread(user_id, thread_id, business_number)
+        return thread_id
+    for entry in messages:
+        count_api_call("messages.create")
+        client.beta.threads.messages.create(thread_id=thread_id, **entry)
+    touch_thread(user_id, thread_id, business_number)
+    return thread_id
+
+
+def touch_thread(user_id, thread_id, business_number=None):
+    """
+    Record activity on a user's thread so the sweeper doesn't expire it.
+    Also restores the mapping if it was expired while cached here.
+    """
+    try:
+        thread_store.touch(user_id, thread_id, business_number)
     except Exception as e:
-        logging.error(f"Error in get_or_create_thread: {str(e)}")
-        raise
+        logging.error(f"Error recording thread activity: {str(e)}")
+
+
+def forget_thread(user_id, business_number=None):
+    """
+    Drop a user's thread mapping after OpenAI reported the thread as not found.
+    """
+    known_threads.pop(_thread_key(user_id, business_number))
+    remove_thread(user_id, business_number)
 
 
-def check_if_thread_exists(user_id):
+def check_if_thread_exists(user_id, business_number=None):
     """
-    Check if a thread exists for the given user ID.
+    Check if a thread exists for the given user ID and business.
     """
     try:
-        with shelve.open(THREAD_DB_PATH) as shelf:
-            return shelf.get(str(user_id))
+        return thread_store.get(user_id, business_number)
     except Exception as e:
         logging.error(f"Error checking thread existence: {str(e)}")
         return None
 
 
-def store_thread(user_id, thread_id):
+def store_thread(user_id, thread_id, business_number=None):
     """
     Store the thread ID for a user.
     """
     try:
-        with shelve.open(THREAD_DB_PATH) as shelf:
-            shelf[str(user_id)] = thread_id
+        thread_store.put(user_id, thread_id, business_number)
         logging.info(f"Thread {thread_id} stored for user {user_id}")
     except Exception as e:
         logging.error(f"Error storing thread: {str(e)}")
 
 
-def remove_thread(user_id):
+def remove_thread(user_id, business_number=None):
     """
     Remove thread ID for a user from storage.
     """
     try:
-        with shelve.open(THREAD_DB_PATH) as shelf:
-            if str(user_id) in shelf:
-                del shelf[str(user_id)]
-                logging.info(f"Thread removed for user {user_id}")
+        if thread_store.delete(user_id, business_number):
+            logging.info(f"Thread removed for user {user_id}")
     except Exception as e:
         logging.error(f"Error removing thread: {str(e)}")
 
 
+def knowledge_context(message, business_number=None):
+    """
+    The knowledge base snippets relevant to a message, formatted as run instructions.
+    """
+    if not KNOWLEDGE_CONTEXT:
+        return None
+    snippets = knowledge_base.get_relevant_info(message, business_number)
+    if not snippets:
+        return None
+    return "Relevant knowledge base entries:\n" + "\n".join(f"- {snippet}" for snippet in snippets)
+
+
+def start_run(thread_id, assistant_id, message, stream=False, context=None):
+    """
+    Create the run that answers a user message, posting the message in the same call.
+
+    First-contact users (thread_id None) get a new thread via
+    threads.create_and_run; existing threads get runs.create with the message
+    as additional_messages. context is appended to the assistant's instructions
+    for this run only.
+    """
+    user_message = {"role": "user", "content": message}
+    if thread_id is None:
+        options = {}
+        if context:
+            # create_and_run has no additional_instructions, so extend the
+            # assistant's own instructions instead
+            try:
+                instructions = assistant_cache.get(assistant_id).instructions or ""
+                options["instructions"] = f"{instructions}\n\n{context}".strip()
+            except Exception as e:
+                logging.error(f"Error retrieving assistant details: {str(e)}")
+        count_api_call("threads.create_and_run")
+        return client.beta.threads.create_and_run(
+            assistant_id=assistant_id,
+            thread={"messages": [user_message]},
+            stream=stream,
+            **options
+        )
+    options = {"additional_instructions": context} if context else {}
+    for attempt in range(2):
+        try:
+            count_api_call("runs.create")
+            return client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                additional_messages=[user_message],
+                stream=stream,
+                **options
+            )
+        except BadRequestError as e:
+            # A run we lost track of is still going on the thread; stop it and try again
+            if attempt or not is_active_run_error(e) or not run_lifecycle.clear_thread(thread_id):
+                raise
+
+
+def run_assistant(thread_id, assistant_id, message, context=None, business_number=None, max_wait_time=RUN_TIMEOUT_SECONDS):
+    """
+    Post a user message, run the assistant and wait for it to finish.
+
+    Uses the streaming Assistants API when available, which delivers the reply
+    the moment the run completes; otherwise falls back to polling with
+    exponential backoff and reading the reply the run produced. Tool calls
+    (requires_action) are executed with the tool registry and submitted so
+    the run carries on. Returns (status, thread ID, reply text or None).
+    """
+    if thread_id is not None:
+        run_lifecycle.ensure_idle(thread_id)
+
+    started = time.monotonic()
+    deadline = started + max_wait_time
+    status, run, response = None, None, None
+    streamed = False
+
+    try:
+        if ASSISTANT_STREAMING:
+            try:
+                status, thread_id, run, response = consume_run_stream(
+                    start_run(thread_id, assistant_id, message, stream=True, context=context),
+                    thread_id,
+                    deadline
+                )
+                streamed = status is not None
+            except (NotFoundError, BadRequestError):
+                raise
+            except Exception as e:
+                logging.warning(f"Streaming run unavailable, falling back to polling: {str(e)}")
+
+        if run is None and status is None:
+            run = start_run(thread_id, assistant_id, message, context=context)
+            thread_id = run.thread_id
+        run_lifecycle.begin(thread_id, run.id)
+
+        polls = 0
+        while True:
+            if status not in RUN_STOP_STATUSES:
+                status, run_polls, run = poll_run(thread_id, run.id, deadline)
+                polls += run_polls
+                streamed = False
+
+            if status != 'requires_action' or time.monotonic() >= deadline:
+                break
+
+            logging.info("Run requires action - calling tools")
+            tool_outputs = tool_registry.execute(run.required_action.submit_tool_outputs.tool_calls, business_number)
+            status, run, response = submit_tool_outputs(thread_id, run, tool_outputs, deadline)
+    finally:
+        if run is not None:
+            if status in RUN_TERMINAL_STATUSES:
+                run_lifecycle.end(thread_id, run.id)
+            else:
+                # Timed out (or failed mid-way): stop the run so the thread accepts the next one
+                try:
+                    run_lifecycle.cancel(thread_id, run.id)
+                except Exception as e:
+                    logging.error(f"Error cancelling run {run.id}: {str(e)}")
+
+    metrics.increment("assistant_runs_streamed" if streamed else "assistant_runs_polled")
+    elapsed = time.monotonic() - started
+    metrics.observe("assistant_run_seconds", elapsed)
+    metrics.observe("assistant_run_polls", polls)
+    if status == 'completed':
+        # The old loop checked once a second, so it noticed completion at the next whole second
+        metrics.observe("assistant_run_seconds_saved", math.ceil(elapsed) - elapsed)
+        metrics.increment("assistant_run_polls_saved", max(0, math.ceil(elapsed) + 1 - polls))
+        if response is None:
+            response = get_run_reply(thread_id, run.id)
+    return status, thread_id, response
+
+
+def consume_run_stream(stream, thread_id, deadline):
+    """
+    Read a run's event stream until the run stops.
+
+    Returns (status, thread ID, run, reply text), where run is the last run
+    object seen. Raises if the stream fails before the run was created; if it
+    breaks later, returns status None so the caller can poll the run.
+    """
+    status, run, response = None, None, None
+    try:
+        with stream:
+            for event in stream:
+                if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                    if run is None or run.id != event.data.id:
+                        # Record the run as soon as it exists, so others wait for it instead of cancelling it
+                        run_lifecycle.begin(event.data.thread_id, event.data.id)
+                    run = event.data
+                    thread_id = run.thread_id
+                    if run.status in RUN_STOP_STATUSES:
+                        status = run.status
+                        break
+                elif event.event == "thread.message.completed" and event.data.content:
+                    response = event.data.content[0].text.value
+                if time.monotonic() > deadline:
+                    break
+    except Exception as e:
+        if run is None:
+            raise
+        logging.warning(f"Run stream for {run.id} interrupted, polling instead: {str(e)}")
+    return status, thread_id, run, response
+
+
+def submit_tool_outputs(thread_id, run, tool_outputs, deadline):
+    """
+    Hand tool results back to a run. Returns (status, run, reply text); status
+    is None when the run is still going and has to be polled.
+    """
+    count_api_call("runs.submit_tool_outputs")
+    if ASSISTANT_STREAMING:
+        try:
+            stream = client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run.id,
+                tool_outputs=tool_outputs,
+                stream=True
+            )
+            status, _, streamed_run, response = consume_run_stream(stream, thread_id, deadline)
+            return status, streamed_run or run, response
+        except Exception as e:
+            logging.warning(f"Streaming tool outputs failed, polling instead: {str(e)}")
+            return None, run, None
+
+    run = client.beta.threads.runs.submit_tool_outputs(
+        thread_id=thread_id,
+        run_id=run.id,
+        tool_outputs=tool_outputs
+    )
+    return None, run, None
+
+
+def get_run_reply(thread_id, run_id):
+    """
+    Read the reply a completed run posted to its thread.
+    """
+    count_api_call("messages.list")
+    messages = client.beta.threads.messages.list(
+        thread_id=thread_id,
+        run_id=run_id,
+        order='desc',
+        limit=1
+    )
+    if messages.data and messages.data[0].content:
+        return messages.data[0].content[0].text.value
+    return None
+
+
+def poll_run(thread_id, run_id, deadline):
+    """
+    Poll a run with exponential backoff and jitter until it stops (including
+    requires_action) or the deadline passes.
+
+    Returns (status, number of polls, run).
+    """
+    interval = POLL_INITIAL_INTERVAL
+    polls = 0
+    while True:
+        # A run never finishes instantly, so wait before every check
+        remaining = deadline - time.monotonic()
+        time.sleep(max(0, min(remaining, interval * random.uniform(0.8, 1.2))))
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+        count_api_call("runs.retrieve")
+        run_status = client.beta.threads.runs.retrieve(
+            thread_id=thread_id,
+            run_id=run_id
+        )
+        polls += 1
+        status = run_status.status
+        if status in RUN_STOP_STATUSES or time.monotonic() >= deadline:
+            return status, polls, run_status
+
+
 def generate_response(message, user_id, user_name=None, business_number=None):
     """
     Generate a response using OpenAI's Assistant API.
+
+    A reply normally takes a single streamed call (two or three when the run
+    has to be polled); the number of calls is recorded as openai_calls_per_reply.
     """
+    _reply_calls.count = 0
     try:
-        # Get or create thread for this user
-        thread = get_or_create_thread(user_id)
-        
-        # Add user message to thread
-        client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=message
-        )
-        
         # Get assistant ID for the business
         assistant_id = get_assistant_id_for_business(business_number)
         if not assistant_id:
             raise ValueError("No OpenAI Assistant ID found in environment variables")
         
-        # Log assistant details
+        # Log assistant details (cached, refreshed in the background)
         try:
-            assistant = client.beta.assistants.retrieve(assistant_id)
+            assistant = assistant_cache.get(assistant_id)
             logging.info(f"Using assistant: {assistant.name} (ID: {assistant.id}) for business {business_number}")
             logging.info(f"Assistant model: {assistant.model}")
             logging.info(f"Assistant instructions: {assistant.instructions[:200]}...")
         except Exception as e:
             logging.error(f"Error retrieving assistant details: {str(e)}")
         
-        # Run the assistant
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id
-        )
+        # Existing users continue their thread; first-contact users get one
+        # created together with the run
+        thread_id = lookup_thread_id(user_id, business_number)
+        context = knowledge_context(message, business_number)
         
-        # Wait for the run to complete with timeout
-        max_wait_time = 60  # 60 seconds timeout
-        wait_time = 0
+        # A stale thread ID shows up as not-found when the run is created, in
+        # which case the user starts over on a new thread
+        try:
+            status, run_thread_id, response = run_assistant(thread_id, assistant_id, message, context, business_number)
+        except NotFoundError as e:
+            if thread_id is None or thread_id not in str(e):
+                raise
+            logging.warning(f"Thread {thread_id} for user {user_id} no longer exists, recreating it")
+            forget_thread(user_id, business_number)
+            thread_id = None
+            status, run_thread_id, response = run_assistant(None, assistant_id, message, context, business_number)
         
-        while wait_time < max_wait_time:
-            run_status = client.beta.threads.runs.retrieve(
-                thread_id=thread.id,
-                run_id=run.id
-            )
-            
-            if run_status.status == 'completed':
-                break
-            elif run_status.status in ['failed', 'cancelled', 'expired']:
-                logging.error(f"Run failed with status: {run_status.status}")
-                return "I apologize, but I encountered an error while processing your request."
-            elif run_status.status == 'requires_action':
-                logging.info("Run requires action - function calls needed")
-                
-            time.sleep(1)
-            wait_time += 1
+        if run_thread_id and run_thread_id != thread_id:
+            remember_thread(user_id, run_thread_id, business_number)
+            logging.info(f"New thread created for user {user_id}: {run_thread_id}")
+        elif run_thread_id:
+            touch_thread(user_id, run_thread_id, business_number)
+        
+        if status in ['failed', 'cancelled', 'expired']:
+            logging.error(f"Run failed with status: {status}")
+            return "I apologize, but I encountered an error while processing your request."
         
-        if wait_time >= max_wait_time:
+        if status != 'completed':
             logging.error("Run timed out")
             return "I apologize, but the request is taking too long to process. Please try again."
         
-        # Get the latest message from the assistant
-        messages = client.beta.threads.messages.list(
-            thread_id=thread.id,
-            order='desc',
-            limit=1
-        )
-        
-        if messages.data and messages.data[0].content:
-            response = messages.data[0].content[0].text.value
+        if response is not None:
             logging.info(f"Generated response for user {user_id} (business {business_number}): {response[:100]}...")
             return response
             
@@ -245,14 +525,16 @@ def generate_response(message, user_id, user_name=None, business_number=None):
     except Exception as e:
         logging.error(f"Error generating response for user {user_id} (business {business_number}): {str(e)}")
         return "I apologize, but I encountered an error while processing your request."
+    finally:
+        metrics.observe("openai_calls_per_reply", _reply_calls.count)
 
 
-def get_thread_messages(user_id, limit=10):
+def get_thread_messages(user_id, limit=10, business_number=None):
     """
     Get conversation history for a user.
     """
     try:
-        thread_id = check_if_thread_exists(user_id)
+        thread_id = check_if_thread_exists(user_id, business_number)
         if not thread_id:
             return []
         
@@ -268,12 +550,13 @@ def get_thread_messages(user_id, limit=10):
         return []
 
 
-def clear_user_thread(user_id):
+def clear_user_thread(user_id, business_number=None):
     """
     Clear the thread for a user (start fresh conversation).
     """
     try:
-        remove_thread(user_id)
+        known_threads.pop(_thread_key(user_id, business_number))
+        remove_thread(user_id, business_number)
         logging.info(f"Thread cleared for user {user_id}")
         return True
     except Exception as e:
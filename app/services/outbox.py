@@ -0,0 +1,399 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from app.services.dedupe import message_deduplicator
+from app.services.graph_client import graph_clients
+from app.services.metrics import metrics
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+# A send that is not finished within the lease is handed to another worker
+OUTBOX_LEASE_SECONDS = 60
+
+# Graph API errors that mean "slow down" rather than "this message is bad":
+# the business account or app is sending too fast overall...
+THROUGHPUT_LIMIT_CODES = {4, 613, 80007, 130429}
+THROUGHPUT_RETRY_SECONDS = 10
+# ...or too many messages went to the same recipient in a short time
+PAIR_LIMIT_CODES = {131056}
+PAIR_RETRY_SECONDS = 6
+
+
+def graph_error(response):
+    """(code, message) from a Graph API error response"""
+    try:
+        error = response.json().get("error") or {}
+    except ValueError:
+        error = {}
+    return error.get("code"), error.get("message") or response.text[:200]
+
+
+def backoff(attempts, floor=0.0):
+    """Exponential backoff with jitter, at least floor seconds"""
+    delay = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return max(floor, delay * random.uniform(0.8, 1.2))
+
+
+class Outbox:
+    """
+    Durable queue of outgoing WhatsApp messages, backed by SQLite.
+
+    Every reply is written here before it is sent, so a timeout, a Graph
+    error or a restart cannot lose it. Messages to the same recipient are
+    handed out strictly one at a time and in order, so each part of a split
+    reply (one enqueue_many batch) is only sent once the part before it was.
+    A message that keeps failing is moved to the outbox_dead_letters table
+    after max_attempts, together with the rest of its batch, where it can be
+    inspected and replayed.
+    """
+
+    def __init__(self, path=None, max_attempts=OUTBOX_MAX_ATTEMPTS, lease_seconds=OUTBOX_LEASE_SECONDS):
+        self.path = path or STATE_DB_PATH
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                business_number TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                message_ids TEXT NOT NULL DEFAULT '[]',
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                leased_until REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_error TEXT,
+                batch_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (business_number, recipient, id);
+            CREATE TABLE IF NOT EXISTS outbox_dead_letters (
+                id INTEGER PRIMARY KEY,
+                business_number TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                message_ids TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                last_error TEXT,
+                batch_id INTEGER
+            );
+            """
+        )
+        # Tables created before split replies have no batch_id column
+        for table in ("outbox", "outbox_dead_letters"):
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if "batch_id" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN batch_id INTEGER")
+
+    def enqueue(self, business_number, recipient, payload, message_ids=()):
+        """Persist an outgoing message payload (JSON string) and return its id"""
+        return self.enqueue_many(business_number, recipient, [payload], message_ids)[-1]
+
+    def enqueue_many(self, business_number, recipient, payloads, message_ids=()):
+        """
+        Persist several messages to one recipient in a single transaction; they
+        are sent in order, each once the one before it was. message_ids are
+        marked as sent once the last one is, so only when every part went out.
+        """
+        conn = self._conn()
+        now = time.time()
+        ids = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for i, payload in enumerate(payloads):
+                last = i == len(payloads) - 1
+                cursor = conn.execute(
+                    """
+                    INSERT INTO outbox
+                        (business_number, recipient, payload, message_ids, next_attempt_at, created_at, batch_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        business_number,
+                        recipient,
+                        payload,
+                        json.dumps(list(message_ids) if last else []),
+                        now,
+                        now,
+                        ids[0] if ids else None,  # the first row's batch is its own id
+                    ),
+                )
+                ids.append(cursor.lastrowid)
+        self._wakeup.set()
+        return ids
+
+    def claim(self):
+        """
+        Claim the next message that is due and is the oldest for its recipient.
+        Returns a dict with the message fields, or None.
+        """
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT id, business_number, recipient, payload, message_ids, attempts, created_at FROM outbox o
+                WHERE ((status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND leased_until < ?))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM outbox p
+                      WHERE p.business_number = o.business_number AND p.recipient = o.recipient AND p.id < o.id
+                  )
+                ORDER BY next_attempt_at, id LIMIT 1
+                """,
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, leased_until = ? WHERE id = ?",
+                (now + self.lease_seconds, row[0]),
+            )
+        keys = ("id", "business_number", "recipient", "payload", "message_ids", "attempts", "created_at")
+        message = dict(zip(keys, row))
+        message["message_ids"] = json.loads(message["message_ids"])
+        message["attempts"] += 1
+        return message
+
+    def complete(self, message_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+        # The recipient's next message (e.g. the next part of a reply) is now due
+        self._wakeup.set()
+
+    def retry(self, message_id, delay, error):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', leased_until = 0, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, str(error), message_id),
+            )
+
+    def pause_tenant(self, business_number, delay):
+        """Hold back every pending message of a tenant, e.g. after a throughput limit error"""
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE outbox SET next_attempt_at = MAX(next_attempt_at, ?) WHERE business_number = ? AND status = 'pending'",
+                (time.time() + delay, business_number),
+            )
+
+    def dead_letter(self, message_id, error):
+        """
+        Move a message out of the outbox so it stops blocking its recipient's
+        queue. The later parts of its batch go with it: sending them would
+        leave a gap in the reply, and the messages it answers are then never
+        marked as sent.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT COALESCE(batch_id, id) FROM outbox WHERE id = ?", (message_id,)).fetchone()
+            batch_id = row[0] if row else message_id
+            where = "COALESCE(batch_id, id) = :batch_id AND id >= :id"
+            params = {"id": message_id, "batch_id": batch_id, "now": time.time(), "error": str(error)}
+            conn.execute(
+                f"""
+                INSERT OR REPLACE INTO outbox_dead_letters
+                    (id, business_number, recipient, payload, message_ids, attempts, created_at, failed_at,
+                     last_error, batch_id)
+                SELECT id, business_number, recipient, payload, message_ids, attempts, created_at, :now,
+                       CASE WHEN id = :id THEN :error ELSE 'Earlier part of the reply failed' END, batch_id
+                FROM outbox WHERE {where}
+                """,
+                params,
+            )
+            conn.execute(f"DELETE FROM outbox WHERE {where}", params)
+
+    def dead_letters(self, limit=100):
+        rows = self._conn().execute(
+            """
+            SELECT id, business_number, recipient, attempts, failed_at, last_error
+            FROM outbox_dead_letters ORDER BY failed_at DESC LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+        keys = ("id", "business_number", "recipient", "attempts", "failed_at", "last_error")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def replay(self, dead_letter_id):
+        """
+        Put a dead-lettered message back in the outbox with a fresh set of
+        attempts, followed by the later parts of its batch that were
+        dead-lettered with it. Returns the new id of the message, or None.
+        """
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT COALESCE(batch_id, id) FROM outbox_dead_letters WHERE id = ?", (dead_letter_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            where = "COALESCE(batch_id, id) = :batch_id AND id >= :id"
+            params = {"id": dead_letter_id, "batch_id": row[0], "now": now}
+            rows = conn.execute(
+                f"SELECT business_number, recipient, payload, message_ids, created_at FROM outbox_dead_letters "
+                f"WHERE {where} ORDER BY id",
+                params,
+            ).fetchall()
+            ids = []
+            for business_number, recipient, payload, message_ids, created_at in rows:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO outbox
+                        (business_number, recipient, payload, message_ids, next_attempt_at, created_at, batch_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (business_number, recipient, payload, message_ids, now, created_at, ids[0] if ids else None),
+                )
+                ids.append(cursor.lastrowid)
+            conn.execute(f"DELETE FROM outbox_dead_letters WHERE {where}", params)
+        self._wakeup.set()
+        return ids[0]
+
+    def depth(self):
+        """(messages waiting or being sent, dead letters)"""
+        conn = self._conn()
+        return (
+            conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM outbox_dead_letters").fetchone()[0],
+        )
+
+    def wait(self, timeout):
+        """Block until a message is enqueued in this process or the timeout elapses"""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+
+class OutboxSender:
+    """
+    Pool of daemon threads that send outbox messages through the tenants'
+    Graph clients.
+
+    Errors are sorted into three kinds. Rate limits are retried no sooner
+    than the Graph API allows: a throughput limit holds back all of the
+    tenant's messages, and a pair limit holds back that recipient's.
+    Timeouts, connection errors and 5xx responses are retried with
+    exponential backoff. Any other 4xx will not succeed on a retry, so the
+    message is dead-lettered right away.
+    """
+
+    def __init__(self, outbox, size=OUTBOX_WORKERS, poll_interval=1.0):
+        self.outbox = outbox
+        self.size = size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.size):
+            thread = threading.Thread(target=self._run, name=f"outbox-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.size} outbox senders")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self.outbox._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                message = self.outbox.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming outbox message: {str(e)}")
+                message = None
+
+            if message is None:
+                # Other processes may enqueue too, and retries become due over time
+                self.outbox.wait(self.poll_interval)
+                continue
+
+            try:
+                self.deliver(message)
+            except Exception as e:
+                logger.error(f"Error sending outbox message {message['id']}: {str(e)}")
+                self._retry(message, backoff(message["attempts"]), e, "error")
+
+    def deliver(self, message):
+        business_number = message["business_number"]
+        graph = graph_clients.get(business_number)
+        if graph is None:
+            self._dead_letter(message, f"Unknown business number {business_number}")
+            return
+
+        try:
+            response = graph.send(message["payload"])
+        except requests.RequestException as e:
+            self._retry(message, backoff(message["attempts"]), e, "network")
+            return
+
+        if response.status_code == 200:
+            self.outbox.complete(message["id"])
+            for message_id in message["message_ids"]:
+                message_deduplicator.mark_sent(message_id)
+            metrics.increment("outbox_sent")
+            metrics.observe("outbox_delivery_seconds", time.time() - message["created_at"])
+            logger.info(f"Message sent successfully to {message['recipient']} via business {business_number}")
+            return
+
+        code, text = graph_error(response)
+        error = f"{response.status_code} (code {code}): {text}"
+        retry_after = float(response.headers.get("Retry-After") or 0)
+        if code in THROUGHPUT_LIMIT_CODES or response.status_code == 429:
+            delay = backoff(message["attempts"], max(retry_after, THROUGHPUT_RETRY_SECONDS))
+            self.outbox.pause_tenant(business_number, delay)
+            self._retry(message, delay, error, "throughput_limit")
+        elif code in PAIR_LIMIT_CODES:
+            self._retry(message, backoff(message["attempts"], max(retry_after, PAIR_RETRY_SECONDS)), error, "pair_limit")
+        elif response.status_code >= 500 or response.status_code == 408:
+            self._retry(message, backoff(message["attempts"], retry_after), error, "server_error")
+        else:
+            self._dead_letter(message, error)
+
+    def _retry(self, message, delay, error, reason):
+        if message["attempts"] >= self.outbox.max_attempts:
+            self._dead_letter(message, error)
+            return
+        logger.warning(f"Retrying outbox message {message['id']} in {delay:.1f}s ({reason}): {error}")
+        metrics.increment(f"outbox_retries.{reason}")
+        self.outbox.retry(message["id"], delay, error)
+
+    def _dead_letter(self, message, error):
+        logger.error(f"Outbox message {message['id']} to {message['recipient']} failed after {message['attempts']} attempts: {error}")
+        metrics.increment("outbox_dead_lettered")
+        self.outbox.dead_letter(message["id"], error)
+
+
+# Create singleton instances
+outbox = Outbox()
+outbox_sender = OutboxSender(outbox)
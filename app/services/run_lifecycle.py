@@ -0,0 +1,228 @@
+import logging
+import os
+import time
+
+from openai import BadRequestError, NotFoundError
+
+from app.services.metrics import metrics
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for OpenAI to confirm a cancellation before giving up
+RUN_CANCEL_WAIT_SECONDS = float(os.getenv("RUN_CANCEL_WAIT_SECONDS", "10"))
+RUN_FINAL_STATUSES = {'completed', 'failed', 'cancelled', 'expired', 'incomplete'}
+RUN_ACTIVE_STATUSES = {'queued', 'in_progress', 'requires_action', 'cancelling'}
+
+
+def is_active_run_error(error):
+    """True for the 400 OpenAI returns when a thread still has a run going"""
+    return isinstance(error, BadRequestError) and "active run" in str(error)
+
+
+def process_alive(pid):
+    """Whether a process on this host is still running"""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RunLifecycle:
+    """
+    Tracks the assistant runs in flight per thread and cleans up after them.
+
+    Active runs are recorded in the shared state database together with the
+    process that owns them, so a run left behind by a crashed worker or a
+    shutdown is known to every process. A thread only accepts one active run
+    at a time, so before a new run starts, ensure_idle() waits for a run
+    that is still owned by a live process (another worker, thread or
+    coroutine answering the same user) to finish. A run is only cancelled as
+    orphaned when its owner is gone or it has outlived run_timeout plus the
+    owner's own cancellation; those are counted as orphaned on /metrics.
+    """
+
+    def __init__(
+        self,
+        client,
+        count_call=lambda endpoint: None,
+        path=None,
+        cancel_wait_seconds=RUN_CANCEL_WAIT_SECONDS,
+        run_timeout=60,
+    ):
+        self.client = client
+        self.count_call = count_call
+        self.path = path or STATE_DB_PATH
+        self.cancel_wait_seconds = cancel_wait_seconds
+        self.run_timeout = run_timeout
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS active_runs (
+                thread_id TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                started_at REAL NOT NULL
+            )
+            """
+        )
+
+    def begin(self, thread_id, run_id):
+        """Record a run as owned by this process; repeated calls for the same run are no-ops"""
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO active_runs (thread_id, run_id, pid, started_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (thread_id) DO UPDATE SET
+                    run_id = excluded.run_id, pid = excluded.pid, started_at = excluded.started_at
+                WHERE active_runs.run_id != excluded.run_id
+                """,
+                (thread_id, run_id, os.getpid(), time.time()),
+            )
+
+    def end(self, thread_id, run_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM active_runs WHERE thread_id = ? AND run_id = ?", (thread_id, run_id))
+
+    def active_run(self, thread_id):
+        row = self._active_run_row(thread_id)
+        return row[0] if row else None
+
+    def _active_run_row(self, thread_id):
+        """(run ID, owner pid, started at) of the run recorded on a thread, or None"""
+        return self._conn().execute(
+            "SELECT run_id, pid, started_at FROM active_runs WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+
+    def is_orphaned(self, pid, started_at):
+        """
+        A run is orphaned once its owner process is gone (pid None: unknown
+        owner), or it has run longer than its owner would have let it.
+        """
+        if time.time() - started_at > self.run_timeout + self.cancel_wait_seconds:
+            return True
+        return pid is not None and not process_alive(pid)
+
+    def _wait_for(self, thread_id, run_id, pid, started_at, finished):
+        """
+        Wait until finished() reports the run done, cancelling it once it is
+        orphaned. Returns True once the run has stopped.
+        """
+        interval = 0.25
+        waited = False
+        while not self.is_orphaned(pid, started_at):
+            if not waited:
+                logger.info(f"Waiting for run {run_id} on thread {thread_id} to finish")
+                metrics.increment("runs_waited_for")
+                waited = True
+            time.sleep(interval)
+            interval = min(interval * 2, 2.0)
+            if finished():
+                return True
+        logger.warning(f"Run {run_id} on thread {thread_id} is orphaned, cancelling it")
+        metrics.increment("orphaned_runs_cleaned")
+        return self.cancel(thread_id, run_id, reason="orphaned")
+
+    def cancel(self, thread_id, run_id, reason="timeout"):
+        """
+        Cancel a run and wait for the cancellation to land. Returns True once
+        the run has stopped; otherwise it stays recorded as active.
+        """
+        deadline = time.monotonic() + self.cancel_wait_seconds
+        try:
+            self.count_call("runs.cancel")
+            status = self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id).status
+        except BadRequestError:
+            # Already finished (or finishing) on its own
+            status = None
+        except NotFoundError:
+            # The thread or run is gone, so nothing is left running
+            self.end(thread_id, run_id)
+            return True
+
+        interval = 0.25
+        while status not in RUN_FINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Run {run_id} on thread {thread_id} did not stop within {self.cancel_wait_seconds}s")
+                metrics.increment("runs_cancel_unconfirmed")
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, 2.0)
+            self.count_call("runs.retrieve")
+            status = self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id).status
+
+        self.end(thread_id, run_id)
+        metrics.increment(f"runs_cancelled_{reason}")
+        logger.info(f"Run {run_id} on thread {thread_id} stopped ({status}) after {reason}")
+        return True
+
+    def ensure_idle(self, thread_id):
+        """
+        Make sure no earlier recorded run is still going on a thread before
+        starting one: wait for a live owner to finish it, cancel an orphan.
+        """
+        row = self._active_run_row(thread_id)
+        if row is None:
+            return True
+        run_id, pid, started_at = row
+
+        def finished():
+            if self.active_run(thread_id) != run_id:
+                return True
+            if self._run_finished(thread_id, run_id):
+                # Its owner is still about to record that
+                self.end(thread_id, run_id)
+                return True
+            return False
+
+        return self._wait_for(thread_id, run_id, pid, started_at, finished)
+
+    def _run_finished(self, thread_id, run_id):
+        self.count_call("runs.retrieve")
+        return self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id).status in RUN_FINAL_STATUSES
+
+    def clear_thread(self, thread_id):
+        """
+        Deal with whatever run OpenAI reports as active on a thread, even one
+        this service has no record of (e.g. started by a worker that was
+        killed, or still being created by another one). Runs are waited for
+        or cancelled as in ensure_idle; an unrecorded run counts as orphaned
+        once it is older than the run timeout.
+        """
+        self.count_call("runs.list")
+        runs = self.client.beta.threads.runs.list(thread_id=thread_id, order="desc", limit=5)
+        row = self._active_run_row(thread_id)
+        cleared = True
+        for run in runs.data:
+            if run.status not in RUN_ACTIVE_STATUSES:
+                continue
+            if row is not None and row[0] == run.id:
+                pid, started_at = row[1], row[2]
+            else:
+                pid, started_at = None, run.created_at
+            cleared = self._wait_for(
+                thread_id, run.id, pid, started_at, lambda: self._run_finished(thread_id, run.id)
+            ) and cleared
+        return cleared
+
+    def cancel_all(self):
+        """Cancel the runs this process still has in flight, e.g. on shutdown"""
+        rows = self._conn().execute(
+            "SELECT thread_id, run_id FROM active_runs WHERE pid = ?", (os.getpid(),)
+        ).fetchall()
+        for thread_id, run_id in rows:
+            try:
+                self.cancel(thread_id, run_id, reason="shutdown")
+            except Exception as e:
+                logger.error(f"Error cancelling run {run_id} on shutdown: {str(e)}")
+        return len(rows)
@@ -0,0 +1,32 @@
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shared on-disk state (job queue and friends) lives in one SQLite file so that
+# every gunicorn worker process sees the same data.
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+
+_local = threading.local()
+
+
+def connect(path=None):
+    """
+    Return a SQLite connection for the current thread, opened in WAL mode.
+    """
+    path = path or STATE_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        # Lets pages freed by a delete be handed back to the filesystem a few
+        # at a time (see ThreadStore.reclaim); only applies to new databases
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+    return conn
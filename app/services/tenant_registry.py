@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Optional declarative tenant config, merged over the WHATSAPP_*_<number> environment variables:
+# a single file listing tenants and/or a directory with one JSON file per tenant
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+TENANTS_DIR = os.getenv("TENANTS_DIR", "tenants")
+TENANTS_WATCH_INTERVAL = float(os.getenv("TENANTS_WATCH_INTERVAL", "5"))
+
+# Environment variable prefix -> Tenant attribute
+ENV_PREFIXES = {
+    "WHATSAPP_ACCESS_TOKEN_": "access_token",
+    "WHATSAPP_PHONE_NUMBER_ID_": "phone_number_id",
+    "OPENAI_ASSISTANT_ID_": "assistant_id",
+    "APP_SECRET_": "app_secret",
+    "TENANT_WEIGHT_": "weight",
+    "LLM_BACKEND_": "llm_backend",
+    "THREAD_TTL_DAYS_": "thread_ttl_days",
+    "MESSAGES_PER_SECOND_": "messages_per_second",
+    "MESSAGING_LIMIT_": "messaging_limit",
+}
+
+
+class Tenant:
+    """Credentials and settings for one WhatsApp business number"""
+
+    __slots__ = (
+        "business_number",
+        "name",
+        "phone_number_id",
+        "access_token",
+        "assistant_id",
+        "app_secret",
+        "weight",
+        "llm_backend",
+        "thread_ttl_days",
+        "messages_per_second",
+        "messaging_limit",
+    )
+
+    def __init__(self, business_number, **fields):
+        self.business_number = business_number
+        self.name = fields.get("name") or business_number
+        self.phone_number_id = fields.get("phone_number_id")
+        self.access_token = fields.get("access_token")
+        self.assistant_id = fields.get("assistant_id")
+        self.app_secret = fields.get("app_secret")
+        self.weight = float(fields.get("weight") or 1)
+        self.llm_backend = fields.get("llm_backend")
+        ttl = fields.get("thread_ttl_days")
+        self.thread_ttl_days = float(ttl) if ttl not in (None, "") else None
+        # Broadcast limits of the phone number; None means the defaults in broadcast.py
+        self.messages_per_second = float(fields["messages_per_second"]) if fields.get("messages_per_second") else None
+        self.messaging_limit = int(fields["messaging_limit"]) if fields.get("messaging_limit") else None
+
+    def __repr__(self):
+        return f"Tenant({self.business_number!r}, phone_number_id={self.phone_number_id!r})"
+
+
+class _Snapshot:
+    """Immutable set of lookup tables; replaced as a whole on reload"""
+
+    def __init__(self, tenants, default_assistant_id):
+        self.tenants = tenants
+        self.default_assistant_id = default_assistant_id
+        self.by_business_number = {t.business_number: t for t in tenants}
+        self.by_phone_number_id = {t.phone_number_id: t for t in tenants if t.phone_number_id}
+        self.app_secrets = tuple({t.app_secret for t in tenants if t.app_secret})
+
+
+class TenantRegistry:
+    """
+    Tenant lookups built once instead of scanning os.environ per message.
+
+    Tenants come from the WHATSAPP_ACCESS_TOKEN_<number> style environment
+    variables and, optionally, from TENANTS_FILE and the per-tenant files in
+    TENANTS_DIR. The lookup tables are rebuilt off to the side and swapped in
+    with a single assignment, so readers never see a half-loaded registry.
+    reload() runs when a config file changes (see start_watcher) or the
+    process receives SIGHUP.
+    """
+
+    def __init__(self, config_path=TENANTS_FILE, config_dir=TENANTS_DIR):
+        self.config_path = config_path
+        self.config_dir = config_dir
+        self._config_state = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._snapshot = self._build()
+
+    def _config_files(self):
+        paths = [self.config_path] if os.path.isfile(self.config_path) else []
+        if os.path.isdir(self.config_dir):
+            paths += sorted(
+                os.path.join(self.config_dir, name)
+                for name in os.listdir(self.config_dir)
+                if name.endswith(".json")
+            )
+        return paths
+
+    def _current_config_state(self):
+        state = []
+        for path in self._config_files():
+            try:
+                state.append((path, os.path.getmtime(path)))
+            except OSError:
+                pass
+        return tuple(state)
+
+    def _read_config_files(self):
+        self._config_state = self._current_config_state()
+        entries = []
+        for path, _ in self._config_state:
+            with open(path, "r") as f:
+                config = json.load(f)
+            if isinstance(config, dict):
+                # Either {"tenants": [...]} or a single tenant entry
+                entries.extend(config["tenants"] if "tenants" in config else [config])
+            else:
+                entries.extend(config)
+        return entries
+
+    def _build(self):
+        fields = {}
+        for key, value in os.environ.items():
+            for prefix, attribute in ENV_PREFIXES.items():
+                if key.startswith(prefix):
+                    fields.setdefault(key[len(prefix):], {})[attribute] = value
+                    break
+
+        for entry in self._read_config_files():
+            business_number = str(entry["business_number"])
+            fields.setdefault(business_number, {}).update(
+                {k: v for k, v in entry.items() if k != "business_number"}
+            )
+
+        # Inbound messages are matched to a tenant by phone_number_id and replies
+        # are sent with its access token, so a tenant without both is unusable
+        tenants = []
+        for business_number, values in fields.items():
+            missing = [name for name in ("access_token", "phone_number_id") if not values.get(name)]
+            if missing:
+                logger.warning(f"Skipping tenant {business_number}: missing {', '.join(missing)}")
+                continue
+            tenants.append(Tenant(business_number, **values))
+        return _Snapshot(tenants, os.getenv("OPENAI_ASSISTANT_ID"))
+
+    def reload(self):
+        """Rebuild the registry and swap it in atomically"""
+        with self._reload_lock:
+            try:
+                snapshot = self._build()
+            except Exception as e:
+                logger.error(f"Error reloading tenant registry, keeping previous config: {str(e)}")
+                return False
+            self._snapshot = snapshot
+        logger.info(f"Tenant registry loaded {len(snapshot.tenants)} tenant(s)")
+        return True
+
+    def get(self, business_number):
+        return self._snapshot.by_business_number.get(business_number)
+
+    def by_phone_number_id(self, phone_number_id):
+        return self._snapshot.by_phone_number_id.get(phone_number_id)
+
+    def business_numbers(self):
+        return [t.business_number for t in self._snapshot.tenants]
+
+    def tenants(self):
+        return list(self._snapshot.tenants)
+
+    def app_secrets(self):
+        return self._snapshot.app_secrets
+
+    def assistant_id_for(self, business_number):
+        """Assistant for a business, falling back to OPENAI_ASSISTANT_ID or any configured assistant"""
+        snapshot = self._snapshot
+        tenant = snapshot.by_business_number.get(business_number)
+        if tenant and tenant.assistant_id:
+            return tenant.assistant_id
+        if snapshot.default_assistant_id:
+            return snapshot.default_assistant_id
+        for tenant in snapshot.tenants:
+            if tenant.assistant_id:
+                return tenant.assistant_id
+        return None
+
+    def start_watcher(self, interval=TENANTS_WATCH_INTERVAL):
+        """Poll the config files and reload when any of them changes"""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                if self._current_config_state() != self._config_state:
+                    logger.info("Tenant config changed, reloading tenants")
+                    self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="tenant-watcher", daemon=True)
+        self._watcher.start()
+
+    def install_sighup_handler(self):
+        """Reload on SIGHUP. Must be called from the main thread."""
+        try:
+            signal.signal(
+                signal.SIGHUP,
+                lambda signum, frame: threading.Thread(target=self.reload, daemon=True).start(),
+            )
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Could not install SIGHUP handler: {str(e)}")
+
+
+# Create a singleton instance
+tenant_registry = TenantRegistry()
@@ -0,0 +1,237 @@
+import logging
+import os
+import time
+
+from app.services.state_db import STATE_DB_PATH, connect
+
+logger = logging.getLogger(__name__)
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# prepared statement on every call instead of compiling it again
+_SELECT = "SELECT thread_id FROM threads WHERE business_number = ? AND user_id = ?"
+_UPSERT = (
+    "INSERT INTO threads (user_id, thread_id, business_number, updated_at, last_active) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (business_number, user_id) DO UPDATE SET thread_id = excluded.thread_id, "
+    "updated_at = excluded.updated_at, last_active = excluded.last_active"
+)
+# Same, but an unchanged mapping is only rewritten once its activity timestamp is stale
+_TOUCH = (
+    _UPSERT + " WHERE threads.thread_id != excluded.thread_id"
+    " OR threads.last_active < excluded.last_active - ?"
+)
+_DELETE = "DELETE FROM threads WHERE business_number = ? AND user_id = ?"
+# Mappings stored without a tenant (e.g. copied from the shelve files) are
+# taken over by the first tenant that looks the user up
+_ADOPT = "UPDATE threads SET business_number = ? WHERE business_number = '' AND user_id = ?"
+
+# Activity is recorded at most this often per user, to keep replies from writing on every message
+TOUCH_INTERVAL_SECONDS = int(os.getenv("THREAD_TOUCH_INTERVAL_SECONDS", "300"))
+
+# SQLite limits the number of ? placeholders in one statement
+_MAX_VARIABLES = 500
+
+
+def _tenant(business_number):
+    """Key column value for a tenant; mappings without one are stored under ''"""
+    return "" if business_number is None else str(business_number)
+
+
+class ThreadStore:
+    """
+    Maps WhatsApp users to their OpenAI thread IDs, per tenant: a user who
+    writes to two businesses has a separate thread with each.
+
+    The mapping lives in the shared state database (SQLite in WAL mode), so
+    all gunicorn worker processes read and write it concurrently without the
+    locking problems of a shelve file. Every thread of every process keeps
+    its own open connection, so a lookup is a single indexed SELECT.
+    put_many() writes a batch in one transaction.
+
+    Each mapping records when it was last used, so idle mappings can be
+    expired (see thread_sweeper.py).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or STATE_DB_PATH
+        self._init_schema()
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                user_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                business_number TEXT NOT NULL DEFAULT '',
+                updated_at REAL NOT NULL,
+                last_active REAL,
+                PRIMARY KEY (business_number, user_id)
+            )
+            """
+        )
+        # Tables created before activity tracking only have the first three columns
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+        if "business_number" not in columns:
+            conn.execute("ALTER TABLE threads ADD COLUMN business_number TEXT")
+        if "last_active" not in columns:
+            conn.execute("ALTER TABLE threads ADD COLUMN last_active REAL")
+            conn.execute("UPDATE threads SET last_active = updated_at")
+        # Tables created before per-tenant threads are keyed on user_id alone;
+        # each mapping moves to the tenant it was last used for
+        key = [row[1] for row in sorted(conn.execute("PRAGMA table_info(threads)"), key=lambda row: row[5]) if row[5]]
+        if key == ["user_id"]:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    """
+                    CREATE TABLE threads_by_tenant (
+                        user_id TEXT NOT NULL,
+                        thread_id TEXT NOT NULL,
+                        business_number TEXT NOT NULL DEFAULT '',
+                        updated_at REAL NOT NULL,
+                        last_active REAL,
+                        PRIMARY KEY (business_number, user_id)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    INSERT INTO threads_by_tenant (user_id, thread_id, business_number, updated_at, last_active)
+                    SELECT user_id, thread_id, COALESCE(business_number, ''), updated_at, last_active FROM threads
+                    """
+                )
+                conn.execute("DROP TABLE threads")
+                conn.execute("ALTER TABLE threads_by_tenant RENAME TO threads")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_active ON threads (last_active)")
+
+    def get(self, user_id, business_number=None):
+        tenant = _tenant(business_number)
+        conn = self._conn()
+        row = conn.execute(_SELECT, (tenant, str(user_id))).fetchone()
+        if row is None and tenant:
+            with conn:
+                if conn.execute(_ADOPT, (tenant, str(user_id))).rowcount:
+                    row = conn.execute(_SELECT, (tenant, str(user_id))).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, user_ids, business_number=None):
+        """Thread IDs for several users of a tenant at once, as a dict of the users that have one"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        found = {}
+        for start in range(0, len(user_ids), _MAX_VARIABLES):
+            batch = user_ids[start:start + _MAX_VARIABLES]
+            rows = self._conn().execute(
+                "SELECT user_id, thread_id FROM threads "
+                f"WHERE business_number = ? AND user_id IN ({', '.join('?' * len(batch))})",
+                [_tenant(business_number)] + batch,
+            )
+            found.update(rows)
+        return found
+
+    def put(self, user_id, thread_id, business_number=None):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(_UPSERT, (str(user_id), thread_id, _tenant(business_number), now, now))
+
+    def touch(self, user_id, thread_id, business_number=None, interval=TOUCH_INTERVAL_SECONDS):
+        """
+        Record activity on a mapping, storing it if it is missing or changed.
+        Skips the write when the mapping was touched less than interval seconds ago.
+        """
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(_TOUCH, (str(user_id), thread_id, _tenant(business_number), now, now, interval))
+
+    def put_many(self, mappings, business_number=None):
+        """Store (user_id, thread_id) pairs in a single transaction; returns how many were written"""
+        now = time.time()
+        tenant = _tenant(business_number)
+        rows = [(str(user_id), thread_id, tenant, now, now) for user_id, thread_id in mappings]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_UPSERT, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def delete(self, user_id, business_number=None):
+        with self._conn() as conn:
+            return conn.execute(_DELETE, (_tenant(business_number), str(user_id))).rowcount > 0
+
+    def expire(self, cutoff, limit, business_numbers=None, exclude=()):
+        """
+        Remove up to limit mappings idle since before cutoff. Returns them as
+        (user_id, thread_id) pairs, and the number of database pages that
+        removing them freed. business_numbers restricts the sweep to those
+        tenants; exclude skips tenants (e.g. those with their own TTL).
+        """
+        where = ["last_active < ?"]
+        params = [cutoff]
+        if business_numbers is not None:
+            where.append(f"business_number IN ({', '.join('?' * len(business_numbers))})")
+            params.extend(business_numbers)
+        if exclude:
+            where.append(f"business_number NOT IN ({', '.join('?' * len(exclude))})")
+            params.extend(exclude)
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            rows = conn.execute(
+                f"SELECT business_number, user_id, thread_id FROM threads WHERE {' AND '.join(where)} "
+                "ORDER BY last_active LIMIT ?",
+                params + [limit],
+            ).fetchall()
+            conn.executemany(_DELETE, [(tenant, user_id) for tenant, user_id, _ in rows])
+            freed = conn.execute("PRAGMA freelist_count").fetchone()[0] - free_before
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(user_id, thread_id) for _, user_id, thread_id in rows], max(0, freed)
+
+    def reclaim(self, pages):
+        """
+        Hand up to pages free pages back to the filesystem and return the bytes
+        reclaimed. Only the given number of pages is released, in one short
+        write, so the other tables' free space is left to SQLite to reuse.
+        Does nothing until the database uses incremental auto-vacuum (see
+        enable_incremental_vacuum).
+        """
+        conn = self._conn()
+        if pages <= 0 or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        # executescript runs the pragma to completion; execute() would free a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return max(0, before - conn.execute("PRAGMA page_count").fetchone()[0]) * page_size
+
+    def enable_incremental_vacuum(self):
+        """
+        Switch a database created before incremental auto-vacuum over to it.
+        This VACUUMs the whole shared database once, blocking every writer
+        while it runs, so do it while the bot is stopped. Returns False if the
+        database already used it.
+        """
+        conn = self._conn()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+
+
+# Create a singleton instance
+thread_store = ThreadStore()
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+
+from openai import NotFoundError
+
+from app.services.metrics import metrics
+from app.services.tenant_registry import tenant_registry
+from app.services.thread_store import thread_store
+
+logger = logging.getLogger(__name__)
+
+# Mappings idle for longer than this are dropped (0 keeps them forever);
+# override per tenant with THREAD_TTL_DAYS_<business_number> or "thread_ttl_days"
+THREAD_TTL_DAYS = float(os.getenv("THREAD_TTL_DAYS", "30"))
+# Also delete the expired thread on OpenAI's side
+THREAD_SWEEP_DELETE_REMOTE = os.getenv("THREAD_SWEEP_DELETE_REMOTE", "false").lower() == "true"
+THREAD_SWEEP_INTERVAL = float(os.getenv("THREAD_SWEEP_INTERVAL", "3600"))
+THREAD_SWEEP_BATCH_SIZE = int(os.getenv("THREAD_SWEEP_BATCH_SIZE", "500"))
+# Batches per tenant per sweep, so one sweep never holds the database for long
+THREAD_SWEEP_MAX_BATCHES = 20
+
+DAY_SECONDS = 24 * 3600
+
+
+class ThreadSweeper:
+    """
+    Expires user -> thread mappings that have been idle longer than their
+    tenant's TTL.
+
+    Each sweep removes mappings in bounded batches (oldest first), optionally
+    deletes the matching OpenAI threads, and hands the pages those deletes
+    freed back to the filesystem with an incremental vacuum. The shared
+    database is never VACUUMed as a whole, so jobs, outbox and webhook writes
+    are not locked out. A user whose mapping expired simply starts a new
+    thread with their next message.
+    """
+
+    def __init__(
+        self,
+        store=thread_store,
+        client=None,
+        default_ttl_days=THREAD_TTL_DAYS,
+        delete_remote=THREAD_SWEEP_DELETE_REMOTE,
+        batch_size=THREAD_SWEEP_BATCH_SIZE,
+        max_batches=THREAD_SWEEP_MAX_BATCHES,
+    ):
+        self.store = store
+        self._client = client
+        self.default_ttl_days = default_ttl_days
+        self.delete_remote = delete_remote
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.services.openai_service import client
+            self._client = client
+        return self._client
+
+    def _ttl_groups(self):
+        """(business numbers or None for everyone else, excluded business numbers, TTL in days)"""
+        overrides = {
+            tenant.business_number: tenant.thread_ttl_days
+            for tenant in tenant_registry.tenants()
+            if tenant.thread_ttl_days is not None
+        }
+        groups = [([business_number], (), ttl) for business_number, ttl in overrides.items()]
+        groups.append((None, tuple(overrides), self.default_ttl_days))
+        return groups
+
+    def _delete_remote(self, thread_ids):
+        from app.services.openai_service import count_api_call
+
+        deleted = 0
+        for thread_id in thread_ids:
+            try:
+                count_api_call("threads.delete")
+                self.client.beta.threads.delete(thread_id)
+                deleted += 1
+            except NotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error deleting expired thread {thread_id}: {str(e)}")
+        metrics.increment("threads_deleted_remote", deleted)
+        return deleted
+
+    def sweep(self, now=None):
+        """Run one sweep. Returns a summary dict."""
+        now = time.time() if now is None else now
+        expired = deleted = reclaimed = 0
+        for business_numbers, exclude, ttl_days in self._ttl_groups():
+            if not ttl_days or ttl_days <= 0:
+                continue
+            cutoff = now - ttl_days * DAY_SECONDS
+            for _ in range(self.max_batches):
+                rows, freed_pages = self.store.expire(cutoff, self.batch_size, business_numbers, exclude)
+                expired += len(rows)
+                # Only the space these mappings took; free pages left by other
+                # tables' churn are reused by SQLite
+                reclaimed += self.store.reclaim(freed_pages)
+                if self.delete_remote and rows:
+                    deleted += self._delete_remote(thread_id for _, thread_id in rows)
+                if len(rows) < self.batch_size:
+                    break
+        metrics.increment("thread_mappings_expired", expired)
+        metrics.increment("thread_store_bytes_reclaimed", reclaimed)
+
+        if expired or reclaimed:
+            logger.info(
+                f"Thread sweep: {expired} mappings expired, {deleted} remote threads deleted, "
+                f"{reclaimed / 1024:.1f} KiB reclaimed"
+            )
+        return {"expired": expired, "remote_deleted": deleted, "bytes_reclaimed": reclaimed}
+
+    def start(self, interval=THREAD_SWEEP_INTERVAL):
+        """Sweep every interval seconds on a background thread"""
+        if self._thread is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"Error sweeping thread mappings: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name="thread-sweeper", daemon=True)
+        self._thread.start()
+
+
+# Create a singleton instance
+thread_sweeper = ThreadSweeper()
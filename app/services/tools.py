@@ -0,0 +1,140 @@
+import inspect
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from app.services.knowledge_base import knowledge_base
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Threads shared by all tool calls, and how long one call may take
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+
+
+class Tool:
+    __slots__ = ("name", "function", "description", "parameters", "business_numbers", "wants_business_number")
+
+    def __init__(self, name, function, description, parameters, business_numbers=None):
+        self.name = name
+        self.function = function
+        self.description = description
+        self.parameters = parameters
+        self.business_numbers = set(business_numbers) if business_numbers else None
+        self.wants_business_number = "business_number" in inspect.signature(function).parameters
+
+    def available_to(self, business_number):
+        return self.business_numbers is None or business_number in self.business_numbers
+
+    def definition(self):
+        """Function tool definition for the Assistants API"""
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+class ToolRegistry:
+    """
+    Python functions the assistant can call while a run is in requires_action.
+
+    Tools are registered by name, optionally for specific business numbers.
+    A function that takes a business_number argument receives the tenant the
+    run belongs to. execute() runs all tool calls of a run concurrently on a
+    bounded thread pool and returns the outputs in the shape
+    submit_tool_outputs expects; failures are reported to the model as an
+    error output rather than raised.
+    """
+
+    def __init__(self, workers=TOOL_WORKERS, timeout=TOOL_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._tools = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool")
+
+    def register(self, name, function, description="", parameters=None, business_numbers=None):
+        self._tools[name] = Tool(
+            name,
+            function,
+            description,
+            parameters or {"type": "object", "properties": {}},
+            business_numbers,
+        )
+        return function
+
+    def tool(self, name=None, description="", parameters=None, business_numbers=None):
+        """Decorator form of register()"""
+        def decorator(function):
+            return self.register(
+                name or function.__name__,
+                function,
+                description or (function.__doc__ or "").strip(),
+                parameters,
+                business_numbers,
+            )
+        return decorator
+
+    def get(self, name, business_number=None):
+        tool = self._tools.get(name)
+        return tool if tool is not None and tool.available_to(business_number) else None
+
+    def definitions(self, business_number=None):
+        return [tool.definition() for tool in self._tools.values() if tool.available_to(business_number)]
+
+    def _call(self, tool_call, business_number):
+        started = time.monotonic()
+        name = tool_call.function.name
+        try:
+            tool = self.get(name, business_number)
+            if tool is None:
+                raise LookupError(f"Unknown tool {name!r}")
+            arguments = json.loads(tool_call.function.arguments or "{}")
+            if tool.wants_business_number:
+                arguments["business_number"] = business_number
+            result = tool.function(**arguments)
+            metrics.increment("tool_calls")
+            return result if isinstance(result, str) else json.dumps(result, default=str)
+        except Exception as e:
+            logger.error(f"Error in tool {name}: {str(e)}")
+            metrics.increment("tool_call_errors")
+            return json.dumps({"error": str(e)})
+        finally:
+            metrics.observe("tool_call_seconds", time.monotonic() - started)
+
+    def execute(self, tool_calls, business_number=None):
+        """
+        Run a batch of tool calls in parallel and return their tool_outputs.
+        """
+        futures = [
+            (tool_call.id, self._executor.submit(self._call, tool_call, business_number))
+            for tool_call in tool_calls
+        ]
+        deadline = time.monotonic() + self.timeout
+        outputs = []
+        for tool_call_id, future in futures:
+            try:
+                output = future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                logger.error(f"Tool call {tool_call_id} timed out")
+                metrics.increment("tool_call_errors")
+                output = json.dumps({"error": "The tool did not respond in time"})
+            outputs.append({"tool_call_id": tool_call_id, "output": output})
+        return outputs
+
+
+# Create a singleton instance
+tool_registry = ToolRegistry()
+
+
+@tool_registry.tool(
+    description="Search the company knowledge base and return the most relevant entries.",
+    parameters={
+        "type": "object",
+        "properties": {"query": {"type": "string", "description": "What to look up"}},
+        "required": ["query"],
+    },
+)
+def lookup_knowledge(query, business_number=None):
+    return {"results": knowledge_base.get_relevant_info(query, business_number)}
@@ -0,0 +1,96 @@
+import re
+
+# WhatsApp rejects text message bodies longer than this
+WHATSAPP_TEXT_LIMIT = 4096
+# Room kept free in every piece for the markers that close and reopen formatting
+MARKER_RESERVE = 16
+
+FENCE = "```"
+INLINE_MARKERS = "*_~"
+
+_SENTENCE_END = re.compile(r"[.!?…][*_~)\"'»]*\s")
+
+
+def _formatting_at(text, pos):
+    """
+    (inside a ``` block, inline markers still open) at text[pos], scanning
+    from the start. Inline formatting never spans a line break on WhatsApp,
+    and a marker only counts as open if the same line closes it later on.
+    """
+    in_fence = False
+    opened = []
+    i = 0
+    while i < pos:
+        if text.startswith(FENCE, i):
+            in_fence = not in_fence
+            i += len(FENCE)
+            continue
+        c = text[i]
+        if c == "\n":
+            opened = []
+        elif c in INLINE_MARKERS and not in_fence:
+            before = text[i - 1] if i else " "
+            after = text[i + 1] if i + 1 < len(text) else " "
+            if c in opened and not before.isspace():
+                del opened[opened.index(c):]
+            elif c not in opened and not after.isspace() and not before.isalnum():
+                opened.append(c)
+        i += 1
+
+    line_end = text.find("\n", pos)
+    rest = text[pos:] if line_end == -1 else text[pos:line_end]
+    opened = [c for c in opened if re.search(r"\S" + re.escape(c) + r"(?!\w)", rest)]
+    return in_fence, opened
+
+
+def _cut(text, start, end):
+    """Best place to end a piece that may run from start up to end"""
+    if end >= len(text):
+        return len(text)
+    window = text[start:end]
+    # Only take a boundary in the second half, so pieces are not needlessly short
+    floor = len(window) // 2
+
+    for separator in ("\n\n", "\n"):
+        at = window.rfind(separator)
+        if at > floor:
+            return start + at
+    sentences = [m.end() - 1 for m in _SENTENCE_END.finditer(window)]
+    if sentences and sentences[-1] > floor:
+        return start + sentences[-1]
+    at = max(window.rfind(" "), window.rfind("\t"))
+    if at > floor:
+        return start + at
+    return end
+
+
+def split_reply(text, limit=WHATSAPP_TEXT_LIMIT):
+    """
+    Split a reply into pieces of at most limit characters.
+
+    Pieces end at a paragraph break where possible, then a line break, a
+    sentence end, a space, and only as a last resort mid-word. Formatting
+    that is open at a cut (*bold*, _italic_, ~strike~ or a ``` block) is
+    closed at the end of the piece and reopened at the start of the next,
+    so every piece renders on its own.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    budget = limit - MARKER_RESERVE
+    pieces = []
+    prefix = ""
+    start = 0
+    while len(prefix) + len(text) - start > limit:
+        end = _cut(text, start, start + budget - len(prefix))
+        in_fence, opened = _formatting_at(text, end)
+        suffix = (FENCE if in_fence else "") + "".join(reversed(opened))
+        pieces.append(prefix + text[start:end].rstrip() + suffix)
+
+        prefix = "".join(opened) + (FENCE if in_fence else "")
+        start = end
+        # Whitespace at a cut is dropped, except the indentation of code
+        while start < len(text) and text[start].isspace() and (not in_fence or text[start] == "\n"):
+            start += 1
+    pieces.append(prefix + text[start:])
+    return [piece for piece in pieces if piece.strip()]
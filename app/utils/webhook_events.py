@@ -0,0 +1,126 @@
+import json
+
+
+class InboundEvent:
+    """
+    A single message or status extracted from a webhook payload.
+
+    Uses __slots__ to keep the per-event footprint small; events are created
+    for every delivery and passed through the whole pipeline, so nothing
+    downstream has to walk the raw payload again.
+    """
+
+    __slots__ = (
+        "kind",
+        "tenant_id",
+        "display_number",
+        "sender",
+        "name",
+        "message_id",
+        "type",
+        "text",
+        "timestamp",
+    )
+
+    def __init__(self, kind, tenant_id, display_number, sender, name, message_id, type, text, timestamp):
+        self.kind = kind  # "message" or "status"
+        self.tenant_id = tenant_id  # WhatsApp phone_number_id of the receiving business
+        self.display_number = display_number  # business display number, digits only
+        self.sender = sender  # wa_id of the user
+        self.name = name
+        self.message_id = message_id
+        self.type = type  # message type ("text", "image", ...) or status ("sent", "read", ...)
+        self.text = text
+        self.timestamp = timestamp
+
+    @property
+    def conversation(self):
+        """Key shared by the messages of one user to one business"""
+        return f"{self.tenant_id}:{self.sender}"
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{slot: data.get(slot) for slot in cls.__slots__})
+
+    def __repr__(self):
+        return f"InboundEvent({self.kind!r}, sender={self.sender!r}, message_id={self.message_id!r}, type={self.type!r})"
+
+
+def _message_text(message):
+    message_type = message.get("type")
+    if message_type == "text":
+        return (message.get("text") or {}).get("body")
+    if message_type == "button":
+        return (message.get("button") or {}).get("text")
+    if message_type == "interactive":
+        interactive = message.get("interactive") or {}
+        reply = interactive.get("button_reply") or interactive.get("list_reply") or {}
+        return reply.get("title")
+    return None
+
+
+def extract_work_items(body):
+    """
+    Walk a webhook payload once and return an InboundEvent for every message
+    and status it contains, across all entries and changes.
+
+    Meta may batch several entries, changes or messages into a single POST, so
+    nothing here assumes index 0.
+    """
+    items = []
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            metadata = value.get("metadata") or {}
+            tenant_id = metadata.get("phone_number_id")
+            display_number = "".join(filter(str.isdigit, metadata.get("display_phone_number") or ""))
+
+            names = {
+                contact.get("wa_id"): (contact.get("profile") or {}).get("name")
+                for contact in value.get("contacts") or []
+            }
+
+            for message in value.get("messages") or []:
+                sender = message.get("from")
+                items.append(
+                    InboundEvent(
+                        "message",
+                        tenant_id,
+                        display_number,
+                        sender,
+                        names.get(sender),
+                        message.get("id"),
+                        message.get("type"),
+                        _message_text(message),
+                        message.get("timestamp"),
+                    )
+                )
+
+            for status in value.get("statuses") or []:
+                items.append(
+                    InboundEvent(
+                        "status",
+                        tenant_id,
+                        display_number,
+                        status.get("recipient_id"),
+                        None,
+                        status.get("id"),
+                        status.get("status"),
+                        None,
+                        status.get("timestamp"),
+                    )
+                )
+    return items
+
+
+def parse_webhook(raw_body):
+    """
+    Decode the raw webhook bytes once and return the events they contain.
+    """
+    body = json.loads(raw_body)
+    if not isinstance(body, dict) or not body.get("object"):
+        return []
+    return extract_work_items(body)
@@ -3,8 +3,15 @@ import os
 import requests
 import json
 import re
-from flask import current_app, jsonify
-from app.services.openai_service import generate_response as openai_generate_response
+from flask import jsonify
+from app.services.dedupe import message_deduplicator
+from app.services.graph_client import graph_clients
+from app.services.llm_backends import generate_response as openai_generate_response
+from app.services.metrics import metrics
+from app.services.outbox import outbox
+from app.services.tenant_registry import tenant_registry
+from app.utils.reply_splitter import split_reply
+from app.utils.webhook_events import extract_work_items
 
 logger = logging.getLogger(__name__)
 
@@ -13,44 +20,37 @@ def get_business_number_from_webhook(body):
     try:
         # Get the phone number ID from the webhook
         phone_number_id = body["entry"][0]["changes"][0]["value"]["metadata"]["phone_number_id"]
-        
-        # Try to find matching business number by phone_number_id
-        for key in os.environ:
-            if key.startswith("WHATSAPP_PHONE_NUMBER_ID_"):
-                business_number = key.replace("WHATSAPP_PHONE_NUMBER_ID_", "")
-                if os.getenv(key) == phone_number_id:
-                    logger.info(f"Found business number {business_number} for phone_number_id {phone_number_id}")
-                    return business_number
-        
-        # If no match found, log available configurations
-        logger.warning(f"No business number found for phone_number_id: {phone_number_id}")
-        logger.info(f"Available business configurations: {list_configured_businesses()}")
-        
-        # Return the first configured business as fallback
-        businesses = list_configured_businesses()
-        if businesses:
-            logger.info(f"Using fallback business: {businesses[0]}")
-            return businesses[0]
-        
-        return None
-        
+        return get_business_number_for_phone_number_id(phone_number_id)
     except (KeyError, IndexError) as e:
         logger.error(f"Error extracting business number from webhook: {e}")
         logger.error(f"Webhook body structure: {json.dumps(body, indent=2)}")
         return None
 
+def get_business_number_for_phone_number_id(phone_number_id):
+    """
+    Map a WhatsApp phone_number_id to the configured business number, or None.
+    Messages for a number no tenant is configured with are rejected rather
+    than answered with another company's assistant and token.
+    """
+    tenant = tenant_registry.by_phone_number_id(phone_number_id)
+    if tenant:
+        return tenant.business_number
+
+    logger.warning(f"Rejecting message for unknown phone_number_id: {phone_number_id}")
+    logger.info(f"Available business configurations: {list_configured_businesses()}")
+    return None
+
 def validate_credentials(business_number):
     """Validate that all required credentials exist for a business number"""
     if not business_number:
         return False, "No business number provided"
     
-    access_token = os.getenv(f"WHATSAPP_ACCESS_TOKEN_{business_number}")
-    phone_number_id = os.getenv(f"WHATSAPP_PHONE_NUMBER_ID_{business_number}")
+    tenant = tenant_registry.get(business_number)
     
-    if not access_token:
+    if not tenant or not tenant.access_token:
         return False, f"Missing WHATSAPP_ACCESS_TOKEN_{business_number}"
     
-    if not phone_number_id:
+    if not tenant.phone_number_id:
         return False, f"Missing WHATSAPP_PHONE_NUMBER_ID_{business_number}"
     
     return True, "Credentials valid"
@@ -74,15 +74,6 @@ def send_whatsapp_message(to_number, message_text, business_number=None):
             logger.error(f"Credential validation failed: {error_msg}")
             return False
         
-        access_token = os.getenv(f"WHATSAPP_ACCESS_TOKEN_{business_number}")
-        phone_number_id = os.getenv(f"WHATSAPP_PHONE_NUMBER_ID_{business_number}")
-        version = os.getenv("VERSION", "v18.0")
-        
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {access_token}",
-        }
-        
         data = json.dumps({
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
@@ -91,9 +82,8 @@ def send_whatsapp_message(to_number, message_text, business_number=None):
             "text": {"preview_url": False, "body": message_text},
         })
         
-        url = f"https://graph.facebook.com/{version}/{phone_number_id}/messages"
-        
-        response = requests.post(url, data=data, headers=headers)
+        # Pooled keep-alive connection for this tenant
+        response = graph_clients.get(business_number).send(data)
         
         if response.status_code == 200:
             logger.info(f"Message sent successfully to {to_number} via business {business_number}")
@@ -140,19 +130,10 @@ def send_message(data, business_number=None):
             logger.error(f"Credential validation failed: {error_msg}")
             return jsonify({"status": "error", "message": error_msg}), 500
 
-        access_token = os.getenv(f"WHATSAPP_ACCESS_TOKEN_{business_number}")
-        phone_number_id = os.getenv(f"WHATSAPP_PHONE_NUMBER_ID_{business_number}")
-        version = os.getenv("VERSION", "v18.0")
+        graph = graph_clients.get(business_number)
+        logger.info(f"Sending message to URL: {graph.messages_url} for business {business_number}")
 
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {access_token}",
-        }
-
-        url = f"https://graph.facebook.com/{version}/{phone_number_id}/messages"
-        logger.info(f"Sending message to URL: {url} for business {business_number}")
-
-        response = requests.post(url, data=data, headers=headers, timeout=10)
+        response = graph.send(data)
         if response.status_code != 200:
             logger.error(f"Failed to send message. Status: {response.status_code}, Response: {response.text}")
             return jsonify({"status": "error", "message": f"Failed to send message: {response.text}"}), response.status_code
@@ -185,62 +166,135 @@ def process_text_for_whatsapp(text):
     return whatsapp_style_text
 
 def process_whatsapp_message(body):
-    try:
-        wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-        name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
-        
-        # Get the business number from the webhook
-        business_number = get_business_number_from_webhook(body)
-        
-        if not business_number:
-            logger.error("Could not determine business number from webhook")
-            logger.error(f"Available businesses: {list_configured_businesses()}")
-            return False
-        
-        logging.info(f"Processing message from {name} ({wa_id}) for business {business_number}")
+    """Process every message contained in a webhook payload"""
+    events = [event for event in extract_work_items(body) if event.kind == "message"]
+    if not events:
+        logger.error("No messages found in webhook body")
+        return False
+    return all([process_work_item(event) for event in events])
 
-        message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-        message_body = message["text"]["body"]
-        logging.info(f"Message content: {message_body}")
+def process_work_item(event):
+    """Generate and send the reply for a single inbound message event"""
+    return process_conversation([event])
 
-        # Generate response using OpenAI Assistant with business number
-        response = openai_generate_response(message_body, wa_id, name, business_number)
-        logging.info(f"OpenAI response: {response}")
-        
-        response = process_text_for_whatsapp(response)
-        logging.info(f"Processed response for WhatsApp: {response}")
+def prepare_conversation(events):
+    """
+    Sort a batch of messages from one user into what still needs a run.
 
-        data = get_text_message_input(wa_id, response)
-        result = send_message(data, business_number)
-        
-        return True
-        
-    except (KeyError, IndexError) as e:
+    Messages whose reply was already queued or sent are skipped, and a retried
+    message that already has a stored reply gets it resent instead of running
+    the assistant again. Returns (business number, wa_id, name, messages to
+    answer); business number is None if the tenant is unknown.
+    """
+    wa_id = events[-1].sender
+    name = events[-1].name or f"User_{wa_id[-4:]}"
+
+    # Get the business number from the webhook
+    business_number = get_business_number_for_phone_number_id(events[-1].tenant_id)
+    if not business_number:
+        logger.error("Could not determine business number from webhook")
+        logger.error(f"Available businesses: {list_configured_businesses()}")
+        return None, wa_id, name, []
+
+    logging.info(f"Processing {len(events)} message(s) from {name} ({wa_id}) for business {business_number}")
+
+    pending = []
+    for event in events:
+        status, response = message_deduplicator.get(event.message_id) if event.message_id else (None, None)
+        if status in ("queued", "sent"):
+            logging.info(f"Reply for message {event.message_id} was already {status}, skipping")
+        elif response is not None:
+            logging.info(f"Reusing stored reply for message {event.message_id}")
+            send_reply(wa_id, response, business_number, [event.message_id])
+        elif event.text is None:
+            logger.info(f"Ignoring unsupported message type: {event.type}")
+        else:
+            logging.info(f"Message content: {event.text}")
+            pending.append(event)
+    return business_number, wa_id, name, pending
+
+
+def process_conversation(events):
+    """
+    Run the assistant once for a batch of messages from the same user and
+    send the reply. The job queue hands a user's messages out together and
+    one batch at a time, so rapid-fire messages become a single run.
+    """
+    try:
+        business_number, wa_id, name, pending = prepare_conversation(events)
+    except (KeyError, IndexError, TypeError) as e:
         logger.error(f"Error processing WhatsApp message: {e}")
-        logger.error(f"Message body: {json.dumps(body, indent=2)}")
+        logger.error(f"Events: {events!r}")
         return False
+    if not business_number:
+        return False
+    if not pending:
+        return True
+
+    if len(pending) > 1:
+        logger.info(f"Coalesced {len(pending)} messages from {wa_id} into one run")
+    message_body = "\n".join(event.text for event in pending)
+
+    # Generate response using OpenAI Assistant with business number
+    response = openai_generate_response(message_body, wa_id, name, business_number)
+    logging.info(f"OpenAI response: {response}")
+
+    message_ids = [event.message_id for event in pending]
+    for message_id in message_ids:
+        message_deduplicator.record_reply(message_id, response)
+
+    return send_reply(wa_id, response, business_number, message_ids)
+
+BUSY_REPLY = "We're receiving a lot of messages right now. Please try again shortly."
+
+def shed_conversation(events):
+    """
+    Answer a batch of messages from the same user with a single fast busy
+    reply instead of running the assistant.
+    """
+    business_number = get_business_number_for_phone_number_id(events[-1].tenant_id)
+    message_ids = [
+        event.message_id
+        for event in events
+        if event.message_id and message_deduplicator.get(event.message_id)[0] not in ("queued", "sent")
+    ]
+    if not business_number or not message_ids:
+        return False
+    for message_id in message_ids:
+        message_deduplicator.record_reply(message_id, BUSY_REPLY)
+    return send_reply(events[-1].sender, BUSY_REPLY, business_number, message_ids)
+
+def send_reply(wa_id, response, business_number, message_ids):
+    """
+    Format a reply, split it at WhatsApp's length limit and hand the parts to
+    the outbox, which sends them and marks the messages it answers as sent.
+    Returns without waiting for the send.
+    """
+    response = process_text_for_whatsapp(response)
+    logging.info(f"Processed response for WhatsApp: {response}")
+
+    # Long answers are sent as several messages, in order
+    parts = split_reply(response)
+    if len(parts) > 1:
+        logging.info(f"Reply of {len(response)} characters split into {len(parts)} messages")
+        metrics.increment("replies_split")
+
+    outbox.enqueue_many(business_number, wa_id, [get_text_message_input(wa_id, part) for part in parts], message_ids)
+    for message_id in message_ids:
+        message_deduplicator.mark_queued(message_id)
+    return True
 
 def is_valid_whatsapp_message(body):
     """
-    Check if the incoming webhook event has a valid WhatsApp message structure.
+    Check if the incoming webhook event contains at least one WhatsApp message.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
+    return bool(body.get("object")) and any(
+        event.kind == "message" for event in extract_work_items(body)
     )
 
 def list_configured_businesses():
     """Helper function to list all configured business numbers"""
-    businesses = []
-    for key in os.environ:
-        if key.startswith("WHATSAPP_ACCESS_TOKEN_"):
-            business_number = key.replace("WHATSAPP_ACCESS_TOKEN_", "")
-            businesses.append(business_number)
-    return businesses
+    return tenant_registry.business_numbers()
 
 def debug_credentials():
     """Debug function to check credential configuration"""
@@ -248,8 +302,9 @@ def debug_credentials():
     logger.info(f"Found {len(businesses)} configured businesses: {businesses}")
     
     for business in businesses:
-        token = os.getenv(f"WHATSAPP_ACCESS_TOKEN_{business}")
-        phone_id = os.getenv(f"WHATSAPP_PHONE_NUMBER_ID_{business}")
+        tenant = tenant_registry.get(business)
+        token = tenant.access_token
+        phone_id = tenant.phone_number_id
         
         token_status = "✓" if token else "✗"
         phone_status = "✓" if phone_id else "✗"
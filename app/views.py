@@ -1,13 +1,12 @@
 import logging
-import json
 
 from flask import Blueprint, request, jsonify, current_app
 
 from .decorators.security import signature_required
-from .utils.whatsapp_utils import (
-    process_whatsapp_message,
-    is_valid_whatsapp_message,
-)
+from .services.dedupe import message_deduplicator
+from .services.job_queue import job_queue
+from .services.metrics import metrics
+from .utils.webhook_events import parse_webhook
 
 webhook_blueprint = Blueprint("webhook", __name__)
 
@@ -17,56 +16,57 @@ def handle_message():
     Handle incoming webhook events from the WhatsApp API.
 
     This function processes incoming WhatsApp messages and other events,
-    such as delivery statuses. If the event is a valid message, it gets
-    processed. If the incoming payload is not a recognized WhatsApp event,
-    an error is returned.
+    such as delivery statuses. If the event is a valid message, it is written
+    to the durable job queue and the webhook is acknowledged straight away;
+    the reply is generated later by the job workers. If the incoming payload
+    is not a recognized WhatsApp event, an error is returned.
 
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
 
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
-    body = request.get_json()
-    logging.info(f"Received webhook body: {json.dumps(body, indent=2)}")
-    
-    # Check if it's a WhatsApp status update
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("Received a WhatsApp status update.")
+    # Reuse the raw bytes already read by the signature check and decode them once
+    raw_body = request.get_data()
+    logging.debug("Received webhook body: %s", raw_body)
+    try:
+        events = parse_webhook(raw_body)
+    except ValueError:
+        logging.error("Failed to decode JSON")
+        return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
+
+    statuses = [event for event in events if event.kind == "status"]
+    if statuses:
+        logging.info(f"Received {len(statuses)} WhatsApp status update(s).")
+
+    messages = []
+    for event in events:
+        if event.kind != "message":
+            continue
+        logging.info(f"Received message from: {event.sender}")
+        if event.sender == event.display_number:  # Ignore messages from our own number
+            logging.info("Ignoring message from our own number")
+            continue
+        # Meta redelivers webhooks it thinks we missed; drop those up front
+        if not message_deduplicator.claim(event.message_id):
+            logging.info(f"Ignoring duplicate delivery of message {event.message_id}")
+            continue
+        messages.append(event)
+
+    if messages:
+        # One job per message; a user's messages are handed out together, one batch at a time
+        try:
+            job_ids = job_queue.enqueue_many(
+                [event.to_dict() for event in messages], [event.conversation for event in messages]
+            )
+        except Exception:
+            # Let Meta redeliver rather than losing the messages
+            for event in messages:
+                message_deduplicator.release(event.message_id)
+            raise
+        logging.info(f"Queued {len(messages)} WhatsApp message(s) as jobs {job_ids}")
         return jsonify({"status": "ok"}), 200
 
-    # Check if it's a message from a user (not a status update)
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("messages")
-    ):
-        message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-        from_number = message.get("from")
-        logging.info(f"Received message from: {from_number}")
-        
-        # Get the bot's number from metadata
-        bot_number = body["entry"][0]["changes"][0]["value"]["metadata"]["display_phone_number"].replace("+", "")
-        
-        if from_number != bot_number:  # Ignore messages from our own number
-            try:
-                if is_valid_whatsapp_message(body):
-                    logging.info("Processing valid WhatsApp message")
-                    process_whatsapp_message(body)
-                    return jsonify({"status": "ok"}), 200
-                else:
-                    logging.info("Invalid WhatsApp message format")
-            except json.JSONDecodeError:
-                logging.error("Failed to decode JSON")
-                return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
-        else:
-            logging.info("Ignoring message from our own number")
-    
     # If it's not a status update or a valid user message, return ok but don't process
     logging.info("No valid message to process")
     return jsonify({"status": "ok"}), 200
@@ -105,3 +105,7 @@ def webhook_post():
     return handle_message()
 
 
+
+@webhook_blueprint.route("/metrics", methods=["GET"])
+def metrics_get():
+    return jsonify(metrics.snapshot()), 200
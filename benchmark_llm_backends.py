@@ -0,0 +1,58 @@
+"""
+Compare reply latency of the LLM backends (Assistants runs versus Chat
+Completions with local history) against the local stand-in server
+(mock_openai_server.py). Both backends see the same model time per reply,
+so the difference is the overhead of each API shape.
+
+Usage: python benchmark_llm_backends.py [users] [messages_per_user] [model_seconds]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+from mock_openai_server import start_in_background
+
+PORT = 8089
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def measure(backend, users, messages_per_user):
+    latencies = []
+    for turn in range(messages_per_user):
+        for user in range(users):
+            started = time.monotonic()
+            backend.generate_response(f"question {turn}", f"44700900{user:04d}")
+            latencies.append(time.monotonic() - started)
+    return latencies
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    messages_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    model_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{PORT}/v1",
+        OPENAI_API_KEY="benchmark",
+        OPENAI_ASSISTANT_ID="asst_benchmark",
+    )
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    start_in_background(PORT, model_seconds)
+
+    from app.services.llm_backends import BACKENDS
+
+    print(f"{users} users x {messages_per_user} messages, {model_seconds:.2f}s model time per reply")
+    print(f"{'backend':<12}{'p50 (s)':>10}{'p95 (s)':>10}{'overhead p50 (s)':>20}")
+    for name, backend in BACKENDS.items():
+        latencies = measure(backend, users, messages_per_user)
+        p50 = percentile(latencies, 0.50)
+        print(f"{name:<12}{p50:>10.3f}{percentile(latencies, 0.95):>10.3f}{p50 - model_seconds:>20.3f}")
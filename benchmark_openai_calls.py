@@ -0,0 +1,96 @@
+"""
+Count OpenAI API calls per reply: the old call sequence versus the current
+generate_response, both against the local stand-in server
+(mock_openai_server.py), so no OpenAI account is needed.
+
+The old sequence per reply was threads.retrieve (or threads.create),
+messages.create, assistants.retrieve, runs.create, one runs.retrieve per
+second until the run completes, and messages.list.
+
+Usage: python benchmark_openai_calls.py [users] [messages_per_user]
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+import warnings
+
+from mock_openai_server import start_in_background
+
+PORT = 8089
+RUN_SECONDS = 0.3
+
+
+def server_stats(reset=False):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{PORT}/stats" + ("/reset" if reset else ""),
+        method="POST" if reset else "GET",
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def legacy_generate_response(client, threads, message, user_id, assistant_id):
+    thread_id = threads.get(user_id)
+    if thread_id:
+        client.beta.threads.retrieve(thread_id)
+    else:
+        thread_id = threads[user_id] = client.beta.threads.create().id
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message)
+    client.beta.assistants.retrieve(assistant_id)
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    while client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id).status != "completed":
+        time.sleep(1)
+    messages = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
+    return messages.data[0].content[0].text.value
+
+
+def measure(label, reply, users, messages_per_user):
+    server_stats(reset=True)
+    started = time.monotonic()
+    for turn in range(messages_per_user):
+        for user in range(users):
+            reply(f"question {turn}", f"44700900{user:04d}")
+    elapsed = time.monotonic() - started
+    stats = server_stats()
+    replies = users * messages_per_user
+    calls = sum(stats.values())
+    print(f"{label}")
+    print(f"  API calls per reply:  {calls / replies:6.2f}  ({', '.join(f'{k} {v}' for k, v in sorted(stats.items()))})")
+    print(f"  Seconds per reply:    {elapsed / replies:6.2f}")
+    return calls / replies
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    messages_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{PORT}/v1",
+        OPENAI_API_KEY="benchmark",
+        OPENAI_ASSISTANT_ID="asst_benchmark",
+    )
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    start_in_background(PORT, RUN_SECONDS)
+
+    from app.services.openai_service import client, generate_response
+
+    legacy_threads = {}
+    legacy = measure(
+        "Old call sequence (1s polling)",
+        lambda message, user_id: legacy_generate_response(client, legacy_threads, message, user_id, "asst_benchmark"),
+        users,
+        messages_per_user,
+    )
+    current = measure(
+        "generate_response",
+        lambda message, user_id: generate_response(message, user_id),
+        users,
+        messages_per_user,
+    )
+    print(f"Calls saved per reply:  {legacy - current:6.2f}")
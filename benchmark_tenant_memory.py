@@ -0,0 +1,91 @@
+"""
+Measure memory per tenant: one shared multi-tenant server versus one
+server process per company (the old companies/<name>/ copies).
+
+Each measurement runs in a fresh interpreter that loads N generated tenant
+configs from a temporary TENANTS_DIR, builds the Flask app with create_app(),
+creates every tenant's Graph API client and session, and reports its
+resident set size.
+
+Usage: python benchmark_tenant_memory.py [tenant_count]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def rss_kib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmRSS not available on this platform")
+
+
+def child(tenant_count):
+    workdir = tempfile.mkdtemp()
+    tenants_dir = os.path.join(workdir, "tenants")
+    os.makedirs(tenants_dir)
+    for i in range(tenant_count):
+        with open(os.path.join(tenants_dir, f"tenant_{i}.json"), "w") as f:
+            json.dump(
+                {
+                    "business_number": f"44700900{i:04d}",
+                    "phone_number_id": f"10000000{i:04d}",
+                    "access_token": f"token-{i}",
+                    "assistant_id": f"asst_{i}",
+                },
+                f,
+            )
+
+    os.chdir(workdir)
+    os.environ.update(
+        TENANTS_DIR=tenants_dir,
+        STATE_DB_PATH=os.path.join(workdir, "state.db"),
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "benchmark"),
+        APP_SECRET="benchmark",
+    )
+
+    from app import create_app
+    from app.services.graph_client import graph_clients
+    from app.services.tenant_registry import tenant_registry
+
+    create_app()
+    assert len(tenant_registry.tenants()) == tenant_count
+    # A tenant in service holds its own Graph client, session and connection pool
+    for business_number in tenant_registry.business_numbers():
+        graph_clients.get(business_number)
+    print(rss_kib())
+
+
+def measure(tenant_count):
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=repo_root)
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", str(tenant_count)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return int(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        child(int(sys.argv[2]))
+        sys.exit(0)
+
+    tenant_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    single = measure(1)
+    shared = measure(tenant_count)
+    per_copy_total = single * tenant_count
+
+    print(f"Tenants:                      {tenant_count}")
+    print(f"One process per tenant:       {per_copy_total / 1024:8.1f} MiB total, {single / 1024:6.1f} MiB per tenant")
+    print(f"Shared multi-tenant process:  {shared / 1024:8.1f} MiB total, {shared / tenant_count / 1024:6.1f} MiB per tenant")
+    print(f"Marginal cost of a tenant:    {(shared - single) / max(tenant_count - 1, 1):8.1f} KiB")
+    print(f"Saved:                        {(per_copy_total - shared) / 1024:8.1f} MiB")
@@ -0,0 +1,111 @@
+"""
+Benchmark the user -> thread mapping store under concurrent worker processes.
+
+Compares the old approach (open the shelve file on every lookup and store)
+with the SQLite ThreadStore. Each worker process does a mix of lookups and
+stores for its own users, like gunicorn workers handling messages, then
+reads its mappings back to count writes that were lost along the way.
+
+Usage: python benchmark_thread_store.py [workers] [operations_per_worker]
+"""
+import multiprocessing
+import os
+import random
+import shelve
+import sys
+import tempfile
+import time
+
+WRITE_RATIO = 0.1
+USERS_PER_WORKER = 200
+
+
+class ShelveStore:
+    """The previous storage: a shelve file opened and closed for every call"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, user_id):
+        with shelve.open(self.path) as shelf:
+            return shelf.get(str(user_id))
+
+    def put(self, user_id, thread_id):
+        with shelve.open(self.path) as shelf:
+            shelf[str(user_id)] = thread_id
+
+
+def open_store(kind, workdir):
+    if kind == "shelve":
+        return ShelveStore(os.path.join(workdir, "threads.db"))
+    from app.services.thread_store import ThreadStore
+    return ThreadStore(os.path.join(workdir, "state.db"))
+
+
+def worker(kind, workdir, worker_id, operations, start_barrier, results):
+    store = open_store(kind, workdir)
+    rng = random.Random(worker_id)
+    users = [f"44{worker_id:03d}{i:07d}" for i in range(USERS_PER_WORKER)]
+    expected = {}
+    errors = 0
+
+    start_barrier.wait()
+    started = time.perf_counter()
+    for i in range(operations):
+        user_id = rng.choice(users)
+        try:
+            if rng.random() < WRITE_RATIO:
+                thread_id = f"thread_{worker_id}_{i}"
+                store.put(user_id, thread_id)
+                expected[user_id] = thread_id
+            else:
+                store.get(user_id)
+        except Exception:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    lost = 0
+    for user_id, thread_id in expected.items():
+        try:
+            lost += store.get(user_id) != thread_id
+        except Exception:
+            lost += 1
+    results.put((operations, elapsed, errors, lost))
+
+
+def run(kind, workers, operations):
+    workdir = tempfile.mkdtemp(prefix=f"thread-store-{kind}-")
+    open_store(kind, workdir)  # create the file and schema up front
+
+    start_barrier = multiprocessing.Barrier(workers)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(kind, workdir, i, operations, start_barrier, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    done = sum(t[0] for t in totals)
+    wall = max(t[1] for t in totals)
+    errors = sum(t[2] for t in totals)
+    lost = sum(t[3] for t in totals)
+    return done / wall, errors, lost
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    print(f"{workers} worker processes, {operations} operations each, {WRITE_RATIO:.0%} writes")
+    print(f"{'store':<8} {'ops/sec':>10} {'errors':>8} {'lost writes':>12}")
+    for kind in ("shelve", "sqlite"):
+        rate, errors, lost = run(kind, workers, operations)
+        print(f"{kind:<8} {rate:>10.0f} {errors:>8} {lost:>12}")
+
+
+if __name__ == "__main__":
+    main()
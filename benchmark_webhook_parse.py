@@ -0,0 +1,125 @@
+"""
+Benchmark the per-request CPU cost of webhook parsing.
+
+Compares the previous approach (decode + re-encode the body for the HMAC
+check, a second JSON parse via get_json(), pretty-printing the body into the
+log and walking entry[0].changes[0].value repeatedly) with the single-parse
+InboundEvent path used by the webhook now.
+
+Usage: python benchmark_webhook_parse.py [iterations]
+"""
+import hashlib
+import hmac
+import json
+import sys
+import time
+
+from app.utils.webhook_events import parse_webhook
+
+APP_SECRET = "benchmark-secret"
+
+SAMPLE_BODY = json.dumps(
+    {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "102290129340398",
+                "changes": [
+                    {
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {
+                                "display_phone_number": "447464177761",
+                                "phone_number_id": "627065630497964",
+                            },
+                            "contacts": [{"profile": {"name": "Jane Doe"}, "wa_id": "447700900123"}],
+                            "messages": [
+                                {
+                                    "from": "447700900123",
+                                    "id": "wamid.HBgMNDQ3NzAwOTAwMTIzFQIAEhgUM0VCMDVDRjI0RDM3QjU0QjQ1NUIA",
+                                    "timestamp": "1700000000",
+                                    "text": {"body": "Hi, what are your business hours?"},
+                                    "type": "text",
+                                }
+                            ],
+                        },
+                        "field": "messages",
+                    }
+                ],
+            }
+        ],
+    }
+).encode("utf-8")
+
+SIGNATURE = hmac.new(APP_SECRET.encode("latin-1"), SAMPLE_BODY, hashlib.sha256).hexdigest()
+
+
+def legacy_request(raw_body):
+    # signature_required: decode the bytes, then validate_signature re-encodes them
+    payload = raw_body.decode("utf-8")
+    expected = hmac.new(bytes(APP_SECRET, "latin-1"), msg=payload.encode("utf-8"), digestmod=hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(expected, SIGNATURE)
+
+    # handle_message: get_json() parses the body a second time and logs it pretty-printed
+    body = json.loads(raw_body)
+    json.dumps(body, indent=2)
+
+    # handle_message status / message checks
+    body.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {}).get("statuses")
+    body.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {}).get("messages")
+    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
+    from_number = message.get("from")
+    bot_number = body["entry"][0]["changes"][0]["value"]["metadata"]["display_phone_number"].replace("+", "")
+    assert from_number != bot_number
+
+    # is_valid_whatsapp_message
+    assert (
+        body.get("object")
+        and body.get("entry")
+        and body["entry"][0].get("changes")
+        and body["entry"][0]["changes"][0].get("value")
+        and body["entry"][0]["changes"][0]["value"].get("messages")
+        and body["entry"][0]["changes"][0]["value"]["messages"][0]
+    )
+
+    # process_whatsapp_message + get_business_number_from_webhook
+    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
+    name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
+    phone_number_id = body["entry"][0]["changes"][0]["value"]["metadata"]["phone_number_id"]
+    message_body = body["entry"][0]["changes"][0]["value"]["messages"][0]["text"]["body"]
+    return wa_id, name, phone_number_id, message_body
+
+
+def current_request(raw_body):
+    # signature_required hashes the cached bytes directly
+    expected = hmac.new(bytes(APP_SECRET, "latin-1"), msg=raw_body, digestmod=hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(expected, SIGNATURE)
+
+    # handle_message decodes once into events and queues them
+    events = parse_webhook(raw_body)
+    payloads = [event.to_dict() for event in events if event.kind == "message"]
+    event = events[0]
+    return event.sender, event.name, event.tenant_id, event.text, payloads
+
+
+def measure(fn, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(SAMPLE_BODY)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    # Warm up
+    measure(legacy_request, 1000)
+    measure(current_request, 1000)
+
+    legacy_us = measure(legacy_request, iterations)
+    current_us = measure(current_request, iterations)
+
+    print(f"Iterations:     {iterations}")
+    print(f"Legacy parse:   {legacy_us:8.2f} us CPU/request")
+    print(f"Single parse:   {current_us:8.2f} us CPU/request")
+    print(f"Saved:          {legacy_us - current_us:8.2f} us CPU/request ({(1 - current_us / legacy_us) * 100:.1f}%)")
@@ -0,0 +1,47 @@
+"""
+Build the local embedding indexes used when KNOWLEDGE_RETRIEVER=embeddings.
+
+Writes one memory-mapped index for KNOWLEDGE_BUSINESS_NUMBER (knowledge_base.json
+and the default documents) and one per business that has its own
+KNOWLEDGE_DIR/<business_number>/ directory, then tells the running bots to
+reload them.
+
+Usage: python build_embedding_index.py [--embedder hashing|openai] [--quantize]
+"""
+import argparse
+import logging
+import os
+
+from app.services.answer_cache import invalidate_knowledge
+from app.services.embedding_index import EMBEDDER, EmbeddingIndex, get_embedder
+from app.services.knowledge_base import KNOWLEDGE_BUSINESS_NUMBER, KNOWLEDGE_DIR, knowledge_base
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--embedder", default=EMBEDDER, help="hashing (offline) or openai")
+    parser.add_argument("--quantize", action="store_true", help="store int8 vectors (4x smaller)")
+    args = parser.parse_args()
+
+    embedder = get_embedder(args.embedder)
+    businesses = {KNOWLEDGE_BUSINESS_NUMBER}
+    if os.path.isdir(KNOWLEDGE_DIR):
+        businesses.update(
+            name for name in os.listdir(KNOWLEDGE_DIR) if os.path.isdir(os.path.join(KNOWLEDGE_DIR, name))
+        )
+
+    for business_number in sorted(businesses):
+        path = knowledge_base.embedding_index_path(business_number)
+        index = EmbeddingIndex.build(path, knowledge_base.chunks(business_number), embedder, args.quantize)
+        size = os.path.getsize(os.path.join(path, "vectors.npy"))
+        print(f"{business_number}: {len(index)} chunks, {size / 1024:.1f} KiB of vectors -> {path}")
+
+    # Running workers drop their indexes and map the new files
+    invalidate_knowledge()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
 bind = "0.0.0.0:10000"
 workers = 2
 threads = 4
-timeout = 120 
\ No newline at end of file
+timeout = 120
+
+
+def post_worker_init(worker):
+    # Open the Graph API connections before the first reply needs them
+    from app.services.graph_client import graph_clients
+    graph_clients.prewarm()
@@ -0,0 +1,66 @@
+"""
+Copy user -> thread mappings from the old shelve files into the SQLite thread store.
+
+Reads threads.db (the app) and threads_db (the quickstart) when they exist,
+or the shelve files given on the command line. Mappings already in the
+thread store are newer than the shelve copy and are kept unless --overwrite
+is given. Safe to run more than once; the shelve files are left untouched.
+The copied mappings have no business yet; each is taken over by the first
+business the user writes to.
+
+Usage: python migrate_threads.py [--overwrite] [shelve_path ...]
+"""
+import argparse
+import dbm
+import logging
+import shelve
+
+from app.services.thread_store import thread_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_SHELVES = ["threads.db", "threads_db"]
+BATCH_SIZE = 1000
+
+
+def read_shelf(path):
+    """(user_id, thread_id) pairs from a shelve file, or None if there is no such file"""
+    if dbm.whichdb(path) is None:
+        return None
+    with shelve.open(path, flag="r") as shelf:
+        return [(str(user_id), shelf[user_id]) for user_id in shelf.keys()]
+
+
+def migrate(mappings, overwrite=False):
+    """Write mappings to the thread store in batches; returns (written, skipped)"""
+    written = skipped = 0
+    for start in range(0, len(mappings), BATCH_SIZE):
+        batch = mappings[start:start + BATCH_SIZE]
+        if not overwrite:
+            existing = thread_store.get_many(user_id for user_id, _ in batch)
+            skipped += sum(1 for user_id, _ in batch if user_id in existing)
+            batch = [(user_id, thread_id) for user_id, thread_id in batch if user_id not in existing]
+        written += thread_store.put_many(batch)
+    return written, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=DEFAULT_SHELVES, help="shelve files to migrate")
+    parser.add_argument("--overwrite", action="store_true", help="replace mappings already in the thread store")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        mappings = read_shelf(path)
+        if mappings is None:
+            print(f"{path}: not found, skipped")
+            continue
+        written, skipped = migrate(mappings, args.overwrite)
+        print(f"{path}: {len(mappings)} mappings, {written} written, {skipped} already present")
+
+    print(f"Thread store {thread_store.path} now holds {len(thread_store)} mappings")
+
+
+if __name__ == "__main__":
+    main()
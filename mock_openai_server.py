@@ -0,0 +1,377 @@
+"""
+Local stand-in for the OpenAI Assistants API, for benchmarks and manual testing.
+
+Implements the thread, message, run, assistant and chat completion
+endpoints the bot uses, including streamed runs (server-sent events). Every
+run and chat completion takes RUN_SECONDS and replies with an echo of the
+last user message. A message of the form "/tool <name> <json arguments>"
+makes the run require that function call and reply with the submitted
+output. Like the real API, a thread accepts one active run at a time and
+runs can be listed and cancelled. Requests are counted per endpoint; GET /stats returns the counts and POST /stats/reset
+clears them.
+
+Usage:
+    python mock_openai_server.py [port]
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 flask run
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web
+
+RUN_SECONDS = float(os.getenv("MOCK_RUN_SECONDS", "1.2"))
+ACTIVE_STATUSES = ("queued", "in_progress", "requires_action")
+
+_ids = itertools.count(1)
+
+
+def new_id(prefix):
+    return f"{prefix}_{next(_ids):08d}"
+
+
+class MockAssistantsAPI:
+    def __init__(self, run_seconds=RUN_SECONDS):
+        self.run_seconds = run_seconds
+        self.threads = {}
+        self.runs = {}
+        self.stats = Counter()
+
+    # Objects
+
+    def _thread(self, thread_id):
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}, "tool_resources": {}}
+
+    def _message(self, thread_id, role, text, run_id=None, assistant_id=None):
+        message = {
+            "id": new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "assistant_id": assistant_id,
+            "run_id": run_id,
+            "attachments": [],
+            "metadata": {},
+            "status": "completed",
+        }
+        self.threads[thread_id].append(message)
+        return message
+
+    def _advance(self, run):
+        if run["status"] in ("queued", "in_progress") and time.monotonic() >= run["done_at"]:
+            if run["tool_call"] is not None:
+                run["status"] = "requires_action"
+            else:
+                self._complete(run)
+
+    def _run(self, run):
+        self._advance(run)
+        data = {
+            "id": run["id"],
+            "object": "thread.run",
+            "created_at": run["created_at"],
+            "thread_id": run["thread_id"],
+            "assistant_id": run["assistant_id"],
+            "status": run["status"],
+            "model": "mock",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+            "parallel_tool_calls": True,
+        }
+        if run["status"] == "requires_action":
+            data["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": [run["tool_call"]]},
+            }
+        return data
+
+    def _last_user_message(self, thread_id):
+        history = [m for m in self.threads[thread_id] if m["role"] == "user"]
+        return history[-1]["content"][0]["text"]["value"] if history else ""
+
+    def _complete(self, run):
+        if run["status"] == "completed":
+            return run["reply"]
+        if run["tool_output"] is not None:
+            text = f"Tool output: {run['tool_output']}"
+        else:
+            text = f"Echo: {self._last_user_message(run['thread_id'])}"
+        run["reply"] = self._message(run["thread_id"], "assistant", text, run["id"], run["assistant_id"])
+        run["status"] = "completed"
+        return run["reply"]
+
+    def _start_run(self, thread_id, assistant_id):
+        # "/tool <name> <json arguments>" makes the run call that function tool
+        tool_call = None
+        last = self._last_user_message(thread_id)
+        if last.startswith("/tool "):
+            _, name, *arguments = last.split(" ", 2)
+            tool_call = {
+                "id": new_id("call"),
+                "type": "function",
+                "function": {"name": name, "arguments": arguments[0] if arguments else "{}"},
+            }
+        run = {
+            "id": new_id("run"),
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "status": "queued",
+            "created_at": int(time.time()),
+            "done_at": time.monotonic() + self.run_seconds,
+            "reply": None,
+            "tool_call": tool_call,
+            "tool_output": None,
+        }
+        self.runs[run["id"]] = run
+        return run
+
+    def _active_runs(self, thread_id):
+        for run in self.runs.values():
+            if run["thread_id"] == thread_id:
+                self._advance(run)
+                if run["status"] in ACTIVE_STATUSES:
+                    yield run
+
+    def _not_found(self, kind, object_id):
+        return web.json_response(
+            {"error": {"message": f"No {kind} found with id '{object_id}'.", "type": "invalid_request_error"}},
+            status=404,
+        )
+
+    async def _respond_run(self, request, run, stream, new_thread=False):
+        if not stream:
+            return web.json_response(self._run(run))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(event, data):
+            await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+        if new_thread:
+            await send("thread.created", self._thread(run["thread_id"]))
+        if run["status"] == "queued":
+            await send("thread.run.created", self._run(run))
+        await asyncio.sleep(max(0, run["done_at"] - time.monotonic()))
+        self._advance(run)
+        if run["status"] == "requires_action":
+            await send("thread.run.requires_action", self._run(run))
+        else:
+            await send("thread.message.completed", self._complete(run))
+            await send("thread.run.completed", self._run(run))
+        await response.write(b"event: done\ndata: [DONE]\n\n")
+        return response
+
+    # Handlers
+
+    def count(self, endpoint):
+        self.stats[endpoint] += 1
+
+    async def get_assistant(self, request):
+        self.count("assistants.retrieve")
+        assistant_id = request.match_info["assistant_id"]
+        return web.json_response({
+            "id": assistant_id, "object": "assistant", "created_at": 0, "name": "mock",
+            "model": "mock", "instructions": "Mock assistant", "tools": [], "metadata": {},
+        })
+
+    async def create_thread(self, request):
+        self.count("threads.create")
+        body = await request.json() if request.can_read_body else {}
+        thread_id = new_id("thread")
+        self.threads[thread_id] = []
+        for message in body.get("messages") or []:
+            self._message(thread_id, message["role"], message["content"])
+        return web.json_response(self._thread(thread_id))
+
+    async def get_thread(self, request):
+        self.count("threads.retrieve")
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            return self._not_found("thread", thread_id)
+        return web.json_response(self._thread(thread_id))
+
+    async def delete_thread(self, request):
+        self.count("threads.delete")
+        thread_id = request.match_info["thread_id"]
+        if self.threads.pop(thread_id, None) is None:
+            return self._not_found("thread", thread_id)
+        return web.json_response({"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    async def create_message(self, request):
+        self.count("messages.create")
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            return self._not_found("thread", thread_id)
+        body = await request.json()
+        return web.json_response(self._message(thread_id, body["role"], body["content"]))
+
+    async def list_messages(self, request):
+        self.count("messages.list")
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            return self._not_found("thread", thread_id)
+        messages = list(self.threads[thread_id])
+        run_id = request.query.get("run_id")
+        if run_id:
+            messages = [m for m in messages if m["run_id"] == run_id]
+        if request.query.get("order", "desc") == "desc":
+            messages.reverse()
+        messages = messages[:int(request.query.get("limit", "20"))]
+        return web.json_response({
+            "object": "list",
+            "data": messages,
+            "first_id": messages[0]["id"] if messages else None,
+            "last_id": messages[-1]["id"] if messages else None,
+            "has_more": False,
+        })
+
+    async def create_run(self, request):
+        self.count("runs.create")
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            return self._not_found("thread", thread_id)
+        body = await request.json()
+        for run in self._active_runs(thread_id):
+            return web.json_response(
+                {"error": {"message": f"Thread {thread_id} already has an active run {run['id']}.", "type": "invalid_request_error"}},
+                status=400,
+            )
+        for message in body.get("additional_messages") or []:
+            self._message(thread_id, message["role"], message["content"])
+        run = self._start_run(thread_id, body["assistant_id"])
+        return await self._respond_run(request, run, body.get("stream"))
+
+    async def create_thread_and_run(self, request):
+        self.count("threads.create_and_run")
+        body = await request.json()
+        thread_id = new_id("thread")
+        self.threads[thread_id] = []
+        for message in (body.get("thread") or {}).get("messages", []):
+            self._message(thread_id, message["role"], message["content"])
+        run = self._start_run(thread_id, body["assistant_id"])
+        return await self._respond_run(request, run, body.get("stream"), new_thread=True)
+
+    async def get_run(self, request):
+        self.count("runs.retrieve")
+        run = self.runs.get(request.match_info["run_id"])
+        if run is None:
+            return self._not_found("run", request.match_info["run_id"])
+        return web.json_response(self._run(run))
+
+    async def list_runs(self, request):
+        self.count("runs.list")
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            return self._not_found("thread", thread_id)
+        runs = [self._run(run) for run in self.runs.values() if run["thread_id"] == thread_id]
+        runs.reverse()
+        return web.json_response({
+            "object": "list",
+            "data": runs,
+            "first_id": runs[0]["id"] if runs else None,
+            "last_id": runs[-1]["id"] if runs else None,
+            "has_more": False,
+        })
+
+    async def cancel_run(self, request):
+        self.count("runs.cancel")
+        run = self.runs.get(request.match_info["run_id"])
+        if run is None:
+            return self._not_found("run", request.match_info["run_id"])
+        self._advance(run)
+        if run["status"] not in ACTIVE_STATUSES:
+            return web.json_response(
+                {"error": {"message": f"Cannot cancel run with status '{run['status']}'.", "type": "invalid_request_error"}},
+                status=400,
+            )
+        run["status"] = "cancelled"
+        return web.json_response(self._run(run))
+
+    async def create_chat_completion(self, request):
+        self.count("chat.completions.create")
+        body = await request.json()
+        await asyncio.sleep(self.run_seconds)
+        last = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        return web.json_response({
+            "id": new_id("chatcmpl"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": f"Echo: {last}"},
+            }],
+        })
+
+    async def submit_tool_outputs(self, request):
+        self.count("runs.submit_tool_outputs")
+        run = self.runs.get(request.match_info["run_id"])
+        if run is None:
+            return self._not_found("run", request.match_info["run_id"])
+        self._advance(run)
+        if run["status"] != "requires_action":
+            return web.json_response(
+                {"error": {"message": f"Runs in status {run['status']} do not accept tool outputs.", "type": "invalid_request_error"}},
+                status=400,
+            )
+        body = await request.json()
+        run["tool_output"] = body["tool_outputs"][0]["output"]
+        run["tool_call"] = None
+        run["status"] = "in_progress"
+        run["done_at"] = time.monotonic() + self.run_seconds
+        return await self._respond_run(request, run, body.get("stream"))
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    async def reset_stats(self, request):
+        self.stats.clear()
+        return web.json_response({})
+
+
+def create_mock_app(run_seconds=RUN_SECONDS):
+    api = MockAssistantsAPI(run_seconds)
+    app = web.Application()
+    app["api"] = api
+    app.router.add_get("/v1/assistants/{assistant_id}", api.get_assistant)
+    app.router.add_post("/v1/threads", api.create_thread)
+    app.router.add_post("/v1/threads/runs", api.create_thread_and_run)
+    app.router.add_get("/v1/threads/{thread_id}", api.get_thread)
+    app.router.add_delete("/v1/threads/{thread_id}", api.delete_thread)
+    app.router.add_post("/v1/threads/{thread_id}/messages", api.create_message)
+    app.router.add_get("/v1/threads/{thread_id}/messages", api.list_messages)
+    app.router.add_post("/v1/threads/{thread_id}/runs", api.create_run)
+    app.router.add_get("/v1/threads/{thread_id}/runs", api.list_runs)
+    app.router.add_get("/v1/threads/{thread_id}/runs/{run_id}", api.get_run)
+    app.router.add_post("/v1/threads/{thread_id}/runs/{run_id}/cancel", api.cancel_run)
+    app.router.add_post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs", api.submit_tool_outputs)
+    app.router.add_post("/v1/chat/completions", api.create_chat_completion)
+    app.router.add_get("/stats", api.get_stats)
+    app.router.add_post("/stats/reset", api.reset_stats)
+    return app
+
+
+def start_in_background(port=8089, run_seconds=RUN_SECONDS):
+    """Serve the mock from a daemon thread; returns the MockAssistantsAPI (for its stats)"""
+    app = create_mock_app(run_seconds)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, name="mock-openai", daemon=True).start()
+    return app["api"]
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    web.run_app(create_mock_app(), host="127.0.0.1", port=port)
@@ -0,0 +1,59 @@
+"""
+Send an approved template message to every recipient in a CSV or NDJSON list.
+
+Progress is checkpointed in the state database under the campaign id, so
+re-running the same command after a crash or a pause continues where it
+stopped without messaging anyone twice.
+
+Usage:
+    python run_broadcast.py recipients.csv --business 447464177761 --template spring_offer
+        [--language en] [--campaign spring-2026] [--concurrency 32] [--wait-for-quota]
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+from app.services.broadcast import BROADCAST_CONCURRENCY, BroadcastEngine, CampaignStore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+
+def print_report(campaign_id, stats):
+    print(
+        f"[{campaign_id}] sent {stats['sent']} failed {stats['failed']} | "
+        f"{stats['sent_per_second']} sent/s, error rate {stats['error_rate']:.1%}"
+        + (f" | {stats['status']}" if "status" in stats else ""),
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recipients", help="CSV with a 'to' column, or NDJSON with 'to' and 'parameters'")
+    parser.add_argument("--business", required=True, help="business number to send from")
+    parser.add_argument("--template", required=True, help="approved template name")
+    parser.add_argument("--language", default="en", help="template language code")
+    parser.add_argument("--campaign", help="campaign id (default: <list name>-<template>)")
+    parser.add_argument("--concurrency", type=int, default=BROADCAST_CONCURRENCY, help="requests in flight")
+    parser.add_argument("--wait-for-quota", action="store_true", help="wait out the 24h messaging limit instead of pausing")
+    args = parser.parse_args()
+
+    campaign_id = args.campaign or f"{os.path.splitext(os.path.basename(args.recipients))[0]}-{args.template}"
+    store = CampaignStore()
+    engine = BroadcastEngine(store, concurrency=args.concurrency, on_report=print_report)
+    asyncio.run(
+        engine.run(campaign_id, args.recipients, args.business, args.template, args.language, args.wait_for_quota)
+    )
+
+    progress = store.progress(campaign_id)
+    print(f"[{campaign_id}] totals: {progress}")
+    if progress.get("sending"):
+        print(f"[{campaign_id}] {progress['sending']} sends were interrupted and are unconfirmed; they will not be retried")
+    if progress.get("unknown"):
+        print(f"[{campaign_id}] {progress['unknown']} sends timed out or lost their response and are unconfirmed; they will not be retried")
+
+
+if __name__ == "__main__":
+    main()
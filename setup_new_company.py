@@ -1,6 +1,5 @@
 import os
 import json
-import shutil
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
@@ -10,50 +9,35 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def setup_new_company(company_name, company_info_file, meta_token=None, meta_phone_id=None):
+def setup_new_company(company_name, company_info_file, business_number, meta_token, meta_phone_id):
     """
-    Set up a new company instance with its own configuration
+    Set up a new company as a tenant of the shared multi-tenant server
+    
+    Creates the company's assistant and knowledge base, then writes a tenant
+    config entry to tenants/<company>.json. The running server picks the new
+    file up automatically; nothing is copied or deployed separately.
     
     Args:
         company_name (str): Name of the company
         company_info_file (str): Path to the company's information file
-        meta_token (str, optional): Meta Business API token
-        meta_phone_id (str, optional): Meta Phone Number ID
+        business_number (str): WhatsApp business display number; identifies
+            the tenant in its config, metrics and per-tenant settings
+        meta_token (str): Meta Business API token; replies are sent with it
+        meta_phone_id (str): Meta Phone Number ID; inbound webhooks are
+            matched to the tenant by it
     """
-    try:
-        # Create company directory
-        company_dir = f"companies/{company_name.lower().replace(' ', '_')}"
-        os.makedirs(company_dir, exist_ok=True)
-        
-        # Copy template files
-        template_files = [
-            'app',
-            'start',
-            'requirements.txt',
-            'gunicorn.conf.py',
-            'render.yaml'
-        ]
-        
-        for file in template_files:
-            if os.path.isdir(file):
-                shutil.copytree(file, f"{company_dir}/{file}", dirs_exist_ok=True)
-            else:
-                shutil.copy2(file, f"{company_dir}/{file}")
-        
-        # Create company-specific .env file
-        env_template = """
-# OpenAI Configuration
-OPENAI_API_KEY={openai_api_key}
-OPENAI_ASSISTANT_ID={assistant_id}
-
-# Meta WhatsApp Configuration
-META_TOKEN={meta_token}
-META_PHONE_ID={meta_phone_id}
+    # Checked before anything is created on OpenAI's side
+    business_number = "".join(c for c in str(business_number or "") if c.isdigit())
+    if not business_number:
+        raise ValueError("A WhatsApp business number is required")
+    if not meta_token or not meta_phone_id:
+        raise ValueError("A Meta Business API token and Phone Number ID are required")
 
-# Company Configuration
-COMPANY_NAME={company_name}
-COMPANY_INFO_FILE={company_info_file}
-"""
+    try:
+        company_slug = company_name.lower().replace(' ', '_')
+        tenants_dir = os.getenv("TENANTS_DIR", "tenants")
+        os.makedirs(tenants_dir, exist_ok=True)
+        tenant_file = os.path.join(tenants_dir, f"{company_slug}.json")
         
         # Create new assistant for the company
         client = OpenAI(default_headers={"OpenAI-Beta": "assistants=v2"})
@@ -87,52 +71,28 @@ COMPANY_INFO_FILE={company_info_file}
             tools=[{"type": "file_search", "vector_store_ids": [str(vector_store.id)]}]
         )
         
-        # Write .env file
-        with open(f"{company_dir}/.env", 'w') as f:
-            f.write(env_template.format(
-                openai_api_key=os.getenv('OPENAI_API_KEY'),
-                assistant_id=assistant.id,
-                meta_token=meta_token or os.getenv('META_TOKEN'),
-                meta_phone_id=meta_phone_id or os.getenv('META_PHONE_ID'),
-                company_name=company_name,
-                company_info_file=company_info_file
-            ))
-        
-        # Create setup instructions
-        setup_instructions = f"""
-# Setup Instructions for {company_name}
-
-1. Environment Setup:
-   - Navigate to {company_dir}
-   - Copy .env.example to .env and fill in the values
-   - Install dependencies: pip install -r requirements.txt
-
-2. Meta WhatsApp Setup:
-   - Create a Meta Business account if not already done
-   - Set up WhatsApp Business API
-   - Update META_TOKEN and META_PHONE_ID in .env
-
-3. Deployment:
-   - Update render.yaml with company-specific settings
-   - Deploy to Render.com or your preferred platform
-
-4. Testing:
-   - Run test_assistant.py to verify assistant responses
-   - Test WhatsApp integration using the provided phone number
-
-For support, contact: support@infobot.tech
-"""
+        # Write the tenant config entry
+        tenant = {
+            "business_number": business_number,
+            "name": company_name,
+            "phone_number_id": meta_phone_id,
+            "access_token": meta_token,
+            "assistant_id": assistant.id,
+            "vector_store_id": vector_store.id,
+            "company_info_file": company_info_file,
+            "created_at": datetime.now().isoformat(),
+        }
         
-        with open(f"{company_dir}/SETUP.md", 'w') as f:
-            f.write(setup_instructions)
+        with open(tenant_file, 'w') as f:
+            json.dump(tenant, f, indent=4)
         
-        logger.info(f"Successfully set up new company instance for {company_name}")
-        logger.info(f"Company directory: {company_dir}")
+        logger.info(f"Successfully set up new tenant for {company_name}")
+        logger.info(f"Tenant config: {tenant_file}")
         logger.info(f"Assistant ID: {assistant.id}")
         logger.info(f"Vector Store ID: {vector_store.id}")
         
         return {
-            "company_dir": company_dir,
+            "tenant_file": tenant_file,
             "assistant_id": assistant.id,
             "vector_store_id": vector_store.id
         }
@@ -147,7 +107,8 @@ if __name__ == "__main__":
     # Example usage
     company_name = input("Enter company name: ")
     company_info_file = input("Enter path to company info file: ")
-    meta_token = input("Enter Meta Business API token (optional): ") or None
-    meta_phone_id = input("Enter Meta Phone Number ID (optional): ") or None
+    business_number = input("Enter WhatsApp business number (required): ")
+    meta_token = input("Enter Meta Business API token (required): ") or os.getenv('META_TOKEN')
+    meta_phone_id = input("Enter Meta Phone Number ID (required): ") or os.getenv('META_PHONE_ID')
     
-    setup_new_company(company_name, company_info_file, meta_token, meta_phone_id) 
\ No newline at end of file
+    setup_new_company(company_name, company_info_file, business_number, meta_token, meta_phone_id) 
\ No newline at end of file
@@ -2,11 +2,16 @@ from flask import Flask, request, jsonify
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from dotenv import load_dotenv
 
 # Import your OpenAI assistant functions
 from openai_assistant import generate_response
 
+# Shared webhook extractor (run from the repository root so `app` is importable)
+from app.utils.webhook_events import extract_work_items
+
 # Map WhatsApp business numbers to OpenAI Assistant IDs AND Phone Number IDs
 # IMPORTANT: Replace these with your ACTUAL Phone Number IDs from Facebook Developer Console
 WHATSAPP_TO_ASSISTANT = {
@@ -34,6 +39,9 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Messages batched into one webhook delivery are processed concurrently
+message_executor = ThreadPoolExecutor(max_workers=8)
+
 def get_assistant_config(business_number):
     """
     Get the appropriate assistant configuration for a given business number
@@ -56,117 +64,99 @@ def process_whatsapp_message(webhook_data):
     Process incoming WhatsApp message from webhook
     """
     try:
-        # Extract the entry data
-        entries = webhook_data.get("entry", [])
+        # Extract every message across all entries and changes in one pass
+        events = [
+            event for event in extract_work_items(webhook_data)
+            if event.kind == "message"
+        ]
+        logger.info(f"📦 Webhook contains {len(events)} message(s)")
         
-        for entry in entries:
-            changes = entry.get("changes", [])
-            
-            for change in changes:
-                value = change.get("value", {})
-                
-                # Check if this is a message (not a status update)
-                if "messages" in value:
-                    messages = value.get("messages", [])
-                    contacts = value.get("contacts", [])
-                    metadata = value.get("metadata", {})
-                    
-                    # Get business phone number from metadata
-                    business_number = metadata.get("display_phone_number")
-                    
-                    logger.info(f"📱 Raw business number from metadata: {business_number}")
-                    
-                    # Remove any formatting (keep only digits)
-                    if business_number:
-                        business_number = ''.join(filter(str.isdigit, business_number))
-                    
-                    logger.info(f"📱 Cleaned business number: {business_number}")
-                    
-                    for message in messages:
-                        sender_number = message.get("from")
-                        message_id = message.get("id")
-                        message_type = message.get("type")
-                        timestamp = message.get("timestamp")
-                        
-                        logger.info(f"👤 Processing message from: {sender_number}")
-                        logger.info(f"🏢 Business number: {business_number}")
-                        logger.info(f"📝 Message type: {message_type}")
-                        
-                        # Check if this is NOT from our business number
-                        if sender_number != business_number:
-                            # Get sender's name if available
-                            sender_name = None
-                            for contact in contacts:
-                                if contact.get("wa_id") == sender_number:
-                                    sender_name = contact.get("profile", {}).get("name")
-                                    break
-                            
-                            if not sender_name:
-                                sender_name = f"User_{sender_number[-4:]}"  # Use last 4 digits as name
-                            
-                            # Get the appropriate assistant configuration for this business number
-                            config = get_assistant_config(business_number)
-                            
-                            # Process different message types
-                            if message_type == "text":
-                                text_body = message.get("text", {}).get("body", "")
-                                logger.info(f"💬 Text message: {text_body}")
-                                
-                                # Generate response using OpenAI Assistant
-                                response = generate_response(
-                                    message_body=text_body,
-                                    wa_id=sender_number,
-                                    name=sender_name,
-                                    assistant_id=config["assistant_id"]
-                                )
-                                
-                                # Send response back to user using the correct phone number ID
-                                logger.info(f"📤 About to send response using phone_number_id: {config['phone_number_id']}")
-                                send_whatsapp_message(
-                                    to_number=sender_number, 
-                                    message_text=response, 
-                                    phone_number_id=config["phone_number_id"]
-                                )
-                                
-                            elif message_type == "image":
-                                logger.info("🖼️ Received image message")
-                                response = generate_response(
-                                    message_body="I received an image. How can I help you with it?",
-                                    wa_id=sender_number,
-                                    name=sender_name,
-                                    assistant_id=config["assistant_id"]
-                                )
-                                send_whatsapp_message(
-                                    to_number=sender_number, 
-                                    message_text=response, 
-                                    phone_number_id=config["phone_number_id"]
-                                )
-                                
-                            else:
-                                logger.info(f"❓ Received unsupported message type: {message_type}")
-                                response = "I received your message but I can only respond to text messages at the moment."
-                                send_whatsapp_message(
-                                    to_number=sender_number, 
-                                    message_text=response, 
-                                    phone_number_id=config["phone_number_id"]
-                                )
-                        else:
-                            logger.info("🤖 Ignoring message from our own business number")
+        # Dispatch the messages concurrently
+        list(message_executor.map(process_message_item, events))
                 
     except Exception as e:
         logger.error(f"💥 Error processing WhatsApp message: {str(e)}")
         raise
 
 
+def process_message_item(event):
+    """
+    Generate and send the reply for a single inbound message event
+    """
+    sender_number = event.sender
+    business_number = event.display_number
+    message_type = event.type
+    
+    logger.info(f"👤 Processing message from: {sender_number}")
+    logger.info(f"🏢 Business number: {business_number}")
+    logger.info(f"📝 Message type: {message_type}")
+    
+    # Check if this is NOT from our business number
+    if sender_number == business_number:
+        logger.info("🤖 Ignoring message from our own business number")
+        return
+    
+    # Get sender's name if available
+    sender_name = event.name or f"User_{sender_number[-4:]}"  # Use last 4 digits as name
+    
+    # Get the appropriate assistant configuration for this business number
+    config = get_assistant_config(business_number)
+    
+    # Process different message types
+    if message_type == "text":
+        text_body = event.text or ""
+        logger.info(f"💬 Text message: {text_body}")
+        
+        # Generate response using OpenAI Assistant
+        response = generate_response(
+            message_body=text_body,
+            wa_id=sender_number,
+            name=sender_name,
+            assistant_id=config["assistant_id"]
+        )
+        
+        # Send response back to user using the correct phone number ID
+        logger.info(f"📤 About to send response using phone_number_id: {config['phone_number_id']}")
+        send_whatsapp_message(
+            to_number=sender_number, 
+            message_text=response, 
+            phone_number_id=config["phone_number_id"]
+        )
+        
+    elif message_type == "image":
+        logger.info("🖼️ Received image message")
+        response = generate_response(
+            message_body="I received an image. How can I help you with it?",
+            wa_id=sender_number,
+            name=sender_name,
+            assistant_id=config["assistant_id"]
+        )
+        send_whatsapp_message(
+            to_number=sender_number, 
+            message_text=response, 
+            phone_number_id=config["phone_number_id"]
+        )
+        
+    else:
+        logger.info(f"❓ Received unsupported message type: {message_type}")
+        response = "I received your message but I can only respond to text messages at the moment."
+        send_whatsapp_message(
+            to_number=sender_number, 
+            message_text=response, 
+            phone_number_id=config["phone_number_id"]
+        )
+
+
+# Reused for every send so replies keep the connection to graph.facebook.com alive
+graph_session = requests.Session()
+
+
 def send_whatsapp_message(to_number, message_text, phone_number_id):
     """
     Send a WhatsApp message using the WhatsApp Business API
     Updated to use the specific phone_number_id for each WhatsApp number
     """
     try:
-        # Import requests here to avoid circular imports
-        import requests
-        
         # WhatsApp Business API endpoint - now using the passed phone_number_id
         access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
         
@@ -203,7 +193,7 @@ def send_whatsapp_message(to_number, message_text, phone_number_id):
         
         logger.info(f"📦 Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = graph_session.post(url, headers=headers, json=payload, timeout=10)
         
         logger.info(f"📊 Response status: {response.status_code}")
         logger.info(f"📊 Response body: {response.text}")
@@ -0,0 +1,48 @@
+"""
+Expire idle user -> thread mappings now instead of waiting for the background sweeper.
+
+Uses the same TTLs as the bot (THREAD_TTL_DAYS and the per-tenant
+thread_ttl_days). Handy from cron when THREAD_SWEEP_INTERVAL=0.
+
+--enable-incremental-vacuum switches a state database created before
+incremental auto-vacuum over to it, so expired mappings give their space back.
+It VACUUMs the whole database once; run it while the bot is stopped.
+
+Usage: python sweep_threads.py [--delete-remote] [--enable-incremental-vacuum]
+"""
+import argparse
+import logging
+
+from app.services.thread_store import thread_store
+from app.services.thread_sweeper import thread_sweeper
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--delete-remote", action="store_true", help="also delete the expired OpenAI threads")
+    parser.add_argument(
+        "--enable-incremental-vacuum", action="store_true", help="one-time VACUUM to enable incremental auto-vacuum"
+    )
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        if thread_store.enable_incremental_vacuum():
+            print(f"{thread_store.path} now uses incremental auto-vacuum")
+        else:
+            print(f"{thread_store.path} already uses incremental auto-vacuum")
+
+    if args.delete_remote:
+        thread_sweeper.delete_remote = True
+    before = len(thread_store)
+    result = thread_sweeper.sweep()
+    print(
+        f"{result['expired']} of {before} mappings expired, {result['remote_deleted']} remote threads deleted, "
+        f"{result['bytes_reclaimed'] / 1024:.1f} KiB reclaimed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ from openai import OpenAI
 from dotenv import load_dotenv
 import logging
 
+from app.services.assistant_cache import invalidate_assistant
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,6 +36,9 @@ def update_instructions():
 Remember: Your primary source of information is the attached file. Do not use any other knowledge or make assumptions."""
         )
         
+        # Make running bots pick up the change instead of serving cached metadata and answers
+        invalidate_assistant(assistant_id)
+        
         logger.info(f"Assistant instructions updated successfully!")
         logger.info(f"Assistant ID: {updated_assistant.id}")
         logger.info(f"Assistant name: {updated_assistant.name}")
@@ -0,0 +1,52 @@
+import os
+import sys
+from openai import OpenAI
+from dotenv import load_dotenv
+import logging
+
+from app.services.assistant_cache import invalidate_assistant
+from app.services.tenant_registry import tenant_registry
+from app.services.tools import tool_registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+def update_tools(business_number=None):
+    """
+    Give the assistant the function tools registered in app/services/tools.py,
+    keeping its other tools (file search, code interpreter) as they are.
+    """
+    try:
+        # Initialize OpenAI client
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        assistant_id = tenant_registry.assistant_id_for(business_number)
+        
+        if not assistant_id:
+            raise ValueError("No OpenAI Assistant ID found in environment variables")
+        
+        assistant = client.beta.assistants.retrieve(assistant_id)
+        tools = [tool.model_dump(exclude_none=True) for tool in assistant.tools if tool.type != "function"]
+        tools += tool_registry.definitions(business_number)
+        
+        updated_assistant = client.beta.assistants.update(
+            assistant_id=assistant_id,
+            tools=tools
+        )
+        
+        # Make running bots pick up the change instead of serving cached metadata and answers
+        invalidate_assistant(assistant_id)
+        
+        logger.info(f"Assistant tools updated successfully!")
+        logger.info(f"Assistant ID: {updated_assistant.id}")
+        logger.info(f"Assistant tools: {updated_assistant.tools}")
+        
+    except Exception as e:
+        logger.error(f"Error updating assistant tools: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    update_tools(sys.argv[1] if len(sys.argv) > 1 else None)